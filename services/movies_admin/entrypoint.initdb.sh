@@ -65,4 +65,7 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
     CREATE UNIQUE INDEX film_work_genre ON content.genre_film_work (film_work_id, genre_id);
     CREATE UNIQUE INDEX film_work_person_role ON content.person_film_work (film_work_id, person_id, role);
     CREATE UNIQUE INDEX film_work_file ON content.file_film_work (film_work_id, file_id);
+    CREATE INDEX film_work_modified_id ON content.film_work (modified, id);
+    CREATE INDEX person_modified_id ON content.person (modified, id);
+    CREATE INDEX genre_modified_id ON content.genre (modified, id);
 EOSQL
@@ -54,6 +54,8 @@ class AuthRequired:
         self.condition = condition
         self.token_optional = token_optional
         self.permissions_optional = permissions_optional
+        # The query is sent as is with every request, so Auth service compiles it once
+        self._permissions_param = json.dumps(self._get_permissions_query())
 
     async def __call__(self, request: Request,
                        bearer_info: HTTPAuthorizationCredentials = Depends(_http_bearer),
@@ -74,7 +76,7 @@ class AuthRequired:
             params = None
         else:
             url = AUTH_PERMISSIONS_AND_TOKEN_VALIDATION_URL.format(user_id=user_id)
-            params = {'permissions': json.dumps(self._get_permissions_query())}
+            params = {'permissions': self._permissions_param}
 
         try:
             auth_response = await client.get(url, params=params, token=token)
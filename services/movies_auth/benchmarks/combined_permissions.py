@@ -0,0 +1,106 @@
+"""
+Compares the resolution of the combined permissions of a user with many roles:
+one query per role (the former N+1 pattern), the single UNION query of the User model
+and the cached result reused by permissions_required.
+
+Run from services/movies_auth against a migrated database and Redis:
+    PYTHONPATH=src python benchmarks/combined_permissions.py --roles 50 --permissions 20
+"""
+import argparse
+import time
+import uuid
+
+from sqlalchemy import event
+
+from app import app
+from core.db import db
+from models.permission import Permission, Role
+from models.users import User
+from utils.permissions import get_combined_permissions
+
+
+def get_combined_permissions_per_role(user: User) -> set:
+    permissions = set()
+    for role in user.roles.all():
+        permissions.update(role.permissions.all())
+    permissions.update(user.permissions.all())
+    return permissions
+
+
+def create_user(roles: int, permissions: int, prefix: str) -> User:
+    """
+    Creates a user with `roles` roles of `permissions` permissions each, half of them shared
+    with the next role, and `permissions` direct permissions.
+    """
+    pool = [
+        Permission(name=f'{prefix}_permission_{number}')
+        for number in range(roles * permissions // 2 + permissions)
+    ]
+    user = User(email=f'{prefix}@example.com', first_name='Benchmark', last_name='User', password=prefix)
+    db.session.add_all(pool + [user])
+    for number in range(roles):
+        role = Role(name=f'{prefix}_role_{number}')
+        start = number * permissions // 2
+        role.permissions.extend(pool[start:start + permissions])
+        db.session.add(role)
+        user.roles.append(role)
+    user.permissions.extend(pool[-permissions:])
+    db.session.commit()
+    return user
+
+
+def delete_user(user: User, prefix: str) -> None:
+    roles = user.roles.all()
+    user.roles = []
+    user.permissions = []
+    for role in roles:
+        role.permissions = []
+        db.session.delete(role)
+    db.session.delete(user)
+    Permission.query.filter(Permission.name.like(f'{prefix}_permission_%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def run(name: str, resolve, iterations: int) -> None:
+    queries = 0
+
+    def count_query(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        permissions = resolve()
+    elapsed = (time.perf_counter() - start_time) / iterations
+    event.remove(db.engine, 'before_cursor_execute', count_query)
+
+    print(f'{name}:')
+    print(f'  permissions: {len(permissions)}')
+    print(f'  queries:     {queries / iterations:.0f} per resolution')
+    print(f'  time:        {elapsed * 1000:.2f} ms per resolution\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roles', type=int, default=50, help='roles of the user')
+    parser.add_argument('--permissions', type=int, default=20, help='permissions per role')
+    parser.add_argument('--iterations', type=int, default=20, help='resolutions per approach')
+    args = parser.parse_args()
+
+    prefix = f'benchmark_{uuid.uuid4().hex[:8]}'
+    with app.app_context():
+        user = create_user(args.roles, args.permissions, prefix)
+        user_id = str(user.id)
+        print(f'User with {args.roles} roles of {args.permissions} permissions, {args.iterations} iterations\n')
+        try:
+            run('query per role', lambda: get_combined_permissions_per_role(user), args.iterations)
+            run('single query', lambda: user.combined_permissions, args.iterations)
+            get_combined_permissions(user_id)
+            run('cached', lambda: get_combined_permissions(user_id), args.iterations)
+        finally:
+            delete_user(user, prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares resolving a user by email on the users table partitioned by ID hash:
+filtering users by email, which probes the email index of every partition, and
+User.get_by_email, which resolves the ID in the user_emails lookup table first,
+so only the partition of the user is scanned.
+
+Benchmark users are generated server-side with their own email prefix and deleted afterwards.
+Run from services/movies_auth against a migrated database:
+    PYTHONPATH=src python benchmarks/email_lookup.py --users 2000000
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from app import app
+from core.db import db
+from models.users import User
+
+INSERT_BATCH = 100000
+
+
+def create_users(prefix: str, users: int) -> None:
+    for start in range(0, users, INSERT_BATCH):
+        db.session.execute(text(
+            """INSERT INTO content.users (id, email, first_name, last_name, password)
+               SELECT gen_random_uuid(), :prefix || '_' || n || '@example.com', 'Benchmark', 'User', 'benchmark'
+               FROM generate_series(:start, :end) AS n;"""
+        ), {'prefix': prefix, 'start': start, 'end': min(start + INSERT_BATCH, users) - 1})
+        db.session.commit()
+        print(f'  {min(start + INSERT_BATCH, users)} users created', end='\r')
+    db.session.execute(text('ANALYZE content.users;'))
+    db.session.execute(text('ANALYZE content.user_emails;'))
+    db.session.commit()
+    print()
+
+
+def delete_users(prefix: str) -> None:
+    db.session.execute(text('DELETE FROM content.users WHERE email LIKE :pattern;'), {'pattern': f'{prefix}_%'})
+    db.session.commit()
+
+
+def explain(query) -> str:
+    sql = query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(text(f'EXPLAIN (ANALYZE, BUFFERS) {sql}'))
+    return '\n'.join(f'    {row[0]}' for row in rows)
+
+
+def run(name: str, build_query, emails: list) -> None:
+    print(f'{name}:')
+    print(explain(build_query(emails[0])))
+    latencies = []
+    for email in emails:
+        start_time = time.perf_counter()
+        user = build_query(email).first()
+        latencies.append(time.perf_counter() - start_time)
+        assert user.email == email
+        db.session.expunge_all()
+    latencies.sort()
+    print(f'  median: {statistics.median(latencies) * 1000:.3f} ms')
+    print(f'  p99:    {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms\n')
+
+
+def by_email_filter(email: str):
+    return User.query.filter_by(email=email)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000, help='benchmark users to create')
+    parser.add_argument('--lookups', type=int, default=1000, help='lookups of random emails per approach')
+    args = parser.parse_args()
+
+    prefix = f'benchmark_{uuid.uuid4().hex[:8]}'
+    with app.app_context():
+        try:
+            print(f'Creating {args.users} users...')
+            create_users(prefix, args.users)
+            emails = [
+                f'{prefix}_{n}@example.com' for n in random.sample(range(args.users), min(args.lookups, args.users))
+            ]
+            print(f'{args.lookups} lookups per approach\n')
+            run('filter by email', by_email_filter, emails)
+            run('lookup table', User.query_by_email, emails)
+        finally:
+            delete_users(prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Checks the accuracy bounds of the leased Redis rate limit storage under concurrency and
+measures how many requests it admits without a Redis round trip.
+
+Several processes, each with its own storage and threads, hit one limit as fast as they can.
+Every admitted request is recorded with the fixed window the storage counted it in, then:
+- no fixed window may admit more than the limit (the script fails otherwise),
+- every full fixed window should admit about limit - processes * RATELIMIT_LEASE_MAX at least,
+  less the rounding of the sliding window estimate,
+- the busiest sliding window shows the error of the sliding window estimate.
+
+Limits under RATELIMIT_LEASE_MIN_LIMIT are not leased and take a round trip per request, so
+the round trips per request only drop on large limits: compare --limit 1000/second with 10/second.
+
+Run from services/movies_auth against a scratch Redis:
+    PYTHONPATH=src python benchmarks/rate_limiter.py --redis redis://localhost:6379/15 --limit 1000/second
+"""
+import argparse
+import multiprocessing
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from limits import parse
+from limits.strategies import FixedWindowRateLimiter
+
+from core import config
+from utils.rate_limit_storage import LeasedRedisStorage
+
+
+class RecordingStorage(LeasedRedisStorage):
+    """
+    Remembers the time each thread last read from the clock and counts the leases.
+    """
+
+    def __init__(self, uri: str, **options):
+        super().__init__(uri, **options)
+        self.local = threading.local()
+        self.leases = 0
+        lease_script = self.lease_script
+
+        def count_lease(*args, **kwargs):
+            self.leases += 1
+            return lease_script(*args, **kwargs)
+
+        self.lease_script = count_lease
+
+    def clock(self) -> float:
+        self.local.now = time.time()
+        return self.local.now
+
+
+def hit(redis_url: str, limit: str, identifier: str, seconds: float, threads: int, results) -> None:
+    storage = RecordingStorage(f'leased+{redis_url}')
+    limiter = FixedWindowRateLimiter(storage)
+    item = parse(limit)
+    admitted = []
+    requests = Counter()
+    deadline = time.time() + seconds
+
+    def run():
+        while time.time() < deadline:
+            requests['total'] += 1
+            if limiter.hit(item, identifier):
+                admitted.append(storage.local.now)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((admitted, requests['total'], storage.leases))
+
+
+def busiest_sliding_window(times: list, length: float) -> int:
+    busiest = 0
+    start = 0
+    for end, end_time in enumerate(times):
+        while times[start] <= end_time - length:
+            start += 1
+        busiest = max(busiest, end - start + 1)
+    return busiest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis', required=True, help='URL of a scratch Redis')
+    parser.add_argument('--limit', default='1000/second', help='rate limit, in flask_limiter notation')
+    parser.add_argument('--processes', type=int, default=8, help='processes, each with its own storage')
+    parser.add_argument('--threads', type=int, default=4, help='threads per process')
+    parser.add_argument('--seconds', type=float, default=5, help='duration of the run')
+    args = parser.parse_args()
+
+    item = parse(args.limit)
+    expiry = item.get_expiry()
+    identifier = f'benchmark_{uuid.uuid4().hex[:8]}'
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=hit, args=(args.redis, args.limit, identifier, args.seconds, args.threads, results)
+        )
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    admitted, requests, leases = [], 0, 0
+    for _ in processes:
+        process_admitted, process_requests, process_leases = results.get()
+        admitted += process_admitted
+        requests += process_requests
+        leases += process_leases
+    for process in processes:
+        process.join()
+
+    admitted.sort()
+    windows = Counter(int(now // expiry) for now in admitted)
+    # The first and the last windows are partly out of the run
+    full_windows = sorted(windows)[1:-1]
+    floor = item.amount - args.processes * config.RATELIMIT_LEASE_MAX
+    print(f'{args.processes} processes x {args.threads} threads, {args.limit} for {args.seconds} seconds')
+    print(f'  requests:        {requests}, {len(admitted)} admitted')
+    print(f'  round trips:     {leases} ({leases / max(requests, 1):.3f} per request)')
+    print(f'  fixed windows:   max {max(windows.values(), default=0)} admitted (limit {item.amount})')
+    if full_windows:
+        print(f'  full windows:    min {min(windows[w] for w in full_windows)} admitted (bound {max(floor, 0)})')
+    print(f'  sliding windows: max {busiest_sliding_window(admitted, expiry)} admitted')
+
+    over = {window: count for window, count in windows.items() if count > item.amount}
+    if over:
+        print(f'FAILED: {len(over)} fixed windows admitted more than {item.amount} requests')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,9 @@ from flask import abort, request, Blueprint
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from flasgger import swag_from
 
-from models.users import User, UserLogin, SocialAccount
+from models.users import User, SocialAccount
 from utils.jwt_tokens import generate_tokens
+from utils.login_history import login_history
 from utils.rate_limiter import limiter
 from utils.oauth import oauth
 from core import redis, config
@@ -49,20 +50,14 @@ class LoginResource(Resource):
         logs the login attempt, and returns the access and refresh tokens if the login is successful.
         """
         data = self.parser.parse_args()
-        user = User.query.filter_by(email=data['email']).first()
+        user = User.get_by_email(data['email'])
 
         # If the user does not exist or the password is incorrect, return a conflict status
         if not user or not user.check_password(data['password']):
             return abort(HTTPStatus.CONFLICT)
 
-        # Log the login attempt
-        new_login = UserLogin(
-            ip_address=request.remote_addr,
-            time=datetime.now(),
-            user=user.id
-        )
-        db.session.add(new_login)
-        db.session.commit()
+        # Log the login attempt, written in the background
+        login_history.add(user_id=user.id, ip_address=request.remote_addr, time=datetime.now())
 
         # Generate the access and refresh tokens
         access_token, refresh_token = generate_tokens(user=user, user_agent=request.user_agent.string)
@@ -142,15 +137,17 @@ class RefreshResource(Resource):
         Handles the POST request for the refresh resource. It revokes the current refresh token and generates new access and refresh tokens.
         """
         refresh_jti = get_jwt()['jti']
-        redis.revoke_token(refresh_jti, refresh=True)
-
         user_id = get_jwt_identity()
         user = User.query.filter_by(id=user_id).first()
 
         if not user:
+            redis.revoke_token(refresh_jti, refresh=True)
             return abort(HTTPStatus.CONFLICT)
 
-        access_token, refresh_token = generate_tokens(user=user, user_agent=request.user_agent.string)
+        # The current refresh token is revoked in the same round trip as the new tokens are saved
+        access_token, refresh_token = generate_tokens(
+            user=user, user_agent=request.user_agent.string, replaced_refresh_jti=refresh_jti
+        )
         return (
             marshal({'access_token': access_token, 'refresh_token': refresh_token}, self.resource_fields),
             HTTPStatus.OK
@@ -201,7 +198,7 @@ class GoogleAuthResource(LoginResource):
         oauth_token = oauth.google.authorize_access_token()
         google_user = oauth.google.parse_id_token(oauth_token)
 
-        user = User.query.filter_by(email=google_user.get('email')).first()
+        user = User.get_by_email(google_user.get('email'))
         if not user:
             return abort(HTTPStatus.CONFLICT)
 
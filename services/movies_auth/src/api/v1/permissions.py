@@ -1,5 +1,5 @@
 import json
-from datetime import timedelta
+import uuid
 from typing import Optional, Type
 from urllib import parse
 from http import HTTPStatus
@@ -9,12 +9,15 @@ from flask_restful import Resource, reqparse, marshal, fields, Api
 from flask import abort, Blueprint
 import sqlalchemy
 
+from core import config
 from utils.rate_limiter import limiter
 from core.db import db
 from models.permission import Permission, Role
 from models.users import User
-from utils.permissions import permissions_required, PermissionNames
-from utils.cache.base import cache
+from utils.permissions import (
+    get_combined_permissions, get_combined_permissions_mask, get_combined_permissions_masks,
+    compile_permissions_query, compile_permissions_queries, permissions_required, PermissionNames,
+)
 
 permissions_bp = Blueprint('permissions', __name__)
 permissions_api = Api(permissions_bp)
@@ -114,10 +117,16 @@ ROLE_FIELDS = {
 
 
 class BaseCombinedPermissionResource(BaseResource):
-    @cache(key_suffix='combined_permissions', expires=timedelta(minutes=60))
-    def _get_combined_permissions(self, user_id):
-        user = self.get_object(User, id=user_id)
-        return marshal(user.combined_permissions, PERMISSION_FIELDS)
+    @staticmethod
+    def _get_combined_permissions(user_id):
+        try:
+            combined_permissions = get_combined_permissions(user_id)
+        except sqlalchemy.exc.DataError:
+            return abort(HTTPStatus.BAD_REQUEST)
+
+        if combined_permissions is None:
+            return abort(HTTPStatus.NOT_FOUND)
+        return combined_permissions
 
 
 class UserCombinedPermissionResource(BaseCombinedPermissionResource):
@@ -135,12 +144,60 @@ class UserPermissionValidationResource(BaseCombinedPermissionResource):
     # e.g. curl ...  --data-urlencode 'permissions={"any":["packs_ext", {"all": ["cloud_people", "electric_edwards"]}]}'
     @jwt_required()
     def get(self, user_id: str):
-        combined_permissions = self._get_combined_permissions(user_id)
-        combined_permissions_set = {permission['name'] for permission in combined_permissions}
+        try:
+            permissions_mask = get_combined_permissions_mask(user_id)
+        except sqlalchemy.exc.DataError:
+            return abort(HTTPStatus.BAD_REQUEST)
+        if permissions_mask is None:
+            return abort(HTTPStatus.NOT_FOUND)
+
         query_data = self.parser.parse_args()
         permissions_query_str = parse.unquote(query_data['permissions'])
-        permissions_query = json.loads(permissions_query_str)
-        return {'valid': User.check_permissions_set(permissions_query, combined_permissions_set)}, HTTPStatus.OK
+        try:
+            predicate = compile_permissions_query(permissions_query_str)
+        except (ValueError, TypeError, AttributeError, StopIteration):
+            return abort(HTTPStatus.BAD_REQUEST)
+        return {'valid': predicate(permissions_mask)}, HTTPStatus.OK
+
+
+class BatchPermissionValidationResource(BaseResource):
+    def __init__(self):
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('items', type=list, location='json', required=True)
+
+    # e.g. {"items": [{"user_id": "...", "permissions": {"any": ["packs_ext", {"all": ["cloud_people"]}]}}, ...]}
+    # Decisions are returned in the order of the items, with null for unknown users.
+    @jwt_required()
+    def post(self):
+        items = self.parser.parse_args()['items']
+        if len(items) > config.PERMISSIONS_VALIDATION_BATCH_MAX:
+            return abort(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        user_ids = []
+        permissions_queries = []
+        try:
+            for item in items:
+                user_ids.append(self._normalize_user_id(item['user_id']))
+                permissions_queries.append(json.dumps(item['permissions']))
+            predicates = compile_permissions_queries(permissions_queries)
+        except (KeyError, ValueError, TypeError, AttributeError, StopIteration):
+            return abort(HTTPStatus.BAD_REQUEST)
+
+        masks = get_combined_permissions_masks(list({user_id for user_id in user_ids if user_id}))
+        results = []
+        for item, user_id, permissions_query in zip(items, user_ids, permissions_queries):
+            mask = masks.get(user_id)
+            valid = None if mask is None else predicates[permissions_query](mask)
+            results.append({'user_id': item['user_id'], 'valid': valid})
+        return {'results': results}, HTTPStatus.OK
+
+    @staticmethod
+    def _normalize_user_id(user_id) -> Optional[str]:
+        # Malformed IDs are unknown users rather than a failure of the whole batch
+        try:
+            return str(uuid.UUID(str(user_id)))
+        except ValueError:
+            return None
 
 
 class UserRoleResource(BaseResource):
@@ -355,3 +412,5 @@ permissions_api.add_resource(UserCombinedPermissionResource,
                              '/auth/v1/users/<string:user_id>/combined_permissions')
 permissions_api.add_resource(UserPermissionValidationResource,
                              '/auth/v1/users/<string:user_id>/combined_permissions/validation')
+permissions_api.add_resource(BatchPermissionValidationResource,
+                             '/auth/v1/users/combined_permissions/validation')
@@ -1,3 +1,6 @@
+import base64
+import uuid
+from datetime import datetime
 from http import HTTPStatus
 import typing
 
@@ -7,8 +10,9 @@ from flask import abort, Blueprint
 import sqlalchemy
 
 from utils.rate_limiter import limiter
+from core import config
 from core.db import db
-from models.users import User
+from models.users import User, UserLogin
 
 users_bp = Blueprint('users', __name__)
 users_api = Api(users_bp)
@@ -55,12 +59,8 @@ class UserResource(Resource):
 
     def post(self):
         user_data = self.parser.parse_args()
-        # since we introduced Users table partitioning by id hash, we can't have unique constraint
-        # on email for the whole table anymore, so here we must explicitly check first if user
-        # with such email already exists
-
-        if existing_user := User.query.filter_by(email=user_data['email']).first():
-            return abort(HTTPStatus.CONFLICT)
+        # since we introduced Users table partitioning by id hash, emails are unique across partitions
+        # thanks to the primary key of the user_emails lookup table only: an existing email fails the commit
         new_user = User(**user_data)
         db.session.add(new_user)
 
@@ -128,12 +128,41 @@ class UserLoginResource(Resource):
 
     user_logins_list = {
         'logins': fields.List(fields.Nested(user_login)),
+        'next_cursor': fields.String,
     }
 
+    def __init__(self):
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('cursor', location='args')
+        self.parser.add_argument('page_size', type=int, location='args', default=config.LOGINS_PAGE_SIZE)
+
+    # Newest first, one page at a time: next_cursor is passed as cursor to get the next page
     @jwt_required()
     def get(self, user_id: str):
         user = UserResource.get_object(user_id)
-        return marshal(user, self.user_logins_list), HTTPStatus.OK
+        args = self.parser.parse_args()
+        if not 0 < args['page_size'] <= config.LOGINS_MAX_PAGE_SIZE:
+            return abort(HTTPStatus.BAD_REQUEST)
+        after = self._decode_cursor(args['cursor']) if args['cursor'] else None
+
+        logins = UserLogin.get_page(user.id, limit=args['page_size'] + 1, after=after)
+        next_cursor = None
+        if len(logins) > args['page_size']:
+            logins = logins[:args['page_size']]
+            next_cursor = self._encode_cursor(logins[-1])
+        return marshal({'logins': logins, 'next_cursor': next_cursor}, self.user_logins_list), HTTPStatus.OK
+
+    @staticmethod
+    def _encode_cursor(login: UserLogin) -> str:
+        return base64.urlsafe_b64encode(f'{login.time.isoformat()}|{login.id}'.encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+        try:
+            time, login_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(time), uuid.UUID(login_id)
+        except ValueError:
+            return abort(HTTPStatus.BAD_REQUEST)
 
 
 users_api.add_resource(UserResource, '/auth/v1/users', '/auth/v1/users/<string:user_id>')
@@ -8,7 +8,7 @@ from flask_opentracing import FlaskTracing
 from core.config import DOCS_DIR, DATABASE_URI, SECRET_KEY
 from core.db import init_db
 from core.trace import setup_jaeger
-from utils import jwt_tokens, rate_limiter, oauth
+from utils import jwt_tokens, rate_limiter, oauth, login_history
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
@@ -28,6 +28,7 @@ swagger.init_app(app)
 jwt_tokens.init_jwt(app)
 rate_limiter.init_limiter(app)
 oauth.init_oauth(app)
+login_history.init_login_history(app)
 
 errors = {
     'sqlalchemy.exc.IntegrityError': {
@@ -1,12 +1,18 @@
 import os
+from datetime import date
+from itertools import chain
 
 import click
 import sqlalchemy
 
+from core import config
 from core.db import db
+from core.redis import redis_db
 from models.permission import Permission, Role
 from models.users import User
+from models.additions.partitions import get_convert_user_logins_cmds, get_create_user_logins_partitions_cmds
 from utils.permissions import PermissionNames, RoleNames
+from utils.revocation_filter import BACKFILL_KEY, backfill_revocations
 from app import app as _app
 
 
@@ -60,12 +66,33 @@ def init(ctx, with_superuser):
         superuser_role.add_permission(superuser_permission)
         db.session.commit()
 
+    ctx.invoke(create_logins_partitions, months=config.DB_USER_LOGINS_PARTITIONS_AHEAD)
+    if redis_db.get(BACKFILL_KEY) != b'done':
+        ctx.invoke(backfill_revocations_cmd)
+
     if with_superuser and os.system('flask superuser create'):
         raise RuntimeError('"superuser create" failed')
 
     print('App initialization done.')
 
 
+@app.command('logins-partitions')
+@click.option('--months', default=config.DB_USER_LOGINS_PARTITIONS_AHEAD, help='Number of months from the current one')
+def create_logins_partitions(months):
+    """Create the monthly partitions of the login history ahead of time, partitioning it first if needed"""
+    for cmd in chain(get_convert_user_logins_cmds(), get_create_user_logins_partitions_cmds(date.today(), months)):
+        db.session.execute(sqlalchemy.text(cmd))
+    db.session.commit()
+    print(f'Login history partitions created for {months} months.')
+
+
+@app.command('backfill-revocations')
+def backfill_revocations_cmd():
+    """Copy the token revocations made before the revocations stream existed into it (once)"""
+    copied = backfill_revocations(redis_db)
+    print(f'{copied} revocations copied into the stream.')
+
+
 @_app.cli.group()
 def superuser():
     """Superuser stuff"""
@@ -99,7 +126,7 @@ def create_superuser(email, first_name, last_name, password):
 @click.option('--email', prompt=True)
 def delete_superuser(email):
     """Delete superuser"""
-    user = User.query.filter_by(email=email).first()
+    user = User.get_by_email(email)
     if not user:
         print(f'Superuser <{email}> not found')
         return 0
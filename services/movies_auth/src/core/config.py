@@ -19,8 +19,29 @@ SECRET_KEY = os.getenv('FLASK_SECRET_KEY')
 ACCESS_EXPIRES = timedelta(minutes=30)
 REFRESH_EXPIRES = timedelta(days=1)
 
+# Revocations are published to a stream to keep the revocation filters of all processes in sync
+REVOCATIONS_STREAM = 'revoked_tokens'
+REVOCATION_FILTER_CAPACITY = 1_000_000
+REVOCATION_FILTER_ERROR_RATE = 0.001
+# Longest wait of a read of the stream; a read returns at least this often when nothing is revoked
+REVOCATION_FILTER_READ_BLOCK_MS = 1000
+# Seconds without reading the stream after which the filter is bypassed: a few reads missed in a row
+REVOCATION_FILTER_MAX_LAG = 5 * REVOCATION_FILTER_READ_BLOCK_MS / 1000
+
+# Logins are queued and written in batches by a background thread
+LOGIN_HISTORY_BUFFER_SIZE = 10000
+LOGIN_HISTORY_BATCH_SIZE = 500
+LOGIN_HISTORY_FLUSH_INTERVAL = 1
+# Batches failing to be written are kept here and written back once the database is reachable again
+LOGIN_HISTORY_SPILL_FILE = os.environ.get('LOGIN_HISTORY_SPILL_FILE', 'login_history.jsonl')
+
 RATELIMIT_DEFAULT = "10/second"
-RATELIMIT_STORAGE_URL = "redis://{host}:{port}".format(host=REDIS_HOST, port=REDIS_PORT)
+# Tokens are leased from Redis by each process, see utils/rate_limit_storage.py
+RATELIMIT_STORAGE_URL = "leased+redis://{host}:{port}".format(host=REDIS_HOST, port=REDIS_PORT)
+# Smaller limits, as the per-IP limits of the endpoints, take one INCR per request without leases
+RATELIMIT_LEASE_MIN_LIMIT = 100
+RATELIMIT_LEASE_MAX = 20
+RATELIMIT_LEASE_FRACTION = 0.1
 RATELIMIT_HEADERS_ENABLED = True
 RATELIMIT_IN_MEMORY_FALLBACK = "1/2second"
 RATELIMIT_KEY_PREFIX = "limiter"
@@ -39,5 +60,15 @@ OAUTH = {
 }
 
 DB_USERS_PARTITIONS_NUM = 8
+# Monthly partitions of the login history created ahead of time, by `flask app logins-partitions`
+# on every deploy: logins past the last partition are spilled by the writer until the partition exists
+DB_USER_LOGINS_PARTITIONS_AHEAD = 12
+# Below this many months ahead the login history writer logs an error every hour
+DB_USER_LOGINS_PARTITIONS_MIN_AHEAD = 2
+
+LOGINS_PAGE_SIZE = 50
+LOGINS_MAX_PAGE_SIZE = 500
+
+PERMISSIONS_VALIDATION_BATCH_MAX = 1000
 
 JAEGER_HOST = os.getenv('JAEGER_HOST')
@@ -1,60 +1,144 @@
-import json
+from typing import Optional
+
 import redis
 
 from core import config
+from utils.revocation_filter import RevocationFilter, stream_min_id
 
 redis_db = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
-
-
-def _revoke_token(jti: str, pipeline: redis.client.Pipeline, refresh: bool) -> None:
-    expires = config.REFRESH_EXPIRES if refresh else config.ACCESS_EXPIRES
-    pipeline.setex(jti, expires, 'revoked')
+revocation_filter = RevocationFilter(redis_db)
+
+# Every token JTI is stored with the JTI of its pair (access <-> refresh) until it is revoked,
+# then with 'revoked'. The refresh JTIs of a user are kept in a hash by user agent.
+# Each operation below is one Lua script, so it costs one round trip and runs atomically:
+# concurrent logins of a user from different devices can not lose each other's sessions.
+#
+# Common arguments of the scripts: KEYS[1] is the stream of revocations,
+# ARGV[1] and ARGV[2] the lifetimes of access and refresh tokens in seconds,
+# ARGV[3] the oldest ID kept in the stream. The scripts return the revoked JTIs.
+#
+# The keys known to the caller are passed in KEYS, but the pair of a JTI and the refresh JTIs of a user
+# are read from values, so the scripts touch keys not declared in KEYS: they assume a standalone Redis
+# (no Cluster), where all the keys live on the instance running the script.
+_LUA_REVOKE = """
+local revoked = {}
+
+local function revoke(jti, ttl)
+    redis.call('SET', jti, 'revoked', 'EX', ttl)
+    redis.call('XADD', KEYS[1], 'MINID', '~', ARGV[3], '*', 'jti', jti)
+    table.insert(revoked, jti)
+end
+
+local function revoke_pair(jti, refresh)
+    local pair_jti = redis.call('GET', jti)
+    if pair_jti and pair_jti ~= 'revoked' then
+        revoke(pair_jti, refresh and ARGV[1] or ARGV[2])
+    end
+    revoke(jti, refresh and ARGV[2] or ARGV[1])
+end
+"""
+
+# Refresh JTIs of a user, KEYS[2]: tokens hash of the user, KEYS[3]: the user ID, where older releases
+# kept a JSON object of the refresh JTIs by user agent. Sessions saved there stay valid until they expire.
+_LUA_USER_REFRESH_JTIS = """
+local function user_refresh_jtis()
+    local jtis = redis.call('HVALS', KEYS[2])
+    local legacy = redis.call('GET', KEYS[3])
+    if legacy then
+        for _, refresh_jti in pairs(cjson.decode(legacy)) do
+            table.insert(jtis, refresh_jti)
+        end
+    end
+    return jtis
+end
+"""
+
+# KEYS[2]: token JTI, ARGV[4]: '1' for a refresh token
+_revoke_token_script = redis_db.register_script(_LUA_REVOKE + """
+revoke_pair(KEYS[2], ARGV[4] == '1')
+return revoked
+""")
+
+# KEYS[2]: tokens hash of the user, KEYS[3] and KEYS[4]: new access and refresh JTIs,
+# KEYS[5]: refresh JTI replaced by the new tokens, if any, ARGV[4]: user agent
+_save_tokens_script = redis_db.register_script(_LUA_REVOKE + """
+local old_refresh = redis.call('HGET', KEYS[2], ARGV[4])
+if old_refresh then
+    revoke_pair(old_refresh, true)
+end
+if KEYS[5] and KEYS[5] ~= old_refresh then
+    revoke_pair(KEYS[5], true)
+end
+redis.call('HSET', KEYS[2], ARGV[4], KEYS[4])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('SET', KEYS[3], KEYS[4], 'EX', ARGV[1])
+redis.call('SET', KEYS[4], KEYS[3], 'EX', ARGV[2])
+return revoked
+""")
+
+# KEYS[2], KEYS[3]: see _LUA_USER_REFRESH_JTIS
+_delete_user_tokens_script = redis_db.register_script(_LUA_REVOKE + _LUA_USER_REFRESH_JTIS + """
+for _, refresh_jti in ipairs(user_refresh_jtis()) do
+    revoke_pair(refresh_jti, true)
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+return revoked
+""")
+
+# KEYS[2], KEYS[3]: see _LUA_USER_REFRESH_JTIS
+_revoke_access_tokens_script = redis_db.register_script(_LUA_REVOKE + _LUA_USER_REFRESH_JTIS + """
+for _, refresh_jti in ipairs(user_refresh_jtis()) do
+    local access_jti = redis.call('GET', refresh_jti)
+    if access_jti and access_jti ~= 'revoked' then
+        revoke(access_jti, ARGV[1])
+    end
+end
+return revoked
+""")
+
+
+def _user_tokens_key(user_id: str) -> str:
+    return f'{user_id}_tokens'
+
+
+def _add_to_filter(revoked_jtis: list) -> list:
+    # The revocations of this process are known to its filter before the stream is read back
+    for jti in revoked_jtis:
+        revocation_filter.add(jti.decode())
+    return revoked_jtis
+
+
+def _common_args() -> list:
+    return [
+        int(config.ACCESS_EXPIRES.total_seconds()),
+        int(config.REFRESH_EXPIRES.total_seconds()),
+        stream_min_id(),
+    ]
 
 
 def revoke_token(token_jti: str, refresh: bool = False):
-    pair_jti = redis_db.get(token_jti)
-    pipeline = redis_db.pipeline()
-
-    if pair_jti and pair_jti != b'revoked':
-        _revoke_token(pair_jti, pipeline, refresh=not refresh)
-
-    _revoke_token(token_jti, pipeline, refresh=refresh)
-    pipeline.execute()
-
-
-def save_tokens(user_id: str, access_jti: str, refresh_jti: str, user_agent: str) -> None:
-    user_tokens = json.loads(redis_db.get(user_id) or '{}')
-
-    pipeline = redis_db.pipeline()
-    if old_refresh := user_tokens.get(user_agent):
-        revoke_token(old_refresh, refresh=True)
+    _add_to_filter(_revoke_token_script(
+        keys=[config.REVOCATIONS_STREAM, token_jti],
+        args=_common_args() + [int(refresh)],
+    ))
 
-    user_tokens[user_agent] = refresh_jti
 
-    pipeline.setex(user_id, config.REFRESH_EXPIRES, json.dumps(user_tokens))
-    pipeline.setex(access_jti, config.ACCESS_EXPIRES, refresh_jti)
-    pipeline.setex(refresh_jti, config.REFRESH_EXPIRES, access_jti)
-    pipeline.execute()
+def save_tokens(
+        user_id: str, access_jti: str, refresh_jti: str, user_agent: str, replaced_refresh_jti: Optional[str] = None
+) -> None:
+    keys = [config.REVOCATIONS_STREAM, _user_tokens_key(user_id), access_jti, refresh_jti]
+    if replaced_refresh_jti:
+        keys.append(replaced_refresh_jti)
+    _add_to_filter(_save_tokens_script(keys=keys, args=_common_args() + [user_agent]))
 
 
 def delete_user_tokens(user_id: str):
-    user_tokens = json.loads(redis_db.get(user_id) or '{}')
-    pipeline = redis_db.pipeline()
-    for refresh_jti in user_tokens.values():
-        revoke_token(refresh_jti, refresh=True)
-    pipeline.delete(user_id)
-    pipeline.execute()
+    _add_to_filter(_delete_user_tokens_script(
+        keys=[config.REVOCATIONS_STREAM, _user_tokens_key(user_id), user_id], args=_common_args()
+    ))
 
 
 def revoke_access_tokens(user_id: str) -> int:
-    user_tokens = json.loads(redis_db.get(user_id) or '{}')
-    pipeline = redis_db.pipeline()
-    count = 0
-
-    for refresh_jti in user_tokens.values():
-        access_jti = redis_db.get(refresh_jti)
-        if access_jti and access_jti != b'revoked':
-            _revoke_token(access_jti, pipeline, refresh=False)
-            count += 1
-    pipeline.execute()
-    return count
+    return len(_add_to_filter(_revoke_access_tokens_script(
+        keys=[config.REVOCATIONS_STREAM, _user_tokens_key(user_id), user_id], args=_common_args()
+    )))
@@ -0,0 +1,26 @@
+# The user_emails lookup table is kept in sync with the emails of users by a trigger,
+# in the transaction of the user write. Rows of deleted users go with the foreign key cascade.
+
+def get_create_user_email_sync_cmds():
+    return [
+        """CREATE OR REPLACE FUNCTION content.sync_user_email() RETURNS trigger AS $$
+           BEGIN
+               IF TG_OP = 'UPDATE' THEN
+                   DELETE FROM content.user_emails WHERE email = OLD.email AND user_id = OLD.id;
+               END IF;
+               INSERT INTO content.user_emails (email, user_id) VALUES (NEW.email, NEW.id);
+               RETURN NEW;
+           END;
+           $$ LANGUAGE plpgsql;""",
+        """CREATE TRIGGER users_insert_email
+           AFTER INSERT ON content.users
+           FOR EACH ROW EXECUTE FUNCTION content.sync_user_email();""",
+        """CREATE TRIGGER users_update_email
+           AFTER UPDATE OF email ON content.users
+           FOR EACH ROW WHEN (OLD.email IS DISTINCT FROM NEW.email)
+           EXECUTE FUNCTION content.sync_user_email();""",
+        # Users created before the lookup table
+        """INSERT INTO content.user_emails (email, user_id)
+           SELECT email, id FROM content.users
+           ON CONFLICT (email) DO NOTHING;""",
+    ]
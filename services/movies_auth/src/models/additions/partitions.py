@@ -1,3 +1,4 @@
+from datetime import date
 from itertools import chain
 
 
@@ -22,6 +23,31 @@ def _get_partition_name(table_name, remainder):
     return f'{table_name}_m{remainder}'
 
 
+def get_create_range_partition_cmd(table_name, partition_name, start, end):
+    return f"""CREATE TABLE IF NOT EXISTS content.{partition_name}
+                PARTITION OF content.{table_name}
+                FOR VALUES FROM ('{start}') TO ('{end}');"""
+
+
+def _get_month_partition_name(table_name, month):
+    return f'{table_name}_y{month.year}m{month.month:02d}'
+
+
+def _add_months(month, months):
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, month_index + 1, 1)
+
+
+def get_create_month_partitions_cmds(table_name, start, months_num):
+    first_month = start.replace(day=1)
+    return [
+        get_create_range_partition_cmd(
+            table_name, _get_month_partition_name(table_name, month), month, _add_months(month, 1)
+        )
+        for month in (_add_months(first_month, i) for i in range(months_num))
+    ]
+
+
 def get_create_users_partitions_cmds(partitions_num):
     return chain.from_iterable(
         (get_create_partition_cmd('users', partitions_num, remainder),
@@ -31,3 +57,61 @@ def get_create_users_partitions_cmds(partitions_num):
 
 def get_create_user_permission_partitions_cmds(partitions_num):
     return [get_create_partition_cmd('user_permission', partitions_num, remainder) for remainder in range(partitions_num)]
+
+
+def get_create_user_logins_partitions_cmds(start, months_num):
+    # No DEFAULT partition: creating a month would scan it under an exclusive lock, and fail once it
+    # holds rows of that month. `flask app logins-partitions` keeps the months ahead created instead.
+    return get_create_month_partitions_cmds('user_logins', start, months_num)
+
+
+def get_convert_user_logins_cmds():
+    # A user_logins table created before the login history was partitioned is swapped, in one transaction,
+    # for a partitioned one with a partition per month of its rows. Does nothing once it is partitioned.
+    return [
+        """DO $$
+           DECLARE
+               month date;
+           BEGIN
+               IF NOT EXISTS (
+                   SELECT FROM pg_class c JOIN pg_namespace ns ON ns.oid = c.relnamespace
+                   WHERE ns.nspname = 'content' AND c.relname = 'user_logins' AND c.relkind = 'r'
+               ) THEN
+                   RETURN;
+               END IF;
+               ALTER TABLE content.user_logins RENAME TO user_logins_unpartitioned;
+               ALTER INDEX content.user_logins_pkey RENAME TO user_logins_unpartitioned_pkey;
+               CREATE TABLE content.user_logins (
+                   id uuid NOT NULL,
+                   ip_address inet NOT NULL,
+                   time timestamp without time zone NOT NULL,
+                   "user" uuid REFERENCES content.users (id),
+                   PRIMARY KEY (id, time)
+               ) PARTITION BY RANGE (time);
+               CREATE INDEX user_logins_user_time_idx ON content.user_logins ("user", time, id);
+               FOR month IN
+                   SELECT generate_series(date_trunc('month', min(time)), max(time), interval '1 month')::date
+                   FROM content.user_logins_unpartitioned
+               LOOP
+                   EXECUTE format(
+                       'CREATE TABLE content.%I PARTITION OF content.user_logins FOR VALUES FROM (%L) TO (%L)',
+                       'user_logins_y' || to_char(month, 'YYYY"m"MM'), month, (month + interval '1 month')::date
+                   );
+               END LOOP;
+               INSERT INTO content.user_logins (id, ip_address, time, "user")
+               SELECT id, ip_address, time, "user" FROM content.user_logins_unpartitioned;
+               DROP TABLE content.user_logins_unpartitioned;
+           END;
+           $$;""",
+    ]
+
+
+def get_user_logins_partitions_end_query():
+    # First day after the last monthly partition, read from the partition names
+    return """SELECT (max(to_date(substring(child.relname FROM '_y(\\d{4}m\\d{2})$'), 'YYYY"m"MM'))
+                      + interval '1 month')::date AS partitions_end
+              FROM pg_inherits
+              JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+              JOIN pg_namespace ns ON ns.oid = parent.relnamespace
+              WHERE ns.nspname = 'content' AND parent.relname = 'user_logins';"""
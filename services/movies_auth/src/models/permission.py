@@ -5,7 +5,10 @@ from sqlalchemy.dialects.postgresql import UUID
 from app import db
 from core import config
 from .additions.partitions import get_create_user_permission_partitions_cmds
-from utils.cache.group import cache_invalidate_group, delete_items
+from utils.cache.group import cache_invalidate_group, invalidate_group
+
+# Cache groups holding the combined permissions of users
+COMBINED_PERMISSIONS_CACHES = ('combined_permissions', 'combined_permissions_mask')
 
 
 # Function to create user permission partitions
@@ -54,20 +57,40 @@ class Permission(db.Model):
         id: The unique identifier of the permission.
         name: The name of the permission.
         description: The description of the permission.
+        bit: The index of the permission in permission bitmasks, taken from a sequence,
+            so it is never reassigned to another permission.
     """
 
     __tablename__ = 'permissions'
     __table_args__ = {'schema': 'content'}
 
+    bit_sequence = db.Sequence('permissions_bit_seq', metadata=db.metadata, schema='content')
+
     id = db.Column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False
     )
     name = db.Column(db.String(80), unique=True, nullable=False, index=True)
     description = db.Column(db.String(256), nullable=True)
+    bit = db.Column(
+        db.Integer, bit_sequence, server_default=bit_sequence.next_value(), unique=True, nullable=False
+    )
 
     def __repr__(self):
         return f'<Permission {self.name} ({self.id})>'
 
+    @classmethod
+    def get_bits(cls, names) -> dict[str, int]:
+        """
+        This method returns the bit indexes of permissions.
+
+        Args:
+            names: The names of the permissions.
+
+        Returns:
+            dict: The bit indexes by name, unknown names are left out.
+        """
+        return dict(db.session.query(cls.name, cls.bit).filter(cls.name.in_(list(names))).all())
+
 
 # Definition of the user_role table
 user_role = db.Table(
@@ -152,7 +175,7 @@ class Role(db.Model):
         )
 
     # Method to add a permission to a role
-    @cache_invalidate_group('combined_permissions')
+    @cache_invalidate_group(*COMBINED_PERMISSIONS_CACHES)
     def add_permission(self, permission: Permission):
         """
         This method adds a permission to the role.
@@ -164,7 +187,7 @@ class Role(db.Model):
             self.permissions.append(permission)
 
     # Method to remove a permission from a role
-    @cache_invalidate_group('combined_permissions')
+    @cache_invalidate_group(*COMBINED_PERMISSIONS_CACHES)
     def remove_permission(self, permission: Permission):
         """
         This method removes a permission from the role.
@@ -205,7 +228,8 @@ class CacheResetDBListener:
             session: The database session.
         """
         if session._should_invalidate_cache:
-            delete_items(match='*_combined_permissions')
+            for suffix in COMBINED_PERMISSIONS_CACHES:
+                invalidate_group(suffix)
         session._should_invalidate_cache = False
 
 
@@ -1,12 +1,14 @@
 import uuid
+from datetime import date
 from hashlib import sha512
 
 from sqlalchemy.dialects.postgresql import UUID, INET
 
 from app import db
 from core import config
-from .permission import user_permission, Permission, user_role, Role
-from .additions.partitions import get_create_users_partitions_cmds
+from .permission import user_permission, Permission, user_role, Role, role_permission, COMBINED_PERMISSIONS_CACHES
+from .additions.partitions import get_create_users_partitions_cmds, get_create_user_logins_partitions_cmds
+from .additions.email_lookup import get_create_user_email_sync_cmds
 from utils.cache.base import cache_invalidate
 
 
@@ -15,6 +17,16 @@ def create_partitions(target, connection, **kw):
         connection.execute(cmd)
 
 
+def create_user_logins_partitions(target, connection, **kw):
+    for cmd in get_create_user_logins_partitions_cmds(date.today(), config.DB_USER_LOGINS_PARTITIONS_AHEAD):
+        connection.execute(cmd)
+
+
+def create_user_email_sync(target, connection, **kw):
+    for cmd in get_create_user_email_sync_cmds():
+        connection.execute(cmd)
+
+
 class User(db.Model):
     __tablename__ = 'users'
     __table_args__ = {'schema': 'content',
@@ -28,7 +40,7 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     permissions = db.relationship('Permission', secondary=user_permission, lazy='dynamic')
     roles = db.relationship('Role', secondary=user_role, lazy='dynamic')
-    logins = db.relationship('UserLogin')
+    logins = db.relationship('UserLogin', lazy='dynamic')
 
     def __init__(self, email: str, first_name: str, last_name: str, password: str):
         self.email = email
@@ -36,6 +48,16 @@ class User(db.Model):
         self.last_name = last_name
         self.set_password(password)
 
+    # Resolves the email in the lookup table first, so only the partition of the user is scanned
+    @classmethod
+    def query_by_email(cls, email: str):
+        user_id = db.select(UserEmail.user_id).where(UserEmail.email == email).scalar_subquery()
+        return cls.query.filter(cls.id == user_id)
+
+    @classmethod
+    def get_by_email(cls, email: str):
+        return cls.query_by_email(email).first()
+
     def check_password(self, raw_password):
         return self.password == self._make_password(raw_password)
 
@@ -48,12 +70,12 @@ class User(db.Model):
     def has_permission(self, permission: Permission):
         return self.permissions.filter(user_permission.c.permission_id == permission.id).count() > 0
 
-    @cache_invalidate('combined_permissions')
+    @cache_invalidate(*COMBINED_PERMISSIONS_CACHES)
     def add_permission(self, permission):
         if not self.has_permission(permission):
             self.permissions.append(permission)
 
-    @cache_invalidate('combined_permissions')
+    @cache_invalidate(*COMBINED_PERMISSIONS_CACHES)
     def remove_permission(self, permission: Permission):
         if self.has_permission(permission):
             self.permissions.remove(permission)
@@ -61,26 +83,59 @@ class User(db.Model):
     def has_role(self, role: Role):
         return self.roles.filter(user_role.c.role_id == role.id).count() > 0
 
-    @cache_invalidate('combined_permissions')
+    @cache_invalidate(*COMBINED_PERMISSIONS_CACHES)
     def add_role(self, role: Role):
         if not self.has_role(role):
             self.roles.append(role)
 
-    @cache_invalidate('combined_permissions')
+    @cache_invalidate(*COMBINED_PERMISSIONS_CACHES)
     def remove_role(self, role: Role):
         if self.has_role(role):
             self.roles.remove(role)
 
+    # One query for the direct permissions and the permissions of all the roles of the user
+    def _get_combined_permissions_query(self):
+        direct = db.select(user_permission.c.permission_id).where(user_permission.c.user_id == self.id)
+        from_roles = db.select(role_permission.c.permission_id).select_from(
+            role_permission.join(user_role, user_role.c.role_id == role_permission.c.role_id)
+        ).where(user_role.c.user_id == self.id)
+        return Permission.query.filter(Permission.id.in_(direct.union(from_roles)))
+
     def _get_combined_permissions_set(self):
-        permissions = set()
-        for role in self.roles.all():
-            permissions.update(role.permissions.all())
-        permissions.update(self.permissions.all())
-        return permissions
+        return set(self._get_combined_permissions_query().all())
 
     @property
     def combined_permissions(self):
-        return sorted(self._get_combined_permissions_set(), key=lambda permission: permission.name)
+        return self._get_combined_permissions_query().order_by(Permission.name).all()
+
+    # Bitmask of the bit indexes of the combined permissions
+    @property
+    def combined_permissions_mask(self) -> int:
+        mask = 0
+        for bit, in self._get_combined_permissions_query().with_entities(Permission.bit):
+            mask |= 1 << bit
+        return mask
+
+    # Bitmasks of the combined permissions of many users in one query, unknown users are left out
+    @classmethod
+    def get_combined_permissions_masks(cls, user_ids: list[str]) -> dict[str, int]:
+        direct = db.select(user_permission.c.user_id, user_permission.c.permission_id).where(
+            user_permission.c.user_id.in_(user_ids)
+        )
+        from_roles = db.select(user_role.c.user_id, role_permission.c.permission_id).select_from(
+            role_permission.join(user_role, user_role.c.role_id == role_permission.c.role_id)
+        ).where(user_role.c.user_id.in_(user_ids))
+        granted = direct.union(from_roles).subquery()
+        rows = db.session.query(cls.id, Permission.bit).outerjoin(
+            granted, granted.c.user_id == cls.id
+        ).outerjoin(Permission, Permission.id == granted.c.permission_id).filter(cls.id.in_(user_ids))
+
+        masks = {}
+        for user_id, bit in rows:
+            mask = masks.setdefault(str(user_id), 0)
+            if bit is not None:
+                masks[str(user_id)] = mask | 1 << bit
+        return masks
 
     # query example: {'any': ['packs_ext', {'all': ['cloud_people', 'electric_edwards']}]}
     @classmethod
@@ -99,13 +154,33 @@ class User(db.Model):
         return f'{self.__class__.__name__}(email={self.email}, first_name={self.first_name}, ...)'
 
 
+class UserEmail(db.Model):
+    # Email to ID lookup for the users table partitioned by ID, kept in sync by triggers on users.
+    # Its primary key also makes emails unique across all the partitions.
+    __tablename__ = 'user_emails'
+    __table_args__ = {'schema': 'content',
+                      'listeners': [('after_create', create_user_email_sync)]}
+
+    email = db.Column(db.String, primary_key=True)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('content.users.id', ondelete='CASCADE'), nullable=False)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(email={self.email!r}, user_id={self.user_id!r})'
+
+
 class UserLogin(db.Model):
     __tablename__ = 'user_logins'
-    __table_args__ = {'schema': 'content'}
+    # Partitioned by month, the primary key has to contain the partition key
+    __table_args__ = (
+        db.Index('user_logins_user_time_idx', 'user', 'time', 'id'),
+        {'schema': 'content',
+         'postgresql_partition_by': 'RANGE (time)',
+         'listeners': [('after_create', create_user_logins_partitions)]},
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     ip_address = db.Column(INET, nullable=False)
-    time = db.Column(db.DateTime, nullable=False)
+    time = db.Column(db.DateTime, primary_key=True, nullable=False)
     user = db.Column(UUID(as_uuid=True), db.ForeignKey('content.users.id'))
 
     def __init__(self, ip_address, time, user):
@@ -116,6 +191,14 @@ class UserLogin(db.Model):
     def __repr__(self):
         return f'{self.__class__.__name__}(ip_address={self.ip_address!r}, time={self.time!r}, ...)'
 
+    # Newest first, starting after the (time, id) of the last login of the previous page
+    @classmethod
+    def get_page(cls, user_id, limit: int, after: tuple = None):
+        query = cls.query.filter(cls.user == user_id)
+        if after:
+            query = query.filter(db.tuple_(cls.time, cls.id) < after)
+        return query.order_by(cls.time.desc(), cls.id.desc()).limit(limit).all()
+
 
 class SocialAccount(db.Model):
     __tablename__ = 'social_account'
@@ -1,6 +1,7 @@
 import json
 from datetime import timedelta
 from functools import wraps
+from core.db import db
 from core.redis import redis_db
 
 import models.users
@@ -9,6 +10,90 @@ import models.users
 DEFAULT_EXPIRATION_TIME = timedelta(minutes=60)
 
 
+def generation_key(key_suffix: str) -> str:
+    """
+    Returns the key of the generation counter of a group of cache entries.
+
+    Args:
+        key_suffix (str): Suffix for the cache keys of the group.
+
+    Returns:
+        str: Key of the generation counter.
+    """
+    return f'{key_suffix}_generation'
+
+
+def cache_key(user_id, key_suffix: str) -> str:
+    """
+    Returns the cache key of a user in the current generation of its group. Entries of older
+    generations are never read again and expire on their own.
+
+    Args:
+        user_id: ID of the user.
+        key_suffix (str): Suffix for the cache key.
+
+    Returns:
+        str: Cache key.
+    """
+    generation = int(redis_db.get(generation_key(key_suffix)) or 0)
+    return f'{user_id}_{key_suffix}_v{generation}'
+
+
+def invalidate_group(suffix: str) -> int:
+    """
+    Invalidates all the cache entries of a group at once by moving the group to a new generation,
+    whatever the number of entries. The entries of the old generation expire on their own.
+
+    Args:
+        suffix (str): Suffix for the cache keys of the group.
+
+    Returns:
+        int: The new generation.
+    """
+    return redis_db.incr(generation_key(suffix))
+
+
+def invalidate_on_commit(user_keys=(), groups=()) -> None:
+    """
+    Invalidates cache entries once the current transaction of the session is committed. Invalidated
+    before, an entry could be cached again from the data not committed yet by a concurrent request.
+
+    Args:
+        user_keys: Pairs of the ID of a user and the suffix of its cache entry.
+        groups: Suffixes of the cache keys of groups.
+    """
+    pending = db.session.info.setdefault('cache_invalidations', {'user_keys': set(), 'groups': set()})
+    pending['user_keys'].update(user_keys)
+    pending['groups'].update(groups)
+
+
+class CacheInvalidationDBListener:
+    """
+    This class represents a listener invalidating the cache entries changed by a transaction after its commit.
+    Invalidations left by a rolled back transaction are run with the next commit of the session, which costs
+    cache misses only.
+    """
+
+    @classmethod
+    def after_commit(cls, session):
+        """
+        This method is called after a database commit.
+
+        Args:
+            session: The database session.
+        """
+        pending = session.info.pop('cache_invalidations', None)
+        if not pending:
+            return
+        if pending['user_keys']:
+            redis_db.delete(*(cache_key(user_id, key_suffix) for user_id, key_suffix in pending['user_keys']))
+        for suffix in pending['groups']:
+            invalidate_group(suffix)
+
+
+db.event.listen(db.session, 'after_commit', CacheInvalidationDBListener.after_commit)
+
+
 def cache(key_suffix: str, expires: timedelta = DEFAULT_EXPIRATION_TIME):
     """
     Decorator for caching the result of a function.
@@ -24,7 +109,7 @@ def cache(key_suffix: str, expires: timedelta = DEFAULT_EXPIRATION_TIME):
     def wrapper(fn):
         @wraps(fn)
         def decorator(user_id, *args, **kwargs):
-            key = f'{user_id}_{key_suffix}'
+            key = cache_key(user_id, key_suffix)
             item = redis_db.get(key)
             if not item:
                 item = fn(user_id, *args, **kwargs)
@@ -38,12 +123,55 @@ def cache(key_suffix: str, expires: timedelta = DEFAULT_EXPIRATION_TIME):
     return wrapper
 
 
-def cache_invalidate(key_suffix: str):
+def cache_many(key_suffix: str, expires: timedelta = DEFAULT_EXPIRATION_TIME):
     """
-    Decorator for invalidating a cache entry.
+    Decorator for caching the results of a function of many users, sharing the cache entries of `cache`.
+    Cached entries are read with one MGET, the function is called once with the users missing
+    from the cache and its results are stored in one pipeline.
 
     Args:
-        key_suffix (str): Suffix for the cache key.
+        key_suffix (str): Suffix for the cache keys.
+        expires (timedelta, optional): Expiration time for the cache. Defaults to DEFAULT_EXPIRATION_TIME.
+
+    Returns:
+        function: Decorated function, taking a list of user IDs and returning a dict of results by user ID.
+    """
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(user_ids, *args, **kwargs):
+            if not user_ids:
+                return {}
+            generation = int(redis_db.get(generation_key(key_suffix)) or 0)
+            keys = {user_id: f'{user_id}_{key_suffix}_v{generation}' for user_id in user_ids}
+            items = {}
+            missing = []
+            for user_id, item in zip(keys, redis_db.mget(list(keys.values()))):
+                if not item:
+                    missing.append(user_id)
+                else:
+                    items[user_id] = json.loads(item.decode('utf-8'))
+            if missing:
+                computed = fn(missing, *args, **kwargs)
+                pipeline = redis_db.pipeline(transaction=False)
+                for user_id in missing:
+                    items[user_id] = computed[user_id]
+                    pipeline.setex(keys[user_id], expires, json.dumps(computed[user_id]))
+                pipeline.execute()
+            return items
+
+        return decorator
+
+    return wrapper
+
+
+def cache_invalidate(*key_suffixes: str):
+    """
+    Decorator for invalidating the cache entries of a user in a method of the user model,
+    once the change is committed.
+
+    Args:
+        *key_suffixes (str): Suffixes for the cache keys.
 
     Returns:
         function: Decorated function.
@@ -51,10 +179,10 @@ def cache_invalidate(key_suffix: str):
 
     def wrapper(fn):
         @wraps(fn)
-        def decorator(user_id, *args, **kwargs):
-            key = f'{user_id}_{key_suffix}'
-            redis_db.delete(key)
-            return fn(user_id, *args, **kwargs)
+        def decorator(user, *args, **kwargs):
+            result = fn(user, *args, **kwargs)
+            invalidate_on_commit(user_keys=((user.id, key_suffix) for key_suffix in key_suffixes))
+            return result
 
         return decorator
 
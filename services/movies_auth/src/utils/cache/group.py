@@ -1,22 +1,24 @@
-from datetime import timedelta
 from functools import wraps
 
-from core.redis import redis_db
+from utils.cache.base import invalidate_group, invalidate_on_commit  # noqa: F401
 
-DEFAULT_EXPIRATION_TIME = timedelta(minutes=60)
 
+def cache_invalidate_group(*suffixes: str):
+    """
+    Decorator for invalidating the cache entries of groups, once the change is committed.
 
-def delete_items(match):
-    for key in redis_db.scan_iter(match=match, count=5000):
-        redis_db.delete(key)
+    Args:
+        *suffixes (str): Suffixes for the cache keys of the groups.
 
-
-def cache_invalidate_group(suffix: str):
+    Returns:
+        function: Decorated function.
+    """
     def decorator(fn):
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            delete_items(match=f'*_{suffix}')
-            return fn(*args, **kwargs)
+            result = fn(*args, **kwargs)
+            invalidate_on_commit(groups=suffixes)
+            return result
 
         return wrapper
 
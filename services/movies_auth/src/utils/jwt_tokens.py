@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Optional, Tuple
 from flask import Flask
 from flask_jwt_extended import (
     JWTManager,
@@ -20,7 +20,9 @@ def check_if_token_is_revoked(jwt_header, jwt_payload):
     Check if a JWT token is revoked.
 
     This function checks if a JWT token is revoked by looking up the token's JTI
-    in Redis. If the token is found and its value is 'revoked', the function returns True.
+    in the local revocation filter first: most tokens are not revoked and are let through
+    without a Redis round trip. Only filter hits are looked up in Redis, and if the token
+    is found and its value is 'revoked', the function returns True.
 
     Args:
         jwt_header: The header of the JWT token.
@@ -30,6 +32,8 @@ def check_if_token_is_revoked(jwt_header, jwt_payload):
         bool: True if the token is revoked, False otherwise.
     """
     jti = jwt_payload["jti"]
+    if not redis.revocation_filter.might_contain(jti):
+        return False
     token_in_redis = redis.redis_db.get(jti)
     return token_in_redis == b'revoked'
 
@@ -50,7 +54,7 @@ def init_jwt(app: Flask):
     jwt.init_app(app)
 
 
-def generate_tokens(user, user_agent: str) -> Tuple[str, str]:
+def generate_tokens(user, user_agent: str, replaced_refresh_jti: Optional[str] = None) -> Tuple[str, str]:
     """
     Generate access and refresh tokens for a user.
 
@@ -60,6 +64,7 @@ def generate_tokens(user, user_agent: str) -> Tuple[str, str]:
     Args:
         user: The user for whom to generate the tokens.
         user_agent (str): The user agent string of the client making the request.
+        replaced_refresh_jti (Optional[str]): The JTI of a refresh token to revoke along with saving the new tokens.
 
     Returns:
         Tuple[str, str]: The generated access token and refresh token.
@@ -83,5 +88,6 @@ def generate_tokens(user, user_agent: str) -> Tuple[str, str]:
         access_jti=get_jti(access_token),
         refresh_jti=get_jti(refresh_token),
         user_agent=user_agent,
+        replaced_refresh_jti=replaced_refresh_jti,
     )
     return access_token, refresh_token
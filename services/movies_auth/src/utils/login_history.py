@@ -0,0 +1,215 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+from time import monotonic, sleep
+from typing import Iterator, Optional
+
+import sqlalchemy
+from flask import Flask, has_app_context
+
+from core import config
+from core.db import db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_ATTEMPTS = 3
+# Seconds before the second attempt, doubled before each next one
+FLUSH_BACKOFF = 0.5
+# Seconds between attempts to write the spilled logins back while the database fails
+SPILL_RETRY_INTERVAL = 30
+# Seconds between checks of the monthly partitions left ahead
+PARTITIONS_CHECK_INTERVAL = 3600
+
+
+class LoginHistoryWriter:
+    """
+    Writes the login history in the background: logins are queued by the request and a thread
+    of each process inserts them in multi-row batches, so logging in costs no database write.
+
+    The queue is bounded by LOGIN_HISTORY_BUFFER_SIZE; when it is full the login is written
+    by the request itself, so logins are never dropped to keep up. The queued logins are
+    flushed when the process exits.
+
+    A batch still failing after FLUSH_ATTEMPTS attempts is spilled to LOGIN_HISTORY_SPILL_FILE,
+    shared by the processes, and written back by the first thread finding the database reachable.
+    """
+
+    def __init__(self):
+        self.app: Optional[Flask] = None
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._replay_at = 0.0
+        self._check_partitions_at = 0.0
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        atexit.register(self.stop)
+
+    def add(self, user_id, ip_address: str, time: datetime) -> None:
+        """
+        Queue a login of a user.
+
+        Args:
+            user_id: The ID of the user.
+            ip_address (str): The IP address the user logged in from.
+            time (datetime): The time of the login.
+        """
+        login = {'id': uuid.uuid4(), 'ip_address': ip_address, 'time': time, 'user': user_id}
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(login)
+        except queue.Full:
+            self._insert([login])
+
+    def stop(self) -> None:
+        """
+        Flush the queued logins and stop the thread of the current process.
+        """
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Logins queued before a fork belong to the parent process
+            self._queue = queue.Queue(maxsize=config.LOGIN_HISTORY_BUFFER_SIZE)
+            self._thread = threading.Thread(target=self._run, name='login-history', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch = []
+            try:
+                item = self._queue.get(timeout=config.LOGIN_HISTORY_FLUSH_INTERVAL)
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= config.LOGIN_HISTORY_BATCH_SIZE:
+                        break
+                    item = self._queue.get_nowait()
+                stopped = item is None
+            except queue.Empty:
+                pass
+            self._check_partitions()
+            if batch and not self._flush(batch):
+                continue
+            self._replay_spilled()
+
+    def _flush(self, batch: list[dict]) -> bool:
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            try:
+                self._insert(batch)
+                return True
+            except Exception:
+                logger.exception('Failed to write %d logins (attempt %d)', len(batch), attempt)
+            if attempt < FLUSH_ATTEMPTS:
+                sleep(FLUSH_BACKOFF * 2 ** (attempt - 1))
+        self._spill(batch)
+        return False
+
+    @contextmanager
+    def _spill_locked(self) -> Iterator[None]:
+        with open(f'{config.LOGIN_HISTORY_SPILL_FILE}.lock', 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _spill(self, batch: list[dict]) -> None:
+        lines = ''.join(
+            json.dumps({
+                'id': str(login['id']),
+                'ip_address': login['ip_address'],
+                'time': login['time'].isoformat(),
+                'user': str(login['user']),
+            }) + '\n'
+            for login in batch
+        )
+        try:
+            with self._spill_locked(), open(config.LOGIN_HISTORY_SPILL_FILE, 'a') as f:
+                f.write(lines)
+        except OSError:
+            logger.exception('Dropped %d logins', len(batch))
+            return
+        logger.warning('Spilled %d logins to %s', len(batch), config.LOGIN_HISTORY_SPILL_FILE)
+
+    def _replay_spilled(self) -> None:
+        if monotonic() < self._replay_at or not os.path.exists(config.LOGIN_HISTORY_SPILL_FILE):
+            return
+        with self._spill_locked():
+            with open(config.LOGIN_HISTORY_SPILL_FILE) as f:
+                logins = [json.loads(line) for line in f if line.strip()]
+            if not logins:
+                return
+            for login in logins:
+                login['id'] = uuid.UUID(login['id'])
+                login['time'] = datetime.fromisoformat(login['time'])
+                login['user'] = uuid.UUID(login['user'])
+            try:
+                self._insert(logins)
+            except Exception:
+                logger.exception('Failed to write %d spilled logins', len(logins))
+                self._replay_at = monotonic() + SPILL_RETRY_INTERVAL
+                return
+            # Written in one transaction, so the file is emptied only once all of them are in
+            os.truncate(config.LOGIN_HISTORY_SPILL_FILE, 0)
+        logger.info('Wrote %d spilled logins', len(logins))
+
+    def _check_partitions(self) -> None:
+        # Alerts while `flask app logins-partitions` has not run for long, before logins get spilled
+        from models.additions.partitions import get_user_logins_partitions_end_query
+
+        if monotonic() < self._check_partitions_at:
+            return
+        self._check_partitions_at = monotonic() + PARTITIONS_CHECK_INTERVAL
+        try:
+            with nullcontext() if has_app_context() else self.app.app_context():
+                with db.engine.connect() as connection:
+                    end = connection.execute(sqlalchemy.text(get_user_logins_partitions_end_query())).scalar()
+        except Exception:
+            logger.exception('Failed to check the login history partitions')
+            return
+        today = date.today()
+        months_ahead = (end.year - today.year) * 12 + end.month - today.month - 1 if end else -1
+        if months_ahead < config.DB_USER_LOGINS_PARTITIONS_MIN_AHEAD:
+            logger.error(
+                'Login history partitions end on %s, %d months ahead: run flask app logins-partitions',
+                end, months_ahead,
+            )
+
+    def _insert(self, logins: list[dict]) -> None:
+        # Imported here: models import the application, which initializes the writer
+        from models.users import UserLogin
+
+        # A connection of its own keeps the session of the request untouched
+        with nullcontext() if has_app_context() else self.app.app_context():
+            with db.engine.begin() as connection:
+                for start in range(0, len(logins), config.LOGIN_HISTORY_BATCH_SIZE):
+                    batch = logins[start:start + config.LOGIN_HISTORY_BATCH_SIZE]
+                    connection.execute(UserLogin.__table__.insert().values(batch))
+
+
+login_history = LoginHistoryWriter()
+
+
+def init_login_history(app: Flask):
+    """
+    Initialize the login history writer with the application.
+
+    Args:
+        app (Flask): The Flask application the logins are written with.
+    """
+    login_history.init_app(app)
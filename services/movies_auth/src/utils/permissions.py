@@ -1,10 +1,130 @@
+import json
+import time
+from datetime import timedelta
 from functools import wraps
-from typing import Union, Optional
+from typing import Callable, Union, Optional
 
 from flask import abort
 from flask_jwt_extended import get_jwt_identity
 
+from models.permission import Permission
 from models.users import User
+from utils.cache.base import cache, cache_many
+
+# Compiled permissions queries are kept in memory for a while, so a permission
+# created after a query was compiled is taken into account within that time
+PREDICATES_TTL = 60
+PREDICATES_MAX_SIZE = 1024
+
+_predicates: dict[str, tuple[float, Callable[[int], bool]]] = {}
+
+
+@cache(key_suffix='combined_permissions', expires=timedelta(minutes=60))
+def get_combined_permissions(user_id: str) -> Optional[list[dict]]:
+    """
+    Combined permissions of a user, cached until they change.
+    :param user_id: ID of the user.
+    :return: Permissions sorted by name, as served by the combined permissions endpoint, or None for unknown users.
+    """
+    user = User.query.filter_by(id=user_id).first()
+    if not user:
+        return None
+    return [
+        {'uuid': str(permission.id), 'name': permission.name, 'description': permission.description}
+        for permission in user.combined_permissions
+    ]
+
+
+@cache(key_suffix='combined_permissions_mask', expires=timedelta(minutes=60))
+def get_combined_permissions_mask(user_id: str) -> Optional[int]:
+    """
+    Combined permissions of a user as a bitmask of their bit indexes, cached until they change.
+    :param user_id: ID of the user.
+    :return: Bitmask of the permissions, or None for unknown users.
+    """
+    user = User.query.filter_by(id=user_id).first()
+    if not user:
+        return None
+    return user.combined_permissions_mask
+
+
+@cache_many(key_suffix='combined_permissions_mask', expires=timedelta(minutes=60))
+def get_combined_permissions_masks(user_ids: list[str]) -> dict[str, Optional[int]]:
+    """
+    Combined permissions of many users as bitmasks, sharing the cache of get_combined_permissions_mask.
+    Users missing from the cache are resolved with one query.
+    :param user_ids: IDs of the users, as strings of valid UUIDs.
+    :return: Bitmask of the permissions by user ID, None for unknown users.
+    """
+    masks = User.get_combined_permissions_masks(user_ids)
+    return {user_id: masks.get(user_id) for user_id in user_ids}
+
+
+def compile_permissions_query(permissions_query: str) -> Callable[[int], bool]:
+    """
+    Compiles a permissions query into a predicate over permission bitmasks,
+    equivalent to User.check_permissions_set over the permission names.
+    Predicates are cached by query for PREDICATES_TTL seconds.
+    :param permissions_query: Permissions query as JSON, e.g. {"any": ["perm_1", {"all": ["perm_2", "perm_3"]}]}
+    :return: Predicate telling if a bitmask satisfies the query.
+    """
+    return compile_permissions_queries([permissions_query])[permissions_query]
+
+
+def compile_permissions_queries(permissions_queries: list[str]) -> dict[str, Callable[[int], bool]]:
+    """
+    Compiles many permissions queries, resolving the permissions of all the queries missing
+    from the cache with one query.
+    :param permissions_queries: Permissions queries as JSON.
+    :return: Predicates by permissions query.
+    """
+    now = time.monotonic()
+    predicates = {}
+    missing = {}
+    for permissions_query in permissions_queries:
+        cached = _predicates.get(permissions_query)
+        if cached and now - cached[0] < PREDICATES_TTL:
+            predicates[permissions_query] = cached[1]
+        elif permissions_query not in missing:
+            missing[permissions_query] = json.loads(permissions_query)
+    if not missing:
+        return predicates
+
+    bits = Permission.get_bits(set().union(*map(_get_query_names, missing.values())))
+    if len(_predicates) + len(missing) > PREDICATES_MAX_SIZE:
+        _predicates.clear()
+    for permissions_query, query in missing.items():
+        predicates[permissions_query] = _compile_permissions_query(query, bits)
+        _predicates[permissions_query] = (now, predicates[permissions_query])
+    return predicates
+
+
+def _get_query_names(query: dict) -> set[str]:
+    names = set()
+    for condition in next(iter(query.values())):
+        if isinstance(condition, dict):
+            names |= _get_query_names(condition)
+        else:
+            names.add(str(condition))
+    return names
+
+
+def _compile_permissions_query(query: dict, bits: dict[str, int]) -> Callable[[int], bool]:
+    key, value = next(iter(query.items()))
+    names = [str(c) for c in value if not isinstance(c, dict)]
+    children = [_compile_permissions_query(c, bits) for c in value if isinstance(c, dict)]
+    # Permissions that do not exist can not be granted, they are left out of the mask
+    mask = 0
+    for name in names:
+        if name in bits:
+            mask |= 1 << bits[name]
+
+    if key == 'any':
+        return lambda permissions: bool(permissions & mask) or any(child(permissions) for child in children)
+
+    if any(name not in bits for name in names):
+        return lambda permissions: False
+    return lambda permissions: permissions & mask == mask and all(child(permissions) for child in children)
 
 
 def permissions_required(*permissions: str, condition: Optional[dict] = None):
@@ -25,18 +145,16 @@ def permissions_required(*permissions: str, condition: Optional[dict] = None):
             {'any': ['perm_1', {'all': ['perm_2', 'perm_3']}]}
     """
 
+    permissions_query = json.dumps(_get_permissions_query(*permissions, condition=condition))
+
     def wrapper(fn):
         @wraps(fn)
         def decorator(*args, **kwargs):
-            user_id = get_jwt_identity()
-            user = User.query.filter_by(id=user_id).first()
-            if not user:
+            permissions_mask = get_combined_permissions_mask(get_jwt_identity())
+            if permissions_mask is None:
                 return abort(409)
 
-            permissions_query = _get_permissions_query(
-                *permissions, condition=condition
-            )
-            if not user.check_permissions(permissions_query):
+            if not compile_permissions_query(permissions_query)(permissions_mask):
                 return abort(403)
 
             return fn(*args, **kwargs)
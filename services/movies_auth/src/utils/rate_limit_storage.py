@@ -0,0 +1,145 @@
+import math
+import threading
+import time
+
+from limits.limits import GRANULARITIES
+from limits.storage import RedisStorage
+
+from core import config
+
+# Leases kept per process; past this many keys they are all dropped, losing their unused tokens
+LEASES_MAX_SIZE = 100000
+
+# Sliding window counter: the count of a window is the count of the current fixed window plus
+# the count of the previous one weighted by the part of it still inside the sliding window.
+# Up to ARGV[3] tokens are leased at once, a fraction ARGV[4] of the remaining budget at most,
+# so the leases shrink as the budget runs out. Returns the leased tokens and the new count.
+#
+# KEYS[1], KEYS[2]: counters of the current and previous fixed windows
+# ARGV[1]: limit, ARGV[2]: weight of the previous window, ARGV[5]: window length in seconds
+_LEASE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local used = math.floor(previous * tonumber(ARGV[2])) + current
+local remaining = tonumber(ARGV[1]) - used
+if remaining <= 0 then
+    return {0, used}
+end
+local lease = math.max(1, math.min(tonumber(ARGV[3]), math.floor(remaining * tonumber(ARGV[4]))))
+lease = math.min(lease, remaining)
+redis.call('INCRBY', KEYS[1], lease)
+redis.call('EXPIRE', KEYS[1], 2 * tonumber(ARGV[5]))
+return {lease, used + lease}
+"""
+
+
+class LeasedRedisStorage(RedisStorage):
+    """
+    Rate limit storage leasing tokens from budgets held in Redis, for the fixed-window strategy
+    of flask_limiter (`leased+redis://host:port`). Each process takes tokens from Redis a lease
+    at a time with a Lua script and admits requests from its lease without a round trip;
+    the budget of a limit is a sliding window counter, see _LEASE_SCRIPT.
+
+    Leasing only pays off on large limits shared by many requests, such as a limit of a whole
+    endpoint: a lease is a fraction of the remaining budget, so a limit under
+    1 / RATELIMIT_LEASE_FRACTION leases one token per request, and per-IP limits of a few requests
+    are rarely hit twice by one process within a window. Limits under RATELIMIT_LEASE_MIN_LIMIT,
+    which are all the limits the service sets today, are counted as the plain `redis://` storage
+    does, one INCR per request. See benchmarks/rate_limiter.py for the round trips saved.
+
+    Accuracy, with P processes, a limit of L per window and a lease of at most M tokens:
+    - A process never admits more than its lease and leases never exceed the budget, so no fixed
+      window admits more than L requests, and the sliding window estimate never exceeds L. The
+      estimate assumes the requests of the previous window were spread evenly over it.
+    - Leased tokens a process did not use by the end of the fixed window are lost, so up to
+      P * M requests of a window may be rejected early. Leases are at most a fraction of the
+      remaining budget, so small limits (under 1 / RATELIMIT_LEASE_FRACTION) lease one token at
+      a time and are exact, at the cost of a round trip per request.
+    - When the budget is exhausted, a process rejects requests without a round trip for
+      window / L seconds, about the time a token takes to free up in the sliding window: each
+      process may reject the requests of one such interval that the budget would have admitted.
+    - Rate limit headers report the count seen by the process at its last lease.
+    """
+
+    STORAGE_SCHEME = ['leased+redis']
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, uri: str, **options):
+        super().__init__(uri.replace('leased+', '', 1), **options)
+        self.redis_db = self.storage
+        self.lease_script = self.redis_db.register_script(_LEASE_SCRIPT)
+        # key -> [fixed window, tokens left, count at the last lease, time to lease again when exhausted]
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+
+    @staticmethod
+    def _get_limit(key: str) -> int:
+        # Keys of limits end with '/{amount}/{multiples}/{granularity}'
+        return int(key.split('/')[-3])
+
+    @staticmethod
+    def _counter_key(key: str, window: int) -> str:
+        return f'{key}/{window}'
+
+    @staticmethod
+    def _is_leased(key: str) -> bool:
+        return LeasedRedisStorage._get_limit(key) >= config.RATELIMIT_LEASE_MIN_LIMIT
+
+    def incr(self, key: str, expiry: int, elastic_expiry=False) -> int:
+        if not self._is_leased(key):
+            return super().incr(key, expiry, elastic_expiry)
+        limit = self._get_limit(key)
+        now = self.clock()
+        window = int(now // expiry)
+        with self._leases_lock:
+            lease = self._leases.get(key)
+            if lease and lease[0] == window and lease[1] > 0:
+                lease[1] -= 1
+                return min(lease[2], limit)
+            if lease and now < lease[3]:
+                return limit + 1
+
+        weight = 1 - (now % expiry) / expiry
+        leased, used = self.lease_script(
+            keys=[self._counter_key(key, window), self._counter_key(key, window - 1)],
+            args=[limit, weight, config.RATELIMIT_LEASE_MAX, config.RATELIMIT_LEASE_FRACTION, expiry],
+        )
+        with self._leases_lock:
+            if len(self._leases) >= LEASES_MAX_SIZE:
+                self._leases.clear()
+            retry_at = now if leased else now + expiry / limit
+            self._leases[key] = [window, max(leased - 1, 0), used, retry_at]
+        # The fixed-window strategy admits the request while the returned count is within the limit
+        return min(used, limit) if leased else limit + 1
+
+    def get(self, key: str) -> int:
+        if not self._is_leased(key):
+            return super().get(key)
+        lease = self._leases.get(key)
+        return lease[2] if lease else 0
+
+    def get_expiry(self, key: str) -> int:
+        if not self._is_leased(key):
+            return super().get_expiry(key)
+        expiry = self._get_expiry_seconds(key)
+        return (math.floor(time.time() / expiry) + 1) * expiry
+
+    def reset(self):
+        with self._leases_lock:
+            self._leases.clear()
+        return super().reset()
+
+    def clear(self, key: str):
+        if not self._is_leased(key):
+            return super().clear(key)
+        with self._leases_lock:
+            self._leases.pop(key, None)
+        expiry = self._get_expiry_seconds(key)
+        window = int(time.time() // expiry)
+        self.redis_db.delete(self._counter_key(key, window), self._counter_key(key, window - 1))
+
+    @staticmethod
+    def _get_expiry_seconds(key: str) -> int:
+        *_, multiples, granularity = key.split('/')
+        return int(multiples) * GRANULARITIES[granularity].granularity[0]
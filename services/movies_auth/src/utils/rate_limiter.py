@@ -3,6 +3,8 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_ipaddr as get_remote_address
 
 from core import config
+# Registers the leased+redis storage scheme
+from utils import rate_limit_storage  # noqa: F401
 
 
 limiter = Limiter(key_func=get_remote_address)
@@ -0,0 +1,201 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+# Set to done by the one-off copy of the revocations made before the stream existed (flask app backfill-revocations)
+BACKFILL_KEY = f'{config.REVOCATIONS_STREAM}_backfill'
+BACKFILL_BATCH = 1000
+# Keys of tokens are their JTIs, uuid4 strings
+JTI_PATTERN = '-'.join('[0-9a-f]' * length for length in (8, 4, 4, 4, 12))
+READ_BATCH = 10000
+
+
+class BloomFilter:
+    """
+    A Bloom filter of strings: `in` never misses an added item and wrongly matches
+    other items with about `error_rate` probability while `capacity` is not exceeded.
+
+    Args:
+        capacity (int): Expected number of items.
+        error_rate (float): Expected false positive rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing: k positions out of the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & 1 << (position & 7) for position in self._positions(item))
+
+    @property
+    def full(self) -> bool:
+        return self.count > self.capacity
+
+
+class RevocationFilter:
+    """
+    Per-process filter of the JTIs of revoked tokens, kept in sync with the stream of
+    revocations by a background thread. A token missing from the filter is known not to be
+    revoked without asking Redis; a hit may be a false positive, so it is checked in Redis.
+
+    The filter is rebuilt from the stream when the process starts using it (after a fork too)
+    and when it holds more revocations than its capacity. The stream is trimmed to the lifetime
+    of refresh tokens, so the rebuilt filter drops the revocations of expired tokens. Its capacity
+    is REVOCATION_FILTER_CAPACITY, or twice the length of the stream when that is larger.
+
+    While the thread has not read the stream for longer than REVOCATION_FILTER_MAX_LAG, and until
+    the revocations made before the stream existed are copied into it, the filter is not trusted
+    and every check goes to Redis. Revocations made by the process itself are added right away.
+
+    Args:
+        redis_db (redis.Redis): The Redis client.
+    """
+
+    def __init__(self, redis_db: redis.Redis):
+        self.redis_db = redis_db
+        self._filter: Optional[BloomFilter] = None
+        self._last_id = '0-0'
+        self._synced_at = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._backfill_warned = False
+
+    def might_contain(self, jti: str) -> bool:
+        """
+        Check if a JTI may be revoked.
+
+        Args:
+            jti (str): The JTI of the token.
+
+        Returns:
+            bool: False if the token is surely not revoked, True if it has to be checked in Redis.
+        """
+        self._ensure_started()
+        if time.monotonic() - self._synced_at > config.REVOCATION_FILTER_MAX_LAG:
+            return True
+        return jti in self._filter
+
+    def add(self, jti: str) -> None:
+        """
+        Add a JTI revoked by this process, so it is rejected before the thread reads it back from the stream.
+
+        Args:
+            jti (str): The JTI of the token.
+        """
+        if self._filter is not None:
+            self._filter.add(jti)
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._synced_at = 0.0
+            threading.Thread(target=self._sync, name='revocation-filter', daemon=True).start()
+
+    def _rebuild(self) -> bool:
+        if self.redis_db.get(BACKFILL_KEY) != b'done':
+            if not self._backfill_warned:
+                logger.warning('Revocations are not copied into the stream yet, run flask app backfill-revocations')
+                self._backfill_warned = True
+            return False
+        # Room for as many revocations again as the stream holds, so the new filter is not full right away
+        capacity = max(config.REVOCATION_FILTER_CAPACITY, 2 * self.redis_db.xlen(config.REVOCATIONS_STREAM))
+        revocations = BloomFilter(capacity, config.REVOCATION_FILTER_ERROR_RATE)
+        last_id = '-'
+        while entries := self.redis_db.xrange(config.REVOCATIONS_STREAM, min=last_id, count=READ_BATCH):
+            for entry_id, fields in entries:
+                revocations.add(fields[b'jti'].decode())
+            # Exclusive range start: the next batch begins after the last entry read
+            last_id = f'({entries[-1][0].decode()}'
+        self._filter = revocations
+        self._last_id = last_id[1:] if last_id != '-' else '0-0'
+        self._synced_at = time.monotonic()
+        return True
+
+    def _sync(self) -> None:
+        while True:
+            try:
+                if (self._filter is None or self._filter.full) and not self._rebuild():
+                    time.sleep(config.REVOCATION_FILTER_READ_BLOCK_MS / 1000)
+                    continue
+                response = self.redis_db.xread(
+                    {config.REVOCATIONS_STREAM: self._last_id},
+                    count=READ_BATCH,
+                    block=config.REVOCATION_FILTER_READ_BLOCK_MS,
+                )
+                for _, entries in response:
+                    for entry_id, fields in entries:
+                        self._filter.add(fields[b'jti'].decode())
+                        self._last_id = entry_id.decode()
+                self._synced_at = time.monotonic()
+            except redis.RedisError:
+                logger.exception('Failed to sync the revocation filter')
+                time.sleep(config.REVOCATION_FILTER_READ_BLOCK_MS / 1000)
+
+
+def stream_min_id() -> str:
+    """
+    Returns the oldest stream ID worth keeping: revocations older than the lifetime
+    of refresh tokens concern expired tokens only.
+    """
+    return str(int((time.time() - config.REFRESH_EXPIRES.total_seconds()) * 1000))
+
+
+def backfill_revocations(redis_db: redis.Redis) -> int:
+    """
+    Copy the revocations made before the stream existed into it. Run once, by
+    flask app backfill-revocations: it scans the token keys of the whole database.
+
+    Args:
+        redis_db (redis.Redis): The Redis client.
+
+    Returns:
+        int: The number of copied revocations.
+    """
+    copied = 0
+    keys = []
+    for key in redis_db.scan_iter(match=JTI_PATTERN, count=BACKFILL_BATCH):
+        keys.append(key)
+        if len(keys) == BACKFILL_BATCH:
+            copied += _backfill_batch(redis_db, keys)
+            keys = []
+    if keys:
+        copied += _backfill_batch(redis_db, keys)
+    redis_db.set(BACKFILL_KEY, 'done')
+    return copied
+
+
+def _backfill_batch(redis_db: redis.Redis, keys: list) -> int:
+    pipeline = redis_db.pipeline(transaction=False)
+    for key, value in zip(keys, redis_db.mget(keys)):
+        if value == b'revoked':
+            pipeline.xadd(config.REVOCATIONS_STREAM, {'jti': key})
+    return len(pipeline.execute())
@@ -0,0 +1,130 @@
+"""
+Checks the accuracy bounds of LeasedRedisStorage under concurrency. Several storages share one
+fakeredis server, which runs the real lease script atomically with Lua, and the clock steps
+forward on every read so each run is repeatable.
+
+Run from services/movies_auth:
+    PYTHONPATH=src pytest tests
+"""
+import threading
+from collections import Counter
+
+import pytest
+
+limits = pytest.importorskip('limits')
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+import redis  # noqa: E402
+
+from core import config  # noqa: E402
+from utils.rate_limit_storage import LeasedRedisStorage  # noqa: E402
+
+PROCESSES = 4
+THREADS = 2
+WINDOWS = 4
+# Requests per window, over the storages, as a multiple of the limit
+LOAD = 3
+
+
+class SteppedClock:
+    """
+    Clock moving forward by a step on every read, remembering the time each thread read last.
+    """
+
+    def __init__(self, start: float, step: float):
+        self.now = start
+        self.step = step
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __call__(self) -> float:
+        with self.lock:
+            self.now += self.step
+            self.local.now = self.now
+        return self.local.now
+
+
+@pytest.fixture
+def make_storage(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis, 'from_url', lambda uri, **options: fakeredis.FakeRedis(server=server))
+    return lambda: LeasedRedisStorage('leased+redis://localhost:6379')
+
+
+def admitted_by_half_window(make_storage, limit: str) -> Counter:
+    item = limits.parse(limit)
+    expiry = item.get_expiry()
+    key = item.key_for('test')
+    start = 1000000 * expiry
+    end = start + WINDOWS * expiry
+    clock = SteppedClock(start, expiry / (item.amount * LOAD))
+    admitted = Counter()
+    admitted_lock = threading.Lock()
+
+    def run(storage: LeasedRedisStorage):
+        while True:
+            # As the fixed-window strategy of flask_limiter does
+            is_admitted = storage.incr(key, expiry) <= item.amount
+            if clock.local.now >= end:
+                return
+            if is_admitted:
+                with admitted_lock:
+                    admitted[int(clock.local.now // (expiry / 2))] += 1
+
+    workers = []
+    for _ in range(PROCESSES):
+        storage = make_storage()
+        storage.clock = clock
+        workers += [threading.Thread(target=run, args=(storage,)) for _ in range(THREADS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return admitted
+
+
+def admitted_by_window(make_storage, limit: str) -> Counter:
+    admitted = Counter()
+    for half_window, count in admitted_by_half_window(make_storage, limit).items():
+        admitted[half_window // 2] += count
+    return admitted
+
+
+@pytest.mark.parametrize('limit', ['1000/minute', '100/minute'])
+def test_no_window_admits_more_than_limit(make_storage, limit):
+    amount = limits.parse(limit).amount
+    admitted = admitted_by_window(make_storage, limit)
+
+    assert len(admitted) == WINDOWS
+    assert max(admitted.values()) <= amount
+
+
+@pytest.mark.parametrize('limit', ['1000/minute', '100/minute'])
+def test_leases_reject_at_most_processes_times_lease_max(make_storage, limit):
+    amount = limits.parse(limit).amount
+    admitted = admitted_by_window(make_storage, limit)
+
+    assert min(admitted.values()) >= amount - PROCESSES * config.RATELIMIT_LEASE_MAX
+
+
+@pytest.mark.parametrize('limit', ['1000/minute', '100/minute'])
+def test_sliding_window_spreads_admissions_over_the_window(make_storage, limit):
+    amount = limits.parse(limit).amount
+    admitted = admitted_by_half_window(make_storage, limit)
+
+    # The first window has no previous one to weigh and admits its whole limit at once
+    first_halves = [count for half_window, count in sorted(admitted.items()) if half_window % 2 == 0][1:]
+    assert max(first_halves) <= amount / 2 + PROCESSES * config.RATELIMIT_LEASE_MAX
+
+
+def test_small_limits_are_counted_without_leases(make_storage):
+    storage = make_storage()
+    item = limits.parse('5/second')
+    key = item.key_for('test')
+
+    counts = [storage.incr(key, item.get_expiry()) for _ in range(7)]
+
+    assert counts == [1, 2, 3, 4, 5, 6, 7]
+    assert storage.get(key) == 7
+    assert not storage._leases
@@ -0,0 +1,157 @@
+"""
+Compares the list-based document models serialized with dataclasses.asdict + json.dumps
+with the slotted set-based models serialized to the bulk NDJSON body with orjson,
+over a synthetic batch of films built the way films_from_join builds them: one add_*
+call per row of the person x genre x file join.
+
+Run from services/movies_etl:
+    PYTHONPATH=postgres_to_es python benchmarks/documents.py --films 100000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+from elastic import bulk_body
+from models import Film, ShortFile, ShortGenre, ShortPerson
+
+
+@dataclass
+class ListShortPerson:
+    id: str
+    name: str
+
+
+@dataclass
+class ListShortGenre:
+    id: str
+    name: str
+
+
+@dataclass
+class ListShortFile:
+    id: str
+    path: str
+
+
+@dataclass
+class ListFilm:
+    """
+    The film model before slots and set-based dedup.
+    """
+    id: str
+    title: str
+    type: str = ''
+    rating: float = None
+    description: str = ''
+    creation_date: str = None
+    genre: List[ListShortGenre] = field(default_factory=list)
+    actors: List[ListShortPerson] = field(default_factory=list)
+    writers: List[ListShortPerson] = field(default_factory=list)
+    directors: List[ListShortPerson] = field(default_factory=list)
+    high_quality_file: List[ListShortFile] = field(default_factory=list)
+    middle_quality_file: List[ListShortFile] = field(default_factory=list)
+    low_quality_file: List[ListShortFile] = field(default_factory=list)
+
+    def add_genre(self, gen: ListShortGenre):
+        if gen not in self.genre:
+            self.genre.append(gen)
+
+    def add_person(self, person: ListShortPerson, role: str):
+        persons = {'actor': self.actors, 'writer': self.writers, 'director': self.directors}[role]
+        if person not in persons:
+            persons.append(person)
+
+    def add_video(self, file: ListShortFile, width: int):
+        files = self.high_quality_file if width >= 720 else self.middle_quality_file
+        if file not in files:
+            files.append(file)
+
+    @property
+    def as_dict(self):
+        return asdict(self)
+
+
+MODELS = {
+    'list + asdict + json': (ListFilm, ListShortGenre, ListShortPerson, ListShortFile),
+    'slots + set + orjson': (Film, ShortGenre, ShortPerson, ShortFile),
+}
+ROLES = ('actor', 'actor', 'actor', 'writer', 'director')
+MEMORY_SAMPLE = 1000
+
+
+def build(models: tuple, films: int, persons: int, genres: int, files: int) -> list:
+    film_model, genre_model, person_model, file_model = models
+    batch = []
+    for number in range(films):
+        film = film_model(id=f'film-{number}', title=f'Film {number}', rating=7.5, description='description')
+        for person in range(persons):
+            for genre in range(genres):
+                for file in range(files):
+                    film.add_genre(genre_model(id=f'genre-{genre}', name=f'Genre {genre}'))
+                    film.add_person(
+                        person_model(id=f'person-{number}-{person}', name=f'Person {person}'),
+                        role=ROLES[person % len(ROLES)],
+                    )
+                    film.add_video(file_model(id=f'file-{number}-{file}', path=f'/{number}/{file}.mp4'), width=1080)
+        batch.append(film)
+    return batch
+
+
+def serialize_json(documents: List[dict], chunk_size: int) -> int:
+    size = 0
+    for start in range(0, len(documents), chunk_size):
+        lines = []
+        for document in documents[start:start + chunk_size]:
+            lines.extend([json.dumps({'index': {'_index': 'movies', '_id': document['id']}}), json.dumps(document)])
+        size += len(('\n'.join(lines) + '\n').encode())
+    return size
+
+
+def serialize_orjson(documents: List[dict], chunk_size: int) -> int:
+    return sum(
+        len(bulk_body(documents[start:start + chunk_size], 'movies'))
+        for start in range(0, len(documents), chunk_size)
+    )
+
+
+def run(name: str, args: argparse.Namespace) -> None:
+    start_time = time.perf_counter()
+    batch = build(MODELS[name], args.films, args.persons, args.genres, args.files)
+    build_time = time.perf_counter() - start_time
+
+    # Tracing slows allocations down, so memory is measured on a separate sample
+    tracemalloc.start()
+    sample = build(MODELS[name], MEMORY_SAMPLE, args.persons, args.genres, args.files)
+    memory = tracemalloc.get_traced_memory()[0] * args.films / MEMORY_SAMPLE
+    tracemalloc.stop()
+    del sample
+
+    start_time = time.perf_counter()
+    documents = [film.as_dict for film in batch]
+    serialize = serialize_orjson if name.endswith('orjson') else serialize_json
+    size = serialize(documents, args.chunk_size)
+    serialize_time = time.perf_counter() - start_time
+
+    print(f'{name}:')
+    print(f'  build:     {build_time:.2f} seconds, ~{memory / 2 ** 20:.0f} MiB of films')
+    print(f'  serialize: {serialize_time:.2f} seconds, {size / 2 ** 20:.0f} MiB of bulk body\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=100000, help='number of films in the batch')
+    parser.add_argument('--persons', type=int, default=10, help='persons per film')
+    parser.add_argument('--genres', type=int, default=3, help='genres per film')
+    parser.add_argument('--files', type=int, default=2, help='files per film')
+    parser.add_argument('--chunk-size', type=int, default=500, help='documents per bulk request')
+    args = parser.parse_args()
+
+    for name in MODELS:
+        run(name, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares FW_QUERY (row-exploding join) with FW_AGG_QUERY (one aggregated row per film):
+rows transferred, query + fetch time and transform time for the same set of films.
+
+Run from services/movies_etl against a populated content schema:
+    PYTHONPATH=postgres_to_es python benchmarks/fw_query.py --films 1000 --iterations 5
+"""
+import argparse
+import time
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+import config
+import queries
+from pipelines import FilmWorkPipeline
+
+DSN = {
+    'dbname': config.POSTGRES_NAME,
+    'user': config.POSTGRES_USER,
+    'password': config.POSTGRES_PASSWORD,
+    'host': config.POSTGRES_HOST,
+    'port': config.POSTGRES_PORT,
+}
+
+MODES = {
+    'join': (queries.FW_QUERY, FilmWorkPipeline.films_from_join),
+    'aggregate': (queries.FW_AGG_QUERY, FilmWorkPipeline.films_from_aggregate),
+}
+
+
+def run(cursor, film_ids: list, mode: str, iterations: int) -> None:
+    query, transform = MODES[mode]
+    fetch_times, transform_times = [], []
+    rows, films = [], []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        cursor.execute(query, (film_ids,))
+        rows = cursor.fetchall()
+        fetch_times.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        films = transform(rows)
+        transform_times.append(time.perf_counter() - start_time)
+
+    print(f'{mode}:')
+    print(f'  rows transferred: {len(rows)} for {len(films)} films')
+    print(f'  query + fetch:    {sum(fetch_times) / iterations:.4f} seconds')
+    print(f'  transform:        {sum(transform_times) / iterations:.4f} seconds\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=1000, help='number of films to query')
+    parser.add_argument('--iterations', type=int, default=5, help='runs per query mode')
+    args = parser.parse_args()
+
+    with psycopg2.connect(**DSN) as connection, connection.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute('SELECT id FROM content.film_work LIMIT %s;', (args.films,))
+        film_ids = [row['id'] for row in cursor.fetchall()]
+        print(f'Benchmark over {len(film_ids)} films, {args.iterations} iterations\n')
+        for mode in MODES:
+            run(cursor, film_ids, mode, args.iterations)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
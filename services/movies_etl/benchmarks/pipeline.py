@@ -0,0 +1,284 @@
+"""
+Measures how FilmWorkPipeline scales with the size of the catalog.
+
+A synthetic content schema is generated into a scratch database, then the pipeline runs
+against an Elasticsearch sink that accepts every bulk request in memory, so only the ETL
+itself is measured: source rows and documents per second, peak RSS and the time spent
+in each stage, excluding the time spent in the stages downstream of it.
+
+Two runs are measured: a full load of all the films, then an incremental run after
+--changed-persons persons were updated, which goes through rename_nested with
+ETL_SYNC_MODE=cdc, or through collect_updated_ids and full rebuilds of their films otherwise.
+
+The scratch database must have the content schema (utils/schema_design in movies_admin)
+and is truncated. Run from services/movies_etl:
+    PYTHONPATH=postgres_to_es python benchmarks/pipeline.py --dbname movies_benchmark --films 100000
+"""
+import argparse
+import io
+import random
+import resource
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Generator, Iterator, List
+
+import psycopg2
+
+import config
+from elastic import ElasticsearchLoader
+from models import ModeBulk
+from pipelines import FilmWorkPipeline
+from postgres import PostgresProducer
+from state import JsonFileStorage, State
+
+STAGES = ('collect_changed_ids', 'collect_updated_ids', 'rename_nested', 'enrich', 'transform', 'load_to_es')
+ROLES = ('actor', 'actor', 'actor', 'writer', 'director')
+WIDTHS = (1080, 720, 480, 360)
+GENRE_POOL = 50
+FILMS_PER_COPY = 10000
+TABLES = ('file_film_work', 'person_film_work', 'genre_film_work', 'file', 'person', 'genre', 'film_work')
+
+
+class SinkIndices:
+    def create(self, index, body):
+        pass
+
+    def put_settings(self, index, body):
+        pass
+
+    def refresh(self, index):
+        pass
+
+
+class SinkElasticsearch:
+    """
+    Stands in for the Elasticsearch client: every document of a bulk request is accepted
+    and updates by query match nothing.
+    """
+
+    def __init__(self):
+        self.indices = SinkIndices()
+
+    def bulk(self, body: bytes, index: str) -> dict:
+        return {'errors': False, 'items': [{'index': {'status': 201}}] * (body.count(b'\n') // 2)}
+
+    def update_by_query(self, index: str, body: dict, **kwargs) -> dict:
+        return {'updated': 0, 'noops': 0, 'version_conflicts': 0, 'failures': []}
+
+
+class StageClock:
+    """
+    Adds up the time spent in every stage. Stages are coroutines calling each other
+    through send(), so the time of the stages downstream is taken out of their caller.
+    """
+
+    def __init__(self):
+        self.times = Counter()
+        self.rows = Counter()
+        self.children = []
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        self.children.append(0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.times[stage] += elapsed - self.children.pop()
+            if self.children:
+                self.children[-1] += elapsed
+
+    def wrap(self, stage: str, target: Generator) -> 'TimedTarget':
+        return TimedTarget(self, stage, target)
+
+
+class TimedTarget:
+    def __init__(self, clock: StageClock, stage: str, target: Generator):
+        self.clock = clock
+        self.stage = stage
+        self.target = target
+
+    def send(self, value):
+        if value:
+            self.clock.rows[self.stage] += len(value)
+        with self.clock.measure(self.stage):
+            return self.target.send(value)
+
+
+class BenchmarkFilmWorkPipeline(FilmWorkPipeline):
+    """
+    FilmWorkPipeline whose stages are timed by a StageClock.
+    """
+
+    def __init__(self, *args, clock: StageClock, **kwargs):
+        self.clock = clock
+        super().__init__(*args, **kwargs)
+
+    def collect_changed_ids(self, source: str, query: str, target: Generator) -> TimedTarget:
+        return self.clock.wrap('collect_changed_ids', super().collect_changed_ids(source, query, target))
+
+    def collect_updated_ids(self, query: str, target: Generator) -> TimedTarget:
+        return self.clock.wrap('collect_updated_ids', super().collect_updated_ids(query, target))
+
+    def rename_nested(self, query: str, fields: tuple) -> TimedTarget:
+        return self.clock.wrap('rename_nested', super().rename_nested(query, fields))
+
+    def enrich(self, query: str, target: Generator) -> TimedTarget:
+        return self.clock.wrap('enrich', super().enrich(query, target))
+
+    def transform(self, target: Generator) -> TimedTarget:
+        return self.clock.wrap('transform', super().transform(target))
+
+    def es_loader_coro(self, index_name: str) -> TimedTarget:
+        return self.clock.wrap('load_to_es', super().es_loader_coro(index_name))
+
+
+def new_id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def copy_rows(cursor, table: str, columns: tuple, rows: List[tuple]) -> None:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(str, row)) + '\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY content.{table} ({", ".join(columns)}) FROM STDIN', buffer)
+
+
+def populate(connection, args: argparse.Namespace) -> List[str]:
+    """
+    Fills the content schema with synthetic films, persons, genres and files.
+
+    Returns the IDs of the persons.
+    """
+    rng = random.Random(args.seed)
+    now = time.strftime('%Y-%m-%d %H:%M:%S+00', time.gmtime())
+    genre_ids = [new_id(rng) for _ in range(max(GENRE_POOL, args.genres))]
+    person_ids = [new_id(rng) for _ in range(max(args.persons, args.films * args.persons // args.person_reuse))]
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {", ".join(f"content.{table}" for table in TABLES)};')
+        copy_rows(cursor, 'genre', ('id', 'name', 'description', 'created', 'modified'), [
+            (genre_id, f'Genre {number}', 'description', now, now) for number, genre_id in enumerate(genre_ids)
+        ])
+        copy_rows(cursor, 'person', ('id', 'full_name', 'created', 'modified'), [
+            (person_id, f'Person {number}', now, now) for number, person_id in enumerate(person_ids)
+        ])
+        for start in range(0, args.films, FILMS_PER_COPY):
+            films, genres, persons, files, film_files = [], [], [], [], []
+            for number in range(start, min(start + FILMS_PER_COPY, args.films)):
+                film_id = new_id(rng)
+                films.append((
+                    film_id, f'Film {number}', 'description', '2000-01-01', f'/films/{number}',
+                    round(rng.uniform(1, 10), 1), 'movie', now, now,
+                ))
+                genres.extend(
+                    (new_id(rng), film_id, genre_id, now) for genre_id in rng.sample(genre_ids, args.genres)
+                )
+                persons.extend(
+                    (new_id(rng), film_id, person_id, ROLES[position % len(ROLES)], now)
+                    for position, person_id in enumerate(rng.sample(person_ids, args.persons))
+                )
+                for position in range(args.files):
+                    file_id = new_id(rng)
+                    width = WIDTHS[position % len(WIDTHS)]
+                    files.append((
+                        file_id, f'/films/{number}/{width}.mp4', 'mp4', 'h264',
+                        width, width * 9 // 16, 24, 'aac', 48000, 2, now, now,
+                    ))
+                    film_files.append((new_id(rng), film_id, file_id, now))
+            copy_rows(cursor, 'film_work', (
+                'id', 'title', 'description', 'creation_date', 'file_path', 'rating', 'type', 'created', 'modified',
+            ), films)
+            copy_rows(cursor, 'genre_film_work', ('id', 'film_work_id', 'genre_id', 'created'), genres)
+            copy_rows(cursor, 'person_film_work', ('id', 'film_work_id', 'person_id', 'role', 'created'), persons)
+            copy_rows(cursor, 'file', (
+                'id', 'file_path', 'file_format', 'video_codec', 'video_width', 'video_height', 'video_fps',
+                'audio_codec', 'audio_sample_rate', 'audio_channels', 'created', 'modified',
+            ), files)
+            copy_rows(cursor, 'file_film_work', ('id', 'film_work_id', 'file_id', 'created'), film_files)
+        cursor.execute('ANALYZE;')
+    connection.commit()
+    return person_ids
+
+
+def peak_rss() -> float:
+    """
+    Returns the peak resident set size of the process in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run(name: str, pipeline: BenchmarkFilmWorkPipeline, generators: List[Generator]) -> None:
+    clock = pipeline.clock
+    clock.times.clear()
+    clock.rows.clear()
+    started = time.perf_counter()
+    pipeline.sync(generators)
+    elapsed = time.perf_counter() - started
+
+    print(f'{name}: {elapsed:.2f} seconds, peak RSS {peak_rss():.0f} MiB')
+    print(f'  source rows: {clock.rows["transform"]} ({clock.rows["transform"] / elapsed:.0f} rows/sec)')
+    print(f'  documents:   {clock.rows["load_to_es"]} ({clock.rows["load_to_es"] / elapsed:.0f} docs/sec)')
+    for stage in STAGES:
+        print(f'  {stage + ":":<21}{clock.times[stage]:.4f} seconds')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dbname', required=True, help='scratch database, truncated and filled')
+    parser.add_argument('--films', type=int, default=10000, help='number of films')
+    parser.add_argument('--persons', type=int, default=10, help='persons per film')
+    parser.add_argument('--person-reuse', type=int, default=5, help='films per person on average')
+    parser.add_argument('--genres', type=int, default=3, help='genres per film')
+    parser.add_argument('--files', type=int, default=2, help='files per film')
+    parser.add_argument('--changed-persons', type=int, default=100, help='persons updated before the second run')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    args = parser.parse_args()
+    if args.dbname == config.POSTGRES_NAME:
+        parser.error(f'{args.dbname} is the database of the ETL, pick a scratch database')
+
+    dsn = {
+        'dbname': args.dbname,
+        'user': config.POSTGRES_USER,
+        'password': config.POSTGRES_PASSWORD,
+        'host': config.POSTGRES_HOST,
+        'port': config.POSTGRES_PORT,
+    }
+    connection = psycopg2.connect(**dsn)
+    started = time.perf_counter()
+    person_ids = populate(connection, args)
+    print(
+        f'Generated {args.films} films with {args.persons} persons, {args.genres} genres and '
+        f'{args.files} files each in {time.perf_counter() - started:.2f} seconds '
+        f'({config.ETL_FW_QUERY_MODE} query mode)\n'
+    )
+
+    es_loader = ElasticsearchLoader(['http://localhost:9200'], bulk_mode=ModeBulk.SERIAL.value, skip_unchanged=False)
+    es_loader.client = SinkElasticsearch()
+    pipeline = BenchmarkFilmWorkPipeline(
+        State(JsonFileStorage()), PostgresProducer(dsn), es_loader, clock=StageClock()
+    )
+    generators, _ = pipeline.build_process()
+    run('full load', pipeline, generators)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE content.person SET modified = clock_timestamp() WHERE id IN %s;',
+            (tuple(random.Random(args.seed).sample(person_ids, min(args.changed_persons, len(person_ids)))),),
+        )
+    connection.commit()
+    run(f'{args.changed_persons} persons changed', pipeline, generators)
+
+    pipeline.db_adapter.close()
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
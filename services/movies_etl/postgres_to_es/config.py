@@ -4,8 +4,30 @@ import os
 ETL_MODE = os.environ.get('ETL_MODE', 'default_mode')
 ETL_CHUNK_SIZE = int(os.environ.get('ETL_CHUNK_SIZE', 100))
 ETL_SYNC_DELAY = int(os.environ.get('ETL_SYNC_DELAY', 60))
+ETL_SYNC_MAX_DELAY = int(os.environ.get('ETL_SYNC_MAX_DELAY', 600))
+ETL_SYNC_MODE = os.environ.get('ETL_SYNC_MODE', 'polling')
+ETL_CDC_CHANNEL = os.environ.get('ETL_CDC_CHANNEL', 'content_changes')
+ETL_CDC_DEBOUNCE = float(os.environ.get('ETL_CDC_DEBOUNCE', 1))
+ETL_CDC_MAX_WAIT = float(os.environ.get('ETL_CDC_MAX_WAIT', 10))
+ETL_CDC_RESYNC_INTERVAL = int(os.environ.get('ETL_CDC_RESYNC_INTERVAL', 3600))
+# Longest expected transaction on the content tables: watermarks checkpointed from notifications stay behind by it
+ETL_CDC_WATERMARK_MARGIN = int(os.environ.get('ETL_CDC_WATERMARK_MARGIN', 300))
+ETL_STATE_BACKEND = os.environ.get('ETL_STATE_BACKEND', 'file')
 ETL_FILE_STATE = os.environ.get('ETL_FILE_STATE', 'state.json')
+ETL_SQLITE_STATE = os.environ.get('ETL_SQLITE_STATE', 'state.sqlite3')
+ETL_REDIS_STATE_KEY = os.environ.get('ETL_REDIS_STATE_KEY', 'etl_state')
 ETL_DEFAULT_DATE = os.environ.get('ETL_DEFAULT_DATE', '1970-01-01')
+ETL_BATCH_LIMIT = int(os.environ.get('ETL_BATCH_LIMIT', 1000))
+ETL_ID_TEMP_TABLE_THRESHOLD = int(os.environ.get('ETL_ID_TEMP_TABLE_THRESHOLD', 10000))
+ETL_FW_QUERY_MODE = os.environ.get('ETL_FW_QUERY_MODE', 'join')
+ETL_SKIP_UNCHANGED = os.environ.get('ETL_SKIP_UNCHANGED', 'true').lower() == 'true'
+# Renaming persons and genres in place is only safe when CDC reindexes the films of changed links,
+# polling sees the changed persons and genres only, so it always rebuilds their films
+ETL_PARTIAL_UPDATES = (
+    ETL_SYNC_MODE == 'cdc' and os.environ.get('ETL_PARTIAL_UPDATES', 'true').lower() == 'true'
+)
+ETL_REINDEX_WORKERS = int(os.environ.get('ETL_REINDEX_WORKERS', 4))
+ETL_DEAD_LETTER_FILE = os.environ.get('ETL_DEAD_LETTER_FILE', 'dead_letters.jsonl')
 
 # Postgres
 POSTGRES_NAME = os.environ.get('POSTGRES_NAME', 'postgres')
@@ -13,7 +35,16 @@ POSTGRES_USER = os.environ.get('POSTGRES_USER', 'user')
 POSTGRES_PASSWORD = os.environ.get('POSTGRES_PASSWORD', 'password')
 POSTGRES_HOST = os.environ.get('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.environ.get('POSTGRES_PORT', '5432')
+POSTGRES_POOL_SIZE = int(os.environ.get('POSTGRES_POOL_SIZE', 5))
 
 # Elasticsearch
 ELASTICSEARCH_HOST = os.environ.get('ELASTICSEARCH_HOST', 'localhost')
-ELASTICSEARCH_PORT = os.environ.get('ELASTICSEARCH_PORT', '9200')
\ No newline at end of file
+ELASTICSEARCH_PORT = os.environ.get('ELASTICSEARCH_PORT', '9200')
+ELASTICSEARCH_BULK_MODE = os.environ.get('ELASTICSEARCH_BULK_MODE', 'serial')
+ELASTICSEARCH_BULK_THREADS = int(os.environ.get('ELASTICSEARCH_BULK_THREADS', 4))
+ELASTICSEARCH_BULK_MAX_BYTES = int(os.environ.get('ELASTICSEARCH_BULK_MAX_BYTES', 10 * 1024 * 1024))
+ELASTICSEARCH_BULK_RETRIES = int(os.environ.get('ELASTICSEARCH_BULK_RETRIES', 3))
+
+# Redis
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
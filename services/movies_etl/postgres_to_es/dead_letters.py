@@ -0,0 +1,111 @@
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Iterator, List
+
+import orjson
+
+module_logger = logging.getLogger('DeadLetterStore')
+
+
+class DeadLetterStore:
+    """
+    Keeps the ids of the documents Elasticsearch rejected for good, with their error, as JSON lines.
+    Only ids are kept: a replay rebuilds the documents from the database, as a stored snapshot
+    could overwrite a newer version of the document.
+    Appends and rewrites hold a lock on a side file, so several processes can share the file.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def put(self, index_name: str, document: dict, result: dict) -> None:
+        """
+        Append a rejected document.
+
+        Args:
+            index_name (str): The name of the index the document was sent to.
+            document (dict): The rejected document.
+            result (dict): The bulk response item of the document.
+        """
+        module_logger.error(
+            'Failed to index %s into %s (status %s): %s',
+            document['id'], index_name, result.get('status'), result.get('error'),
+        )
+        dead_letter = {
+            'index': index_name,
+            'id': document['id'],
+            'status': result.get('status'),
+            'error': result.get('error'),
+            'failed_at': datetime.now(timezone.utc),
+        }
+        self.append(dead_letter)
+
+    def append(self, dead_letter: dict) -> None:
+        """
+        Append a dead letter as one line in a single write.
+
+        Args:
+            dead_letter (dict): The dead letter.
+        """
+        with self.locked(), open(self.file_path, 'ab') as f:
+            f.write(orjson.dumps(dead_letter) + b'\n')
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """
+        Hold the lock of the store, so appends never go to a file replaced by a rewrite.
+        """
+        with open(f'{self.file_path}.lock', 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def read_lines(self) -> List[bytes]:
+        """
+        Read the lines of the dead letters.
+
+        Returns:
+            List[bytes]: The non-empty lines in the order they were appended.
+        """
+        try:
+            with open(self.file_path, 'rb') as f:
+                return [line for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read(self) -> List[dict]:
+        """
+        Read all the dead letters.
+
+        Returns:
+            List[dict]: The dead letters in the order they were appended.
+        """
+        return [orjson.loads(line) for line in self.read_lines()]
+
+    @contextmanager
+    def take(self, select: Callable[[dict], bool]) -> Iterator[List[dict]]:
+        """
+        Take the selected dead letters out of the store. They are removed only when the block
+        succeeds, otherwise they stay for the next take. The store is rewritten with the remaining
+        dead letters, and the ones appended meanwhile, into a temporary file moved over it,
+        so an error never loses or duplicates a dead letter. Meant for one take at a time.
+
+        Args:
+            select (Callable[[dict], bool]): Whether a dead letter is taken.
+
+        Yields:
+            List[dict]: The selected dead letters in the order they were appended.
+        """
+        with self.locked():
+            lines = self.read_lines()
+        dead_letters = [orjson.loads(line) for line in lines]
+        yield [dead_letter for dead_letter in dead_letters if select(dead_letter)]
+        with self.locked():
+            appended = self.read_lines()[len(lines):]
+            kept = [line for line, dead_letter in zip(lines, dead_letters) if not select(dead_letter)]
+            temp_path = f'{self.file_path}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.writelines(kept + appended)
+            os.replace(temp_path, self.file_path)
@@ -1,35 +1,263 @@
+import asyncio
+import hashlib
 import json
 import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Generator, List
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Tuple
 
 import config
-from elasticsearch import Elasticsearch, exceptions
-from utils import backoff
+import orjson
+from elasticsearch import AsyncElasticsearch, Elasticsearch, exceptions, helpers
+from dead_letters import DeadLetterStore
+from elasticsearch.serializer import JSONSerializer
+from models import ModeBulk
+from utils import backoff, chunked
 
 # Logger for this module
 module_logger = logging.getLogger('ElasticsearchLoader')
 
+# Stored field keeping the hash of the indexed document, excluded from _source
+CONTENT_HASH_FIELD = 'content_hash'
+
+# Statuses of bulk items worth sending again: the cluster was overloaded or unavailable
+RETRIABLE_STATUSES = (429, 503)
+
+# Index settings for a full load into a new index, restored before it goes live
+BULK_INDEX_SETTINGS = {'number_of_replicas': 0, 'refresh_interval': '-1', 'translog': {'durability': 'async'}}
+
+# Renames the entries of nested fields in place, a no-op for documents where no name changes.
+# An update rewrites the document from _source, which leaves the content hash out,
+# so the next full rebuild of an updated document is never skipped as unchanged.
+RENAME_NESTED_SCRIPT = '''
+boolean changed = false;
+for (def field : params.fields) {
+    def entries = ctx._source[field];
+    if (entries == null) {
+        continue;
+    }
+    for (def entry : entries) {
+        def name = params.names[entry.id];
+        if (name != null && name != entry.name) {
+            entry.name = name;
+            changed = true;
+        }
+    }
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+'''
+
+# Seconds an update by query may take, it runs over every document of a renamed person
+UPDATE_BY_QUERY_TIMEOUT = 300
+
+
+def load_index_body(index_name: str) -> dict:
+    """
+    Read the settings and mappings of an index from the indexes directory.
+
+    :param index_name: Name of the index.
+    :return: Body of the index creation request.
+    """
+    index_dir = Path(__file__).resolve(strict=True).parent.joinpath('indexes')
+    with open(index_dir.joinpath(f'{index_name}.json'), 'r') as index_file:
+        return json.load(index_file)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Serializer of the client requests based on orjson.
+    """
+
+    def dumps(self, data) -> str:
+        if isinstance(data, str):
+            return data
+        return orjson.dumps(data, default=self.default).decode()
+
+
+def bulk_body(rows: List[dict], index_name: str) -> bytes:
+    """
+    Serialize rows to the NDJSON body of a bulk index request in one pass.
+
+    :param rows: Rows to be indexed.
+    :param index_name: Name of the index where rows will be loaded.
+    :return: Body of the bulk request.
+    """
+    lines = []
+    for row in rows:
+        lines.append(orjson.dumps({'index': {'_index': index_name, '_id': row['id']}}))
+        lines.append(orjson.dumps(row))
+    lines.append(b'')
+    return b'\n'.join(lines)
+
+
+def bulk_bodies(rows: List[dict], index_name: str, max_chunk_bytes: int) -> Generator[bytes, None, None]:
+    """
+    Serialize rows to the NDJSON bodies of bulk index requests of at most max_chunk_bytes bytes,
+    a row larger than that is sent alone.
+
+    :param rows: Rows to be indexed.
+    :param index_name: Name of the index where rows will be loaded.
+    :param max_chunk_bytes: Maximum size of one bulk request.
+    :return: Generator of bodies of bulk requests.
+    """
+    lines, size = [], 0
+    for row in rows:
+        action = orjson.dumps({'index': {'_index': index_name, '_id': row['id']}})
+        source = orjson.dumps(row)
+        row_size = len(action) + len(source) + 2
+        if lines and size + row_size > max_chunk_bytes:
+            yield b'\n'.join(lines + [b''])
+            lines, size = [], 0
+        lines += [action, source]
+        size += row_size
+    if lines:
+        yield b'\n'.join(lines + [b''])
+
+
+def is_retriable(error: exceptions.TransportError) -> bool:
+    """
+    Tell whether a failed request can be sent again: the connection failed, or Elasticsearch
+    is overloaded or unavailable for a while.
+
+    :param error: Error raised by the client.
+    """
+    return isinstance(error, exceptions.ConnectionError) or error.status_code in RETRIABLE_STATUSES
+
+
+def split_bulk_results(
+    documents: List[dict], items: List[dict]
+) -> Tuple[int, List[Tuple[dict, dict]], List[Tuple[dict, dict]]]:
+    """
+    Match the items of a bulk response with the documents sent, which come in the same order.
+
+    :param documents: Documents sent in the bulk request.
+    :param items: Items of the bulk response.
+    :return: Number of indexed documents, documents to send again and documents
+        rejected for good, both with their bulk response item.
+    """
+    indexed, retry, rejected = 0, [], []
+    for document, item in zip(documents, items):
+        result = next(iter(item.values()))
+        if 'error' not in result:
+            indexed += 1
+        elif result.get('status') in RETRIABLE_STATUSES:
+            retry.append((document, result))
+        else:
+            rejected.append((document, result))
+    return indexed, retry, rejected
+
+
+def rename_nested_body(fields: Iterable[str], names: Dict[str, str]) -> dict:
+    """
+    Build the body of an update by query renaming the entries of nested fields.
+
+    :param fields: Nested fields whose entries have an id and a name.
+    :param names: New names by id.
+    :return: Body of the update by query request.
+    """
+    ids = list(names)
+    return {
+        'query': {'bool': {
+            'should': [{'nested': {'path': field, 'query': {'terms': {f'{field}.id': ids}}}} for field in fields],
+            'minimum_should_match': 1,
+        }},
+        'script': {
+            'source': RENAME_NESTED_SCRIPT,
+            'lang': 'painless',
+            'params': {'fields': list(fields), 'names': names},
+        },
+    }
+
+
+def content_hash(document: dict) -> str:
+    """
+    Hash a document independently of the order of its keys.
+
+    :param document: Document to be hashed.
+    :return: Hex digest of the document.
+    """
+    return hashlib.sha1(orjson.dumps(document, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def has_content_hash(mapping: dict, index_name: str) -> bool:
+    """
+    Check that the mapping of an index stores content hashes.
+
+    Indexes created before the field was added reject documents with it,
+    as their mapping is strict, so unchanged documents cannot be skipped there.
+
+    :param mapping: Response of the get mapping request.
+    :param index_name: Name of the index.
+    """
+    properties = next(iter(mapping.values()))['mappings'].get('properties', {})
+    if CONTENT_HASH_FIELD in properties:
+        return True
+    module_logger.warning('%s has no %s field, recreate it to skip unchanged documents', index_name, CONTENT_HASH_FIELD)
+    return False
+
+
+def get_stored_hashes(response: dict) -> Dict[str, str]:
+    """
+    Read the content hashes of a multi get response.
+
+    :param response: Response of the multi get request.
+    :return: Content hashes by document id.
+    """
+    return {
+        doc['_id']: doc['fields'][CONTENT_HASH_FIELD][0]
+        for doc in response['docs']
+        if doc.get('found') and CONTENT_HASH_FIELD in doc.get('fields', {})
+    }
+
 
 class ElasticsearchLoader:
     """
     Class for loading data into Elasticsearch.
     """
 
-    def __init__(self, hosts: list, chunk_size: int = config.ETL_CHUNK_SIZE):
+    def __init__(
+        self,
+        hosts: list,
+        chunk_size: int = config.ETL_CHUNK_SIZE,
+        bulk_mode: str = config.ELASTICSEARCH_BULK_MODE,
+        thread_count: int = config.ELASTICSEARCH_BULK_THREADS,
+        max_chunk_bytes: int = config.ELASTICSEARCH_BULK_MAX_BYTES,
+        skip_unchanged: bool = config.ETL_SKIP_UNCHANGED,
+        bulk_retries: int = config.ELASTICSEARCH_BULK_RETRIES,
+        dead_letter_file: str = config.ETL_DEAD_LETTER_FILE,
+    ):
         """
         Initialize ElasticsearchLoader with hosts and chunk size.
 
         :param hosts: List of hosts where Elasticsearch is running.
         :param chunk_size: Size of the chunk to be loaded at once.
+        :param bulk_mode: 'serial' to send one bulk request at a time or 'parallel'
+            to stream documents through several concurrent bulk workers.
+        :param thread_count: Number of bulk workers in parallel mode.
+        :param max_chunk_bytes: Maximum size of one bulk request in parallel mode.
+        :param skip_unchanged: Do not reindex documents whose content hash is unchanged.
+        :param bulk_retries: Number of times documents rejected with a retriable status are sent again.
+        :param dead_letter_file: File keeping the documents rejected for good.
         """
 
         try:
-            self.client = Elasticsearch(hosts=hosts)
+            self.client = Elasticsearch(hosts=hosts, serializer=OrjsonSerializer())
         except exceptions.ElasticsearchException as e:
             module_logger.error('Error initializing Elasticsearch client: %s', e)
             raise
         self.chunk_size = chunk_size
+        self.bulk_mode = ModeBulk(bulk_mode)
+        self.thread_count = thread_count
+        self.max_chunk_bytes = max_chunk_bytes
+        self.skip_unchanged = skip_unchanged
+        self.bulk_retries = bulk_retries
+        self.dead_letters = DeadLetterStore(dead_letter_file)
+        self.hashed_indexes = set()
+        self.stats = defaultdict(Counter)
 
     def init(self, index_name: str):
         """
@@ -37,59 +265,448 @@ class ElasticsearchLoader:
 
         :param index_name: Name of the index to be created.
         """
-        index_dir = Path(__file__).resolve(strict=True).parent.joinpath('indexes')
-        file = index_dir.joinpath(f'{index_name}.json')
-        with open(file, 'r') as index_file:
-            data = json.load(index_file)
         try:
-            self.client.indices.create(index=index_name, body=data)
+            self.client.indices.create(index=index_name, body=load_index_body(index_name))
         except exceptions.ElasticsearchException:
             module_logger.warning('Index already exist: %s', index_name)
+        if self.skip_unchanged and has_content_hash(self.client.indices.get_mapping(index=index_name), index_name):
+            self.hashed_indexes.add(index_name)
+
+    @contextmanager
+    def bulk_indexing(self, index_name: str) -> Iterator[None]:
+        """
+        Disable periodic refresh of the index while a full load is running
+        and refresh it once when the load is over.
 
-    def load_to_es(self, records: List[dict], index_name: str) -> None:
+        :param index_name: Name of the index being loaded.
+        """
+        self.client.indices.put_settings(index=index_name, body={'index': {'refresh_interval': '-1'}})
+        module_logger.info('Refresh of %s is disabled for bulk indexing', index_name)
+        try:
+            yield
+        finally:
+            # null restores the default refresh interval of the index
+            self.client.indices.put_settings(index=index_name, body={'index': {'refresh_interval': None}})
+            self.client.indices.refresh(index=index_name)
+            module_logger.info('Refresh of %s is restored', index_name)
+
+    def create_bulk_index(self, alias: str) -> str:
+        """
+        Create a new version of an index with settings tuned for a bulk load.
+
+        :param alias: Name of the alias the index is created for, also the name of its definition.
+        :return: Name of the new index.
+        """
+        index_name = f'{alias}_{time.strftime("%Y%m%d%H%M%S")}'
+        body = load_index_body(alias)
+        body['settings'] = {**body.get('settings', {}), **BULK_INDEX_SETTINGS}
+        self.client.indices.create(index=index_name, body=body)
+        module_logger.info('Created %s for %s', index_name, alias)
+        return index_name
+
+    def swap_alias(self, alias: str, index_name: str) -> None:
+        """
+        Restore the settings of a bulk loaded index and point the alias to it.
+
+        The alias is moved and the indexes it pointed to are deleted in one atomic request.
+        An index named as the alias, created before aliases were used, is replaced the same way.
+
+        :param alias: Name of the alias.
+        :param index_name: Name of the bulk loaded index.
+        """
+        settings = load_index_body(alias).get('settings', {})
+        # null restores the default of a setting the definition leaves out
+        self.client.indices.put_settings(index=index_name, body={'index': {
+            'number_of_replicas': settings.get('number_of_replicas'),
+            'refresh_interval': settings.get('refresh_interval'),
+            'translog': {'durability': None},
+        }})
+        self.client.indices.refresh(index=index_name)
+
+        if self.client.indices.exists_alias(name=alias):
+            old_indexes = list(self.client.indices.get_alias(name=alias))
+        elif self.client.indices.exists(index=alias):
+            old_indexes = [alias]
+        else:
+            old_indexes = []
+        actions = [{'add': {'index': index_name, 'alias': alias}}]
+        actions.extend({'remove_index': {'index': old_index}} for old_index in old_indexes)
+        self.client.indices.update_aliases(body={'actions': actions})
+        module_logger.info('%s points to %s, deleted %s', alias, index_name, ', '.join(old_indexes) or 'nothing')
+
+    def delete_index(self, index_name: str) -> None:
+        """
+        Delete an index if it exists.
+
+        :param index_name: Name of the index.
+        """
+        self.client.indices.delete(index=index_name, ignore=404)
+
+    def load_to_es(self, records: Iterable[dict], index_name: str) -> None:
         """
         Load records into Elasticsearch.
 
-        :param records: List of records to be loaded.
+        The index is not refreshed after every chunk: documents become searchable
+        with the next periodic refresh of the index. Records identical to the indexed
+        documents are skipped when the index stores content hashes.
+
+        :param records: Records to be loaded.
         :param index_name: Name of the index where records will be loaded.
         """
-        for prepared_query in self._get_chunk_query(records, index_name):
-            str_query = '\n'.join(prepared_query) + '\n'
-            self._post_to_es(str_query, index_name)
-            module_logger.info('Post %d items to elastic search', len(prepared_query))
+        started = time.monotonic()
+        stats = self.stats[index_name]
+        skipped = stats['skipped']
+        if index_name in self.hashed_indexes:
+            records = self._skip_unchanged(records, index_name)
+        if self.bulk_mode is ModeBulk.PARALLEL:
+            # A group is spread over the bulk workers and its rejected documents are sent again together
+            group_size, send = self.chunk_size * self.thread_count, self._send_parallel
+        else:
+            group_size, send = self.chunk_size, self._send_serial
+        indexed, failed = 0, 0
+        for documents in chunked(records, group_size):
+            group_indexed, group_failed = self._load_documents(documents, index_name, send)
+            indexed += group_indexed
+            failed += group_failed
+            module_logger.info('Post %d items to elastic search', len(documents))
+        elapsed = time.monotonic() - started
+        stats.update(written=indexed, failed=failed)
+        module_logger.info(
+            'Indexed %d docs into %s (%d failed, %d unchanged) in %.2f s: %.0f docs/sec',
+            indexed, index_name, failed, stats['skipped'] - skipped, elapsed,
+            indexed / elapsed if elapsed else indexed,
+        )
+
+    def rename_nested(self, index_name: str, fields: Iterable[str], names: Dict[str, str]) -> None:
+        """
+        Rename the entries of nested fields in place instead of rebuilding the documents.
+        Documents changed while the update ran are updated again, up to bulk_retries times.
+        Assumes the change is a rename only: films linked to or unlinked from the entries are not touched.
 
-    @backoff(Exception, logger=module_logger)
-    def _post_to_es(self, query: str, index: str) -> None:
+        :param index_name: Name of the index.
+        :param fields: Nested fields whose entries have an id and a name.
+        :param names: New names by id.
+        """
+        body = rename_nested_body(fields, names)
+        stats = self.stats[index_name]
+        for attempt in range(self.bulk_retries + 1):
+            response = self._update_by_query(body, index_name)
+            stats.update(written=response['updated'], skipped=response['noops'], failed=len(response['failures']))
+            module_logger.info(
+                'Renamed %d ids in %s of %d docs in %s (%d unchanged, %d conflicts)',
+                len(names), ', '.join(fields), response['updated'], index_name,
+                response['noops'], response['version_conflicts'],
+            )
+            if not response['version_conflicts']:
+                break
+            if attempt == self.bulk_retries:
+                stats['failed'] += response['version_conflicts']
+
+    def pop_stats(self, index_name: str) -> Counter:
+        """
+        Return the numbers of written, skipped and failed documents
+        of an index since the previous call and reset them.
+
+        :param index_name: Name of the index.
+        """
+        return self.stats.pop(index_name, Counter())
+
+    @backoff(exceptions.ConnectionError, logger=module_logger)
+    def _update_by_query(self, body: dict, index_name: str) -> dict:
+        """
+        Run an update by query, going on over version conflicts.
+
+        :param body: Body of the update by query request.
+        :param index_name: Name of the index.
+        :return: Update by query response.
+        """
+        return self.client.update_by_query(
+            index=index_name, body=body, conflicts='proceed', slices='auto', request_timeout=UPDATE_BY_QUERY_TIMEOUT
+        )
+
+    def _skip_unchanged(self, records: Iterable[dict], index_name: str) -> Generator[dict, None, None]:
+        """
+        Filter out records whose content hash equals the hash stored with the indexed document
+        and add the content hash to the others.
+
+        :param records: Records to be loaded.
+        :param index_name: Name of the index where records will be loaded.
+        :return: Generator of changed records.
+        """
+        for chunk in chunked(records, self.chunk_size):
+            hashes = {record['id']: content_hash(record) for record in chunk}
+            stored_hashes = self._get_stored_hashes(list(hashes), index_name)
+            for record in chunk:
+                if stored_hashes.get(record['id']) == hashes[record['id']]:
+                    self.stats[index_name]['skipped'] += 1
+                else:
+                    yield {**record, CONTENT_HASH_FIELD: hashes[record['id']]}
+
+    @backoff(exceptions.TransportError, logger=module_logger)
+    def _get_stored_hashes(self, ids: List[str], index_name: str) -> Dict[str, str]:
+        """
+        Get the content hashes of indexed documents.
+
+        :param ids: Ids of the documents.
+        :param index_name: Name of the index.
+        :return: Content hashes by document id.
+        """
+        response = self.client.mget(
+            index=index_name, body={'ids': ids}, stored_fields=CONTENT_HASH_FIELD, _source=False
+        )
+        return get_stored_hashes(response)
+
+    def _load_documents(
+        self, documents: List[dict], index_name: str, send: Callable[[List[dict], str], List[dict]]
+    ) -> Tuple[int, int]:
+        """
+        Send documents and then, with exponential backoff, only the documents rejected
+        with a retriable status. Documents rejected for good, or still rejected after
+        bulk_retries attempts, go to the dead-letter store.
+
+        :param documents: Documents to be loaded.
+        :param index_name: Name of the index where documents will be loaded.
+        :param send: Method sending documents and returning the items of the bulk response.
+        :return: Number of indexed and failed documents.
+        """
+        indexed, failed, delay = 0, 0, 1
+        for attempt in range(self.bulk_retries + 1):
+            sent_indexed, retry, rejected = split_bulk_results(documents, send(documents, index_name))
+            indexed += sent_indexed
+            if attempt == self.bulk_retries:
+                rejected, retry = rejected + retry, []
+            for document, result in rejected:
+                self.dead_letters.put(index_name, document, result)
+            failed += len(rejected)
+            if not retry:
+                break
+            module_logger.warning('%d docs are rejected by %s, retrying in %d seconds', len(retry), index_name, delay)
+            time.sleep(delay)
+            delay *= 2
+            documents = [document for document, _ in retry]
+        return indexed, failed
+
+    def _send_serial(self, documents: List[dict], index_name: str) -> List[dict]:
+        """
+        Send documents in one bulk request.
+
+        :return: Items of the bulk response.
+        """
+        return self._post_to_es(bulk_body(documents, index_name), index_name)['items']
+
+    @backoff(exceptions.TransportError, logger=module_logger, retry_if=is_retriable)
+    def _send_parallel(self, documents: List[dict], index_name: str) -> List[dict]:
+        """
+        Send documents through concurrent bulk workers, each request
+        bounded by chunk_size documents and max_chunk_bytes bytes.
+
+        :return: Items of the bulk responses in the order of the documents.
+        """
+        return [
+            item for _, item in helpers.parallel_bulk(
+                self.client,
+                self._get_actions(documents, index_name),
+                thread_count=self.thread_count,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+            )
+        ]
+
+    @backoff(exceptions.TransportError, logger=module_logger, retry_if=is_retriable)
+    def _post_to_es(self, query: bytes, index: str) -> dict:
         """
         Post query to Elasticsearch.
 
         :param query: Query to be posted.
         :param index: Name of the index where query will be posted.
+        :return: Bulk response.
         """
-        self.client.bulk(body=query, index=index)
-        self.client.indices.refresh(index=index)
+        return self.client.bulk(body=query, index=index)
 
-    def _get_chunk_query(
-        self, rows: List[dict], index_name: str
-    ) -> Generator[List[str], None, None]:
+    @staticmethod
+    def _get_actions(rows: Iterable[dict], index_name: str) -> Generator[dict, None, None]:
         """
-        Generate chunked queries from rows.
+        Generate bulk index actions from rows.
 
-        :param rows: List of rows to be chunked.
+        :param rows: Rows to be indexed.
         :param index_name: Name of the index where rows will be loaded.
-        :return: Generator of chunked queries.
+        :return: Generator of bulk actions.
+        """
+        for row in rows:
+            yield {'_index': index_name, '_id': row['id'], '_source': row}
+
+
+class AsyncElasticsearchLoader:
+    """
+    Class for loading data into Elasticsearch from asyncio code.
+    """
+
+    def __init__(self, hosts: list, chunk_size: int = config.ETL_CHUNK_SIZE,
+                 max_chunk_bytes: int = config.ELASTICSEARCH_BULK_MAX_BYTES,
+                 skip_unchanged: bool = config.ETL_SKIP_UNCHANGED,
+                 bulk_retries: int = config.ELASTICSEARCH_BULK_RETRIES,
+                 dead_letter_file: str = config.ETL_DEAD_LETTER_FILE):
         """
-        chunked_rows = (
-            rows[i : i + self.chunk_size] for i in range(0, len(rows), self.chunk_size)
+        Initialize AsyncElasticsearchLoader with hosts and chunk size.
+
+        :param hosts: List of hosts where Elasticsearch is running.
+        :param chunk_size: Maximum number of documents in one bulk request.
+        :param max_chunk_bytes: Maximum size of one bulk request.
+        :param skip_unchanged: Do not reindex documents whose content hash is unchanged.
+        :param bulk_retries: Number of times documents rejected with a retriable status are sent again.
+        :param dead_letter_file: File keeping the documents rejected for good.
+        """
+        self.client = AsyncElasticsearch(hosts=hosts, serializer=OrjsonSerializer())
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.skip_unchanged = skip_unchanged
+        self.bulk_retries = bulk_retries
+        self.dead_letters = DeadLetterStore(dead_letter_file)
+        self.hashed_indexes = set()
+        self.stats = defaultdict(Counter)
+
+    async def init(self, index_name: str) -> None:
+        """
+        Initialize Elasticsearch index.
+
+        :param index_name: Name of the index to be created.
+        """
+        try:
+            await self.client.indices.create(index=index_name, body=load_index_body(index_name))
+        except exceptions.ElasticsearchException:
+            module_logger.warning('Index already exist: %s', index_name)
+        if self.skip_unchanged and has_content_hash(await self.client.indices.get_mapping(index=index_name), index_name):
+            self.hashed_indexes.add(index_name)
+
+    async def load_to_es(self, records: Iterable[dict], index_name: str) -> None:
+        """
+        Load records into Elasticsearch.
+
+        :param records: Records to be loaded.
+        :param index_name: Name of the index where records will be loaded.
+        """
+        started = time.monotonic()
+        stats = self.stats[index_name]
+        skipped = stats['skipped']
+        indexed, failed = 0, 0
+        for documents in chunked(records, self.chunk_size):
+            if index_name in self.hashed_indexes:
+                documents = await self._skip_unchanged(documents, index_name)
+            if documents:
+                chunk_indexed, chunk_failed = await self._load_documents(documents, index_name)
+                indexed += chunk_indexed
+                failed += chunk_failed
+        elapsed = time.monotonic() - started
+        stats.update(written=indexed, failed=failed)
+        module_logger.info(
+            'Indexed %d docs into %s (%d failed, %d unchanged) in %.2f s: %.0f docs/sec',
+            indexed, index_name, failed, stats['skipped'] - skipped, elapsed,
+            indexed / elapsed if elapsed else indexed,
+        )
+
+    async def rename_nested(self, index_name: str, fields: Iterable[str], names: Dict[str, str]) -> None:
+        """
+        Rename the entries of nested fields in place instead of rebuilding the documents.
+        Documents changed while the update ran are updated again, up to bulk_retries times.
+        Assumes the change is a rename only: films linked to or unlinked from the entries are not touched.
+
+        :param index_name: Name of the index.
+        :param fields: Nested fields whose entries have an id and a name.
+        :param names: New names by id.
+        """
+        body = rename_nested_body(fields, names)
+        stats = self.stats[index_name]
+        for attempt in range(self.bulk_retries + 1):
+            response = await self.client.update_by_query(
+                index=index_name, body=body, conflicts='proceed', slices='auto',
+                request_timeout=UPDATE_BY_QUERY_TIMEOUT,
+            )
+            stats.update(written=response['updated'], skipped=response['noops'], failed=len(response['failures']))
+            module_logger.info(
+                'Renamed %d ids in %s of %d docs in %s (%d unchanged, %d conflicts)',
+                len(names), ', '.join(fields), response['updated'], index_name,
+                response['noops'], response['version_conflicts'],
+            )
+            if not response['version_conflicts']:
+                break
+            if attempt == self.bulk_retries:
+                stats['failed'] += response['version_conflicts']
+
+    def pop_stats(self, index_name: str) -> Counter:
+        """
+        Return the numbers of written, skipped and failed documents
+        of an index since the previous call and reset them.
+
+        :param index_name: Name of the index.
+        """
+        return self.stats.pop(index_name, Counter())
+
+    async def _skip_unchanged(self, documents: List[dict], index_name: str) -> List[dict]:
+        """
+        Filter out documents whose content hash equals the hash stored with the indexed document
+        and add the content hash to the others.
+
+        :param documents: Documents to be loaded.
+        :param index_name: Name of the index where documents will be loaded.
+        :return: Changed documents.
+        """
+        hashes = {document['id']: content_hash(document) for document in documents}
+        response = await self.client.mget(
+            index=index_name, body={'ids': list(hashes)}, stored_fields=CONTENT_HASH_FIELD, _source=False
         )
+        stored_hashes = get_stored_hashes(response)
+        changed = []
+        for document in documents:
+            if stored_hashes.get(document['id']) == hashes[document['id']]:
+                self.stats[index_name]['skipped'] += 1
+            else:
+                changed.append({**document, CONTENT_HASH_FIELD: hashes[document['id']]})
+        return changed
+
+    async def _load_documents(self, documents: List[dict], index_name: str) -> Tuple[int, int]:
+        """
+        Send documents in bulk requests of at most max_chunk_bytes bytes and then, with exponential
+        backoff, only the documents rejected with a retriable status. Documents rejected for good,
+        or still rejected after bulk_retries attempts, go to the dead-letter store.
+
+        :param documents: Documents to be loaded.
+        :param index_name: Name of the index where documents will be loaded.
+        :return: Number of indexed and failed documents.
+        """
+        indexed, failed, delay = 0, 0, 1
+        for attempt in range(self.bulk_retries + 1):
+            items = []
+            for body in bulk_bodies(documents, index_name, self.max_chunk_bytes):
+                items += (await self._post_to_es(body, index_name))['items']
+            sent_indexed, retry, rejected = split_bulk_results(documents, items)
+            indexed += sent_indexed
+            if attempt == self.bulk_retries:
+                rejected, retry = rejected + retry, []
+            for document, result in rejected:
+                self.dead_letters.put(index_name, document, result)
+            failed += len(rejected)
+            if not retry:
+                break
+            module_logger.warning('%d docs are rejected by %s, retrying in %d seconds', len(retry), index_name, delay)
+            await asyncio.sleep(delay)
+            delay *= 2
+            documents = [document for document, _ in retry]
+        return indexed, failed
+
+    @backoff(exceptions.TransportError, logger=module_logger, retry_if=is_retriable)
+    async def _post_to_es(self, query: bytes, index: str) -> dict:
+        """
+        Post query to Elasticsearch.
+
+        :param query: Query to be posted.
+        :param index: Name of the index where query will be posted.
+        :return: Bulk response.
+        """
+        return await self.client.bulk(body=query, index=index)
 
-        for chunk in chunked_rows:
-            prepared_query = []
-            for row in chunk:
-                prepared_query.extend(
-                    [
-                        json.dumps({'index': {'_index': index_name, '_id': row['id']}}),
-                        json.dumps(row),
-                    ]
-                )
-            yield prepared_query
+    async def close(self) -> None:
+        """
+        Close the connections of the client.
+        """
+        await self.client.close()
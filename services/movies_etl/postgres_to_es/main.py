@@ -1,11 +1,14 @@
+import asyncio
 import logging
 
 import config
-from elastic import ElasticsearchLoader
-from models import ModeETL
+from elastic import AsyncElasticsearchLoader, ElasticsearchLoader
+from models import ModeETL, ModeState, ModeSync
 from pipelines import FilmWorkPipeline, GenrePipeline, PersonPipeline
-from postgres import PostgresProducer
-from state import JsonFileStorage, State
+from postgres import AsyncPostgresProducer, PostgresListener, PostgresProducer
+from redis import Redis
+from runner import AsyncETLRunner
+from state import BaseStorage, JsonFileStorage, RedisStorage, SqliteStorage, State
 
 logging.basicConfig(
     level=logging.INFO, format='%(asctime)s: %(name)s - %(levelname)s - %(message)s'
@@ -13,27 +16,45 @@ logging.basicConfig(
 logger = logging.getLogger('root')
 
 
+def get_storage() -> BaseStorage:
+    mode = ModeState(config.ETL_STATE_BACKEND)
+    if mode is ModeState.SQLITE:
+        return SqliteStorage(config.ETL_SQLITE_STATE)
+    if mode is ModeState.REDIS:
+        return RedisStorage(Redis(host=config.REDIS_HOST, port=config.REDIS_PORT), config.ETL_REDIS_STATE_KEY)
+    return JsonFileStorage(config.ETL_FILE_STATE)
+
+
 def main():
     try:
-        logger.info('Start ETL application with %s mode', config.ETL_MODE)
-
-        state = State(JsonFileStorage(config.ETL_FILE_STATE))
-        es_loader = ElasticsearchLoader(
-            [
-                'http://{host}:{port}'.format(
-                    host=config.ELASTICSEARCH_HOST, port=config.ELASTICSEARCH_PORT
-                )
-            ]
-        )
-        db_adapter = PostgresProducer(
-            {
-                'dbname': config.POSTGRES_NAME,
-                'user': config.POSTGRES_USER,
-                'password': config.POSTGRES_PASSWORD,
-                'host': config.POSTGRES_HOST,
-                'port': config.POSTGRES_PORT,
-            }
-        )
+        logger.info('Start ETL application with %s mode (%s sync)', config.ETL_MODE, config.ETL_SYNC_MODE)
+
+        state = State(get_storage())
+        hosts = [
+            'http://{host}:{port}'.format(
+                host=config.ELASTICSEARCH_HOST, port=config.ELASTICSEARCH_PORT
+            )
+        ]
+        dsn = {
+            'dbname': config.POSTGRES_NAME,
+            'user': config.POSTGRES_USER,
+            'password': config.POSTGRES_PASSWORD,
+            'host': config.POSTGRES_HOST,
+            'port': config.POSTGRES_PORT,
+        }
+
+        if config.ETL_MODE == ModeETL.ALL.value:
+            runner = AsyncETLRunner(state, AsyncPostgresProducer(dsn), AsyncElasticsearchLoader(hosts))
+            asyncio.run(runner.run())
+            return
+
+        es_loader = ElasticsearchLoader(hosts)
+        db_adapter = PostgresProducer(dsn)
+
+        listener = None
+        if ModeSync(config.ETL_SYNC_MODE) is ModeSync.CDC:
+            listener = PostgresListener(dsn)
+            listener.init()
 
         pipeline_classes = {
             ModeETL.FILM_WORK.value: FilmWorkPipeline,
@@ -42,7 +63,7 @@ def main():
         }
 
         if pipeline_class := pipeline_classes.get(config.ETL_MODE):
-            pipeline = pipeline_class(state, db_adapter, es_loader)
+            pipeline = pipeline_class(state, db_adapter, es_loader, listener)
             pipeline.etl_process()
         else:
             logger.warning(
@@ -1,15 +1,109 @@
-from dataclasses import asdict, dataclass, field
-from datetime import datetime
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timezone
 from enum import Enum
-from typing import List
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+
+MIN_UUID = '00000000-0000-0000-0000-000000000000'
+
+
+def slotted(cls):
+    """
+    Recreates a dataclass with __slots__ for its own fields, as dataclass(slots=True) does on Python 3.10+.
+    """
+    inherited = {name for base in cls.__mro__[1:] for name in getattr(base, '__slots__', ())}
+    own_fields = tuple(f.name for f in fields(cls) if f.name not in inherited)
+    cls_dict = dict(cls.__dict__)
+    cls_dict['__slots__'] = own_fields
+    for name in own_fields:
+        # Defaults are kept by the generated __init__, class attributes would clash with the slots
+        cls_dict.pop(name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+def by_id(items: Iterable) -> Dict:
+    """
+    Dedups items by id in a dict, which keeps the insertion order and makes membership checks O(1).
+    """
+    if isinstance(items, dict):
+        return items
+    return {item.id: item for item in items}
 
 
 class ModeETL(Enum):
     FILM_WORK = 'film_work'
     PERSON = 'person'
     GENRE = 'genre'
+    ALL = 'all'
+
+
+class ModeBulk(Enum):
+    SERIAL = 'serial'
+    PARALLEL = 'parallel'
+
+
+class ModeFilmQuery(Enum):
+    JOIN = 'join'
+    AGGREGATE = 'aggregate'
+
+
+class ModeSync(Enum):
+    POLLING = 'polling'
+    CDC = 'cdc'
+
+
+class ModeState(Enum):
+    FILE = 'file'
+    SQLITE = 'sqlite'
+    REDIS = 'redis'
+
+
+@dataclass
+class Watermark:
+    """
+    Keyset position (modified, id) of the last processed row of a table.
+    """
+    modified: str
+    id: str = MIN_UUID
+
+    @classmethod
+    def from_state(cls, value: Optional[Union[dict, str]], default_date: str) -> 'Watermark':
+        if isinstance(value, dict):
+            return cls(**value)
+        # Older states kept a bare timestamp without the id part
+        return cls(modified=value or default_date)
+
+    def query_args(self, limit: int) -> Tuple[str, str, int]:
+        return self.modified, self.id, limit
+
+    @property
+    def modified_at(self) -> datetime:
+        modified = datetime.fromisoformat(self.modified)
+        # Naive timestamps are UTC, as in the session time zone of the database
+        return modified if modified.tzinfo else modified.replace(tzinfo=timezone.utc)
+
+    @property
+    def position(self) -> Tuple[datetime, str]:
+        """
+        Keyset position of the watermark, ordered as the (modified, id) keyset of the queries.
+        """
+        return self.modified_at, self.id
+
+    @property
+    def lag(self) -> float:
+        """
+        Seconds elapsed since the modification time of the watermark.
+        """
+        return (datetime.now(timezone.utc) - self.modified_at).total_seconds()
+
+    @property
+    def as_dict(self):
+        return asdict(self)
 
 
+@slotted
 @dataclass
 class ShortFilm:
     id: str
@@ -27,90 +121,138 @@ class ShortFilm:
         if self.rating is not None and not isinstance(self.rating, float):
             raise TypeError('rating must be a float or None')
 
+    @property
+    def as_dict(self):
+        return {'id': self.id, 'title': self.title, 'type': self.type, 'rating': self.rating}
+
 
+@slotted
 @dataclass
 class ShortPerson:
     id: str
     name: str
 
+    @property
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name}
+
 
+@slotted
 @dataclass
 class ShortFile:
     id: str
     path: str
 
+    @property
+    def as_dict(self):
+        return {'id': self.id, 'path': self.path}
+
 
+@slotted
 @dataclass
 class Person(ShortPerson):
-    roles: List[str] = field(default_factory=list)
-    films: List[ShortFilm] = field(default_factory=list)
+    roles: Dict[str, None] = field(default_factory=dict)
+    films: Dict[str, ShortFilm] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.roles = dict.fromkeys(self.roles)
+        self.films = by_id(self.films)
 
     def add_role(self, role: str):
-        if role not in self.roles:
-            self.roles.append(role)
+        self.roles[role] = None
 
     def add_film(self, film: ShortFilm):
-        if film not in self.films:
-            self.films.append(film)
+        self.films.setdefault(film.id, film)
 
     @property
     def as_dict(self):
-        return asdict(self)
+        return {
+            'id': self.id,
+            'name': self.name,
+            'roles': list(self.roles),
+            'films': [film.as_dict for film in self.films.values()],
+        }
 
 
+@slotted
 @dataclass
 class ShortGenre:
     id: str
     name: str
 
+    @property
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name}
+
 
+@slotted
 @dataclass
 class Genre(ShortGenre):
     description: str
 
     @property
     def as_dict(self):
-        return asdict(self)
+        return {'id': self.id, 'name': self.name, 'description': self.description}
 
 
+@slotted
 @dataclass
 class Film(ShortFilm):
     description: str = ''
     creation_date: datetime = None
-    genre: List[ShortGenre] = field(default_factory=list)
-    actors: List[ShortPerson] = field(default_factory=list)
-    writers: List[ShortPerson] = field(default_factory=list)
-    directors: List[ShortPerson] = field(default_factory=list)
-    high_quality_file: List[ShortFile] = field(default_factory=list)
-    middle_quality_file: List[ShortFile] = field(default_factory=list)
-    low_quality_file: List[ShortFile] = field(default_factory=list)
+    genre: Dict[str, ShortGenre] = field(default_factory=dict)
+    actors: Dict[str, ShortPerson] = field(default_factory=dict)
+    writers: Dict[str, ShortPerson] = field(default_factory=dict)
+    directors: Dict[str, ShortPerson] = field(default_factory=dict)
+    high_quality_file: Dict[str, ShortFile] = field(default_factory=dict)
+    middle_quality_file: Dict[str, ShortFile] = field(default_factory=dict)
+    low_quality_file: Dict[str, ShortFile] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Zero-argument super() refers to the class replaced by @slotted
+        ShortFilm.__post_init__(self)
+        self.genre = by_id(self.genre)
+        self.actors = by_id(self.actors)
+        self.writers = by_id(self.writers)
+        self.directors = by_id(self.directors)
+        self.high_quality_file = by_id(self.high_quality_file)
+        self.middle_quality_file = by_id(self.middle_quality_file)
+        self.low_quality_file = by_id(self.low_quality_file)
 
     def add_genre(self, gen: ShortGenre):
-        if gen not in self.genre:
-            self.genre.append(gen)
+        self.genre.setdefault(gen.id, gen)
 
     def add_person(self, person: ShortPerson, role: str):
         if role == 'actor':
-            if person not in self.actors:
-                self.actors.append(person)
+            self.actors.setdefault(person.id, person)
         elif role == 'writer':
-            if person not in self.writers:
-                self.writers.append(person)
+            self.writers.setdefault(person.id, person)
         elif role == 'director':
-            if person not in self.directors:
-                self.directors.append(person)
+            self.directors.setdefault(person.id, person)
 
     def add_video(self, file: ShortFile, width: int):
         if width:
             if width >= 720:
-                if file not in self.high_quality_file:
-                    self.high_quality_file.append(file)
+                self.high_quality_file.setdefault(file.id, file)
             elif 480 <= width < 720:
-                if file not in self.middle_quality_file:
-                    self.middle_quality_file.append(file)
-            elif file not in self.low_quality_file:
-                self.low_quality_file.append(file)
+                self.middle_quality_file.setdefault(file.id, file)
+            else:
+                self.low_quality_file.setdefault(file.id, file)
 
     @property
     def as_dict(self):
-        return asdict(self)
+        return {
+            'id': self.id,
+            'title': self.title,
+            'type': self.type,
+            'rating': self.rating,
+            'description': self.description,
+            'creation_date': self.creation_date,
+            'genre': [genre.as_dict for genre in self.genre.values()],
+            'actors': [person.as_dict for person in self.actors.values()],
+            'writers': [person.as_dict for person in self.writers.values()],
+            'directors': [person.as_dict for person in self.directors.values()],
+            'high_quality_file': [file.as_dict for file in self.high_quality_file.values()],
+            'middle_quality_file': [file.as_dict for file in self.middle_quality_file.values()],
+            'low_quality_file': [file.as_dict for file in self.low_quality_file.values()],
+        }
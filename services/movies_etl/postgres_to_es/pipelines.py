@@ -1,16 +1,19 @@
 import abc
-import datetime as dt
 import logging
-from time import sleep
-from typing import Generator, List
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from time import monotonic, sleep
+from typing import Dict, Generator, Iterable, List, Optional, Tuple
 
 import config
+import psycopg2
 import queries
 from elastic import ElasticsearchLoader
-from models import Film, Genre, Person, ShortFilm, ShortGenre, ShortPerson, ShortFile
-from postgres import PostgresProducer
+from models import Film, Genre, ModeFilmQuery, Person, ShortFilm, ShortGenre, ShortPerson, ShortFile, Watermark
+from postgres import PostgresListener, PostgresProducer
 from state import State
-from utils import coroutine
+from utils import AdaptiveDelay, chunked, coroutine
 
 module_logger = logging.getLogger('Pipeline')
 
@@ -24,10 +27,25 @@ class BasePipeline(abc.ABC):
         state (State): An instance of the State class that manages the state of the pipeline.
         db_adapter (PostgresProducer): An instance of the PostgresProducer class that handles database operations.
         es_loader (ElasticsearchLoader): An instance of the ElasticsearchLoader class that handles Elasticsearch operations.
-        state_key (str): A string that represents the key for the state of the pipeline.
+        listener (Optional[PostgresListener]): An instance of the PostgresListener class that receives change
+            notifications. When it is set, the pipeline reacts to notifications instead of polling.
+        state_key (str): A string that represents the legacy key for the state of the pipeline,
+            used as a starting point when no watermark has been checkpointed yet.
+        run_stats (Counter): The number of changed rows, the number of full batches and the lag
+            in seconds of the current run.
+        run_started (Optional[datetime]): The start of the current polling run on the database clock.
+            The run only picks up the changes made before it, later changes are left to the next run.
+        loaded_ids (Optional[set]): The IDs loaded by the current polling run. A film changed through
+            several sources (person, genre and film_work) is loaded once per run.
     """
 
-    def __init__(self, state: State, db_adapter: PostgresProducer, es_loader: ElasticsearchLoader):
+    def __init__(
+        self,
+        state: State,
+        db_adapter: PostgresProducer,
+        es_loader: ElasticsearchLoader,
+        listener: Optional[PostgresListener] = None,
+    ):
         """
         The constructor for the BasePipeline class.
 
@@ -35,11 +53,16 @@ class BasePipeline(abc.ABC):
             state (State): An instance of the State class.
             db_adapter (PostgresProducer): An instance of the PostgresProducer class.
             es_loader (ElasticsearchLoader): An instance of the ElasticsearchLoader class.
+            listener (Optional[PostgresListener]): An instance of the PostgresListener class.
         """
         self.state = state
         self.db_adapter = db_adapter
         self.es_loader = es_loader
+        self.listener = listener
         self.state_key = f'{self.index}_last_updated'
+        self.run_stats = Counter()
+        self.run_started = None
+        self.loaded_ids = None
 
         self.db_adapter.init()
         self.es_loader.init(self.index)
@@ -53,12 +76,19 @@ class BasePipeline(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def etl_process(self) -> None:
+    def build_process(self) -> Tuple[List[Generator], Dict[str, Generator]]:
         """
-        Abstract method that should be implemented by subclasses to define the ETL process.
+        Abstract method that should be implemented by subclasses to set up the coroutines of the ETL process.
+        It returns the generators polling the source tables and the targets taking the changed ids of each table.
         """
         pass
 
+    def etl_process(self) -> None:
+        """
+        Method that sets up the coroutines of the ETL process and runs it.
+        """
+        self.run(*self.build_process())
+
     @abc.abstractmethod
     def transform(self, target: Generator) -> Generator:
         """
@@ -70,6 +100,10 @@ class BasePipeline(abc.ABC):
     def enrich(self, query: str, target: Generator) -> Generator:
         """
         Coroutine that enriches the data by executing a query and sending the results to a target generator.
+        IDs are queried in chunks of ETL_CHUNK_SIZE and the rows of every chunk are sent downstream on their
+        own, so memory is bounded by the chunk size and not by the number of changed ids. During a polling
+        run, IDs already loaded by the run are skipped: their documents were read after the run started,
+        so they already hold every change the run picks up.
 
         Parameters:
             query (str): The SQL query to execute.
@@ -77,31 +111,118 @@ class BasePipeline(abc.ABC):
         """
         while True:
             ids = (yield)
+            if self.loaded_ids is not None:
+                ids = [id_ for id_ in dict.fromkeys(ids) if id_ not in self.loaded_ids]
+                self.loaded_ids.update(ids)
             module_logger.info('Got %d ids', len(ids))
-            if ids:
+            for chunk_ids in chunked(ids, config.ETL_CHUNK_SIZE):
                 context = []
-                for chunck_rows in self.db_adapter.execute(query, list(ids)):
+                for chunck_rows in self.db_adapter.execute(query, chunk_ids):
                     context.extend(chunck_rows)
 
-                target.send(context)
+                if context:
+                    target.send(context)
+
+    @coroutine
+    def collect_changed_ids(self, source: str, query: str, target: Generator) -> Generator:
+        """
+        Coroutine that pages through the rows of a source table changed after the stored watermark
+        and sends their IDs to a target generator batch by batch.
+
+        Once a batch has been processed downstream, the (modified, id) of its last row is checkpointed,
+        so a restarted pipeline resumes right after the last loaded batch. When nothing has been
+        checkpointed yet, the run is a full load and the index refresh is disabled until it is over.
+        Rows changed after the run started are left to the next run, see run_started.
+        The lag of the run is the age of the oldest change it picked up, full loads left aside.
+
+        Parameters:
+            source (str): The name of the source table, used to build the state key.
+            query (str): The keyset-paged SQL query to execute.
+            target (Generator): The target generator to send the results to.
+        """
+        state_key = self.watermark_key(source)
+        while True:
+            (yield)
+            stored_watermark = self.state.get_state(state_key) or self.state.get_state(self.state_key)
+            watermark = Watermark.from_state(stored_watermark, config.ETL_DEFAULT_DATE)
+            full_load = stored_watermark is None
+            with self.es_loader.bulk_indexing(self.index) if full_load else nullcontext():
+                while True:
+                    rows = []
+                    for chunck_rows in self.db_adapter.execute(query, watermark.query_args(config.ETL_BATCH_LIMIT)):
+                        rows.extend(chunck_rows)
+                    if self.run_started:
+                        # Rows are ordered by modified, so the rows changed before the run are a prefix
+                        rows = [
+                            row for row in rows
+                            if Watermark(modified=str(row['modified'])).modified_at < self.run_started
+                        ]
+                    if not rows:
+                        break
+
+                    module_logger.info('Got %d changed %s ids after %s', len(rows), source, watermark.modified)
+                    self.run_stats.update(changed=len(rows), full_batches=len(rows) == config.ETL_BATCH_LIMIT)
+                    if not full_load:
+                        self.run_stats['lag'] = max(
+                            self.run_stats['lag'], Watermark(modified=str(rows[0]['modified'])).lag
+                        )
+                    target.send([row['id'] for row in rows])
+
+                    watermark = Watermark(modified=str(rows[-1]['modified']), id=str(rows[-1]['id']))
+                    self.state.set_state(state_key, watermark.as_dict)
+                    if len(rows) < config.ETL_BATCH_LIMIT:
+                        break
+
+    def watermark_key(self, source: str) -> str:
+        """
+        Method that returns the state key of the watermark of a source table.
+
+        Parameters:
+            source (str): The name of the source table.
+        """
+        return f'{self.index}_{source}_watermark'
+
+    def checkpoint_notified(self, watermarks: Dict[str, Watermark], sources: Iterable[str]) -> None:
+        """
+        Method that moves the watermarks of source tables forward to their latest notified changes, so the
+        next catch-up by polling starts after the changes loaded from notifications. Every change committed
+        since the listener connected is notified, so the changes before these watermarks are loaded already.
+        The notified modified is the time of the statement, not of the commit: a transaction still open may
+        commit rows modified earlier, so the watermark is kept ETL_CDC_WATERMARK_MARGIN seconds behind.
+        Watermarks are never moved back, and not set before the first full load of a table.
+
+        Parameters:
+            watermarks (Dict[str, Watermark]): The latest notified (modified, id) of each table.
+            sources (Iterable[str]): The source tables of the pipeline.
+        """
+        for source in sources:
+            if not (watermark := watermarks.get(source)):
+                continue
+            state_key = self.watermark_key(source)
+            stored_watermark = self.state.get_state(state_key) or self.state.get_state(self.state_key)
+            if stored_watermark is None:
+                continue
+            watermark = Watermark(
+                modified=str(watermark.modified_at - timedelta(seconds=config.ETL_CDC_WATERMARK_MARGIN))
+            )
+            if watermark.position > Watermark.from_state(stored_watermark, config.ETL_DEFAULT_DATE).position:
+                self.state.set_state(state_key, watermark.as_dict)
 
     @coroutine
     def collect_updated_ids(self, query: str, target: Generator) -> Generator:
         """
-        Coroutine that collects updated IDs by executing a query and sending the results to a target generator.
+        Coroutine that collects updated IDs by executing a query and sending the results to a target generator
+        chunk by chunk as they are fetched from the database.
 
         Parameters:
             query (str): The SQL query to execute.
             target (Generator): The target generator to send the results to.
         """
         while True:
-            result = []
             query_args = (yield)
             if query_args:
                 for chunck_rows in self.db_adapter.execute(query, query_args):
-                    result.extend([row['id'] for row in chunck_rows])
-
-            target.send(result)
+                    target.send([row['id'] for row in chunck_rows])
 
     @coroutine
     def es_loader_coro(self, index_name: str) -> Generator:
@@ -114,22 +235,124 @@ class BasePipeline(abc.ABC):
         while rows := (yield):
             self.es_loader.load_to_es(rows, index_name)
 
+    def run(self, generators: List[Generator], targets: Dict[str, Generator]) -> None:
+        """
+        Method that runs the pipeline either by polling or by change notifications.
+
+        Parameters:
+            generators (List[Generator]): A list of generators that poll the changes of their source tables.
+            targets (Dict[str, Generator]): The generators that take the changed ids of each source table.
+        """
+        if self.listener:
+            self.cdc_loop(generators, targets)
+        else:
+            self.event_loop(generators)
+
+    def sync(self, generators: List[Generator]) -> None:
+        """
+        Method that triggers all generators once. Each of them processes the changes of its source table
+        made before the run started and checkpoints its own watermark.
+
+        Parameters:
+            generators (List[Generator]): A list of generators to trigger.
+        """
+        module_logger.info('Start ETL process for %s', self.index)
+        self.run_stats = Counter()
+        # From the database clock, as modified is, so the host clock skew does not move the cut
+        self.run_started = [row['now'] for rows in self.db_adapter.execute(queries.NOW_QUERY, ()) for row in rows][0]
+        self.loaded_ids = set()
+        try:
+            for generator in generators:
+                generator.send(None)
+        finally:
+            self.run_started = None
+            self.loaded_ids = None
+        self.log_stats()
+        self.report_lag()
+
+    def log_stats(self) -> None:
+        """
+        Method that logs how many documents were written, skipped as unchanged and failed since the previous call.
+        """
+        stats = self.es_loader.pop_stats(self.index)
+        module_logger.info(
+            'Run for %s: %d docs written, %d unchanged skipped, %d failed',
+            self.index, stats['written'], stats['skipped'], stats['failed'],
+        )
+
+    def report_lag(self) -> None:
+        """
+        Method that checkpoints the lag of the run as `{index}_lag`, so the indexing delay can be
+        monitored from the state storage. measured_at going stale means the pipeline is stuck.
+        """
+        lag = self.run_stats['lag']
+        self.state.set_state(
+            f'{self.index}_lag', {'seconds': round(lag, 3), 'measured_at': datetime.now(timezone.utc).isoformat()}
+        )
+        module_logger.info('Lag of %s: %.1f seconds over %d changed rows', self.index, lag, self.run_stats['changed'])
+
     def event_loop(self, generators: List[Generator]):
         """
-        Method that runs the event loop for the pipeline. It gets the current state, sends it to all generators,
-        updates the state, and then sleeps for a specified delay.
+        Method that runs the event loop for the pipeline. It syncs all generators and then sleeps
+        for a delay adapted to the changes of the run: none while it works through a backlog,
+        ETL_SYNC_DELAY after a few changes and up to ETL_SYNC_MAX_DELAY while nothing changes.
 
         Parameters:
-            generators (List[Generator]): A list of generators to send the state to.
+            generators (List[Generator]): A list of generators to trigger.
         """
+        delays = AdaptiveDelay(config.ETL_SYNC_DELAY, config.ETL_SYNC_MAX_DELAY)
         while True:
-            state_value = self.state.get_state(self.state_key) or config.ETL_DEFAULT_DATE
-            module_logger.info('Start ETL process for %s: %s', self.state_key, state_value)
-            for generator in generators:
-                generator.send(state_value)
-            self.state.set_state(self.state_key, str(dt.datetime.now()))
-            module_logger.info('ETL process is finished.  Sleep: %d seconds', config.ETL_SYNC_DELAY)
-            sleep(config.ETL_SYNC_DELAY)
+            self.sync(generators)
+            delay = delays.next_delay(self.run_stats['changed'], self.run_stats['full_batches'] > 0)
+            module_logger.info('ETL process is finished.  Sleep: %d seconds', delay)
+            sleep(delay)
+
+    def cdc_loop(self, generators: List[Generator], targets: Dict[str, Generator]):
+        """
+        Method that runs the pipeline on change notifications. Changed ids are debounced into batches and
+        sent right to the targets of their tables, then the watermarks are moved to the loaded changes.
+        After every (re)connect, and every ETL_CDC_RESYNC_INTERVAL seconds, the pipeline catches up by polling.
+        While the listener cannot connect, the pipeline falls back to polling.
+
+        Parameters:
+            generators (List[Generator]): A list of generators that poll the changes of their source tables.
+            targets (Dict[str, Generator]): The generators that take the changed ids of each source table.
+        """
+        while True:
+            try:
+                self.listener.connect()
+            except psycopg2.OperationalError:
+                module_logger.warning(
+                    'Listener is unavailable. Polling, next attempt in %d seconds', config.ETL_SYNC_DELAY
+                )
+                self.sync(generators)
+                sleep(config.ETL_SYNC_DELAY)
+                continue
+
+            self.sync(generators)
+            synced_at = monotonic()
+            try:
+                while True:
+                    changes = self.listener.collect(
+                        timeout=config.ETL_SYNC_DELAY,
+                        debounce=config.ETL_CDC_DEBOUNCE,
+                        max_wait=config.ETL_CDC_MAX_WAIT,
+                        limit=config.ETL_BATCH_LIMIT,
+                    )
+                    for table, ids in changes.items():
+                        if target := targets.get(table):
+                            module_logger.info('Got %d %s ids from notifications', len(ids), table)
+                            target.send(list(ids))
+                    if changes:
+                        self.checkpoint_notified(self.listener.pop_watermarks(), targets)
+                        self.log_stats()
+
+                    if monotonic() - synced_at >= config.ETL_CDC_RESYNC_INTERVAL:
+                        self.sync(generators)
+                        synced_at = monotonic()
+            except psycopg2.OperationalError:
+                module_logger.exception('Listener connection is lost. Reconnecting')
+                self.listener.close()
 
 
 class FilmWorkPipeline(BasePipeline):
@@ -137,10 +360,21 @@ class FilmWorkPipeline(BasePipeline):
     This class is a specific implementation of the BasePipeline for film works. It defines the ETL process for film works,
     including the enrichment, transformation, and loading of film work data.
 
+    With CDC, changed links between films and persons or genres are reported as film_work changes,
+    so a changed person or genre only changes its name in the film documents: with ETL_PARTIAL_UPDATES
+    the name is updated in place instead of rebuilding every film the person or genre appears in.
+    Polling can not tell link changes apart, so it always rebuilds the films.
+
     Attributes:
         index (str): The name of the Elasticsearch index for film works.
+        query_mode (ModeFilmQuery): The way film documents are queried from the database.
+        person_fields (Tuple[str, ...]): The nested fields of the film documents holding persons.
+        genre_fields (Tuple[str, ...]): The nested fields of the film documents holding genres.
     """
 
+    person_fields = ('actors', 'writers', 'directors')
+    genre_fields = ('genre',)
+
     @property
     def index(self):
         """
@@ -148,36 +382,19 @@ class FilmWorkPipeline(BasePipeline):
         """
         return 'movies'
 
-    @coroutine
-    def enrich(self, query: str, target: Generator) -> Generator:
+    @property
+    def query_mode(self) -> ModeFilmQuery:
         """
-        Coroutine that enriches the film work data by executing a query and sending the results to a target generator.
-
-        Parameters:
-            query (str): The SQL query to execute.
-            target (Generator): The target generator to send the results to.
+        Returns the way film documents are queried: a row-exploding join or one aggregated row per film.
         """
-        while True:
-            ids = set()
-            fw_ids_from_person = (yield)
-            ids.update(fw_ids_from_person)
-            module_logger.info('Got %d film_work ids from person etl', len(fw_ids_from_person))
-
-            fw_ids_from_genre = (yield)
-            ids.update(fw_ids_from_genre)
-            module_logger.info('Got %d film_work ids from genre etl', len(fw_ids_from_genre))
+        return ModeFilmQuery(config.ETL_FW_QUERY_MODE)
 
-            fw_ids_from_fw = (yield)
-            ids.update(fw_ids_from_fw)
-            module_logger.info('Got %d film_work ids from film_work etl', len(fw_ids_from_fw))
-
-            module_logger.info('Total unique film_work ids to update: %d', len(ids))
-            if ids:
-                context = []
-                for chunck_rows in self.db_adapter.execute(query, list(ids)):
-                    context.extend(chunck_rows)
-
-                target.send(context)
+    @property
+    def query(self) -> str:
+        """
+        Returns the enrich query matching the query mode.
+        """
+        return queries.FW_AGG_QUERY if self.query_mode is ModeFilmQuery.AGGREGATE else queries.FW_QUERY
 
     @coroutine
     def transform(self, target: Generator) -> Generator:
@@ -188,52 +405,117 @@ class FilmWorkPipeline(BasePipeline):
             target (Generator): The target generator to send the transformed data to.
         """
         while rows := (yield):
-            movies = {}
-            for row in rows:
-                if row['fw_id'] not in movies:
-                    movies[row['fw_id']] = Film(
-                        id=row['fw_id'],
-                        title=row['title'],
-                        rating=row['rating'],
-                        description=row['description'],
-                        type=row['type'],
-                        creation_date=row['creation_date'],
-                    )
-                movies[row['fw_id']].add_genre(
-                    ShortGenre(
-                        id=row['genre_id'],
-                        name=row['genre_name'])
-                )
-                movies[row['fw_id']].add_person(
-                    ShortPerson(
-                        id=row['person_id'],
-                        name=row['person_name']),
-                    role=row['person_role']
-                )
-                movies[row['fw_id']].add_video(
-                    ShortFile(
-                        id=row['file_id'],
-                        path=row['file_path']),
-                    width=row['video_width']
+            if self.query_mode is ModeFilmQuery.AGGREGATE:
+                movies = self.films_from_aggregate(rows)
+            else:
+                movies = self.films_from_join(rows)
+            target.send([movie.as_dict for movie in movies])
+
+    @coroutine
+    def rename_nested(self, query: str, fields: Tuple[str, ...]) -> Generator:
+        """
+        Coroutine that renames changed persons or genres in place in the film documents. Assumes the change
+        of the row is a rename only; links to films are followed by the person_link and genre_link targets.
+
+        Parameters:
+            query (str): The SQL query selecting the id and the name of the changed rows.
+            fields (Tuple[str, ...]): The nested fields of the film documents to update.
+        """
+        while True:
+            ids = (yield)
+            names = {row['id']: row['name'] for rows in self.db_adapter.execute(query, ids) for row in rows}
+            if names:
+                self.es_loader.rename_nested(self.index, fields, names)
+
+    @staticmethod
+    def films_from_join(rows: List[dict]) -> List[Film]:
+        """
+        Builds films from the rows of FW_QUERY, where every film is spread over one row
+        per combination of its persons, genres and files.
+
+        Parameters:
+            rows (List[dict]): The rows of FW_QUERY.
+        """
+        movies = {}
+        for row in rows:
+            if row['fw_id'] not in movies:
+                movies[row['fw_id']] = Film(
+                    id=row['fw_id'],
+                    title=row['title'],
+                    rating=row['rating'],
+                    description=row['description'],
+                    type=row['type'],
+                    creation_date=row['creation_date'],
                 )
-            target.send([movie.as_dict for movie in movies.values()])
+            movies[row['fw_id']].add_genre(
+                ShortGenre(
+                    id=row['genre_id'],
+                    name=row['genre_name'])
+            )
+            movies[row['fw_id']].add_person(
+                ShortPerson(
+                    id=row['person_id'],
+                    name=row['person_name']),
+                role=row['person_role']
+            )
+            movies[row['fw_id']].add_video(
+                ShortFile(
+                    id=row['file_id'],
+                    path=row['file_path']),
+                width=row['video_width']
+            )
+        return list(movies.values())
+
+    @staticmethod
+    def films_from_aggregate(rows: List[dict]) -> List[Film]:
+        """
+        Maps the rows of FW_AGG_QUERY, which are already one row per film, to films.
 
-    def etl_process(self):
+        Parameters:
+            rows (List[dict]): The rows of FW_AGG_QUERY.
         """
-        Defines the ETL process for film works. It sets up the necessary coroutines and runs the event loop.
+        return [
+            Film(
+                id=row['fw_id'],
+                title=row['title'],
+                rating=row['rating'],
+                description=row['description'],
+                type=row['type'],
+                creation_date=row['creation_date'],
+                genre=[ShortGenre(**genre) for genre in row['genre']],
+                actors=[ShortPerson(**person) for person in row['actors']],
+                writers=[ShortPerson(**person) for person in row['writers']],
+                directors=[ShortPerson(**person) for person in row['directors']],
+                high_quality_file=[ShortFile(**file) for file in row['high_quality_file']],
+                middle_quality_file=[ShortFile(**file) for file in row['middle_quality_file']],
+                low_quality_file=[ShortFile(**file) for file in row['low_quality_file']],
+            )
+            for row in rows
+        ]
+
+    def build_process(self):
+        """
+        Sets up the coroutines of the ETL process for film works.
         """
         es_target = self.es_loader_coro(self.index)
         transform_target = self.transform(es_target)
-        enrich_target = self.enrich(queries.FW_QUERY, transform_target)
+        enrich_target = self.enrich(self.query, transform_target)
 
-        person_fw_target = self.collect_updated_ids(queries.PERSON_FW_QUERY, enrich_target)
-        genre_fw_target = self.collect_updated_ids(queries.GENRE_FW_QUERY, enrich_target)
+        if config.ETL_PARTIAL_UPDATES:
+            person_fw_target = self.rename_nested(queries.PERSON_NAMES_QUERY, self.person_fields)
+            genre_fw_target = self.rename_nested(queries.GENRE_NAMES_QUERY, self.genre_fields)
+        else:
+            person_fw_target = self.collect_updated_ids(queries.PERSON_FW_QUERY, enrich_target)
+            genre_fw_target = self.collect_updated_ids(queries.GENRE_FW_QUERY, enrich_target)
 
-        updated_fw_target = self.collect_updated_ids(queries.LAST_FW_QUERY, enrich_target)
-        updated_person_target = self.collect_updated_ids(queries.LAST_PERSON_QUERY, person_fw_target)
-        updated_genre_target = self.collect_updated_ids(queries.LAST_GENRE_QUERY, genre_fw_target)
+        updated_fw_target = self.collect_changed_ids('film_work', queries.LAST_FW_QUERY, enrich_target)
+        updated_person_target = self.collect_changed_ids('person', queries.LAST_PERSON_QUERY, person_fw_target)
+        updated_genre_target = self.collect_changed_ids('genre', queries.LAST_GENRE_QUERY, genre_fw_target)
 
-        self.event_loop([updated_person_target, updated_genre_target, updated_fw_target])
+        return (
+            [updated_person_target, updated_genre_target, updated_fw_target],
+            {'person': person_fw_target, 'genre': genre_fw_target, 'film_work': enrich_target},
+        )
 
 
 class GenrePipeline(BasePipeline):
@@ -244,24 +526,28 @@ class GenrePipeline(BasePipeline):
     @coroutine
     def transform(self, target: Generator) -> Generator:
         while rows := (yield):
-            genre = {}
-            for row in rows:
-                if row['genre_id'] not in genre:
-                    genre[row['genre_id']] = Genre(
-                        id=row['genre_id'],
-                        name=row['genre_name'],
-                        description=row['genre_description']
-                    )
-            target.send([genre.as_dict for genre in genre.values()])
+            target.send([genre.as_dict for genre in self.genres_from_rows(rows)])
+
+    @staticmethod
+    def genres_from_rows(rows: List[dict]) -> List[Genre]:
+        genre = {}
+        for row in rows:
+            if row['genre_id'] not in genre:
+                genre[row['genre_id']] = Genre(
+                    id=row['genre_id'],
+                    name=row['genre_name'],
+                    description=row['genre_description']
+                )
+        return list(genre.values())
 
-    def etl_process(self):
+    def build_process(self):
         es_target = self.es_loader_coro(self.index)
         transform_target = self.transform(es_target)
         enrich_target = self.enrich(queries.GENRE_QUERY, transform_target)
 
-        updated_genre_target = self.collect_updated_ids(queries.LAST_GENRE_QUERY, enrich_target)
+        updated_genre_target = self.collect_changed_ids('genre', queries.LAST_GENRE_QUERY, enrich_target)
 
-        self.event_loop([updated_genre_target])
+        return [updated_genre_target], {'genre': enrich_target, 'genre_link': enrich_target}
 
 
 class PersonPipeline(BasePipeline):
@@ -272,31 +558,35 @@ class PersonPipeline(BasePipeline):
     @coroutine
     def transform(self, target: Generator) -> Generator:
         while rows := (yield):
-            people = {}
-            for row in rows:
-                if row['person_id'] not in people:
-                    people[row['person_id']] = Person(
-                        id=row['person_id'],
-                        name=row['person_name']
-                    )
-                people[row['person_id']].add_role(
-                    role=row['person_role']
+            target.send([person.as_dict for person in self.persons_from_rows(rows)])
+
+    @staticmethod
+    def persons_from_rows(rows: List[dict]) -> List[Person]:
+        people = {}
+        for row in rows:
+            if row['person_id'] not in people:
+                people[row['person_id']] = Person(
+                    id=row['person_id'],
+                    name=row['person_name']
                 )
-                people[row['person_id']].add_film(
-                    ShortFilm(
-                        id=row['fw_id'],
-                        title=row['fw_title'],
-                        type=row['fw_type'],
-                        rating=row['fw_rating'],
-                    )
+            people[row['person_id']].add_role(
+                role=row['person_role']
+            )
+            people[row['person_id']].add_film(
+                ShortFilm(
+                    id=row['fw_id'],
+                    title=row['fw_title'],
+                    type=row['fw_type'],
+                    rating=row['fw_rating'],
                 )
-            target.send([person.as_dict for person in people.values()])
+            )
+        return list(people.values())
 
-    def etl_process(self):
+    def build_process(self):
         es_target = self.es_loader_coro(self.index)
         transform_target = self.transform(es_target)
         enrich_target = self.enrich(queries.PERSON_QUERY, transform_target)
 
-        updated_person_target = self.collect_updated_ids(queries.LAST_PERSON_QUERY, enrich_target)
+        updated_person_target = self.collect_changed_ids('person', queries.LAST_PERSON_QUERY, enrich_target)
 
-        self.event_loop([updated_person_target])
+        return [updated_person_target], {'person': enrich_target, 'person_link': enrich_target}
@@ -1,14 +1,37 @@
+import io
+import json
 import logging
-from typing import Generator, List, Union
+import re
+import select
+import time
+from collections import defaultdict
+from functools import lru_cache
+from itertools import count
+from typing import Dict, Generator, List, Set, Tuple, Union
 
+import asyncpg
 import config
 import psycopg2
+import queries
+from models import Watermark
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from psycopg2.extras import DictCursor, DictRow
-from .utils import backoff
+from utils import backoff, chunked
 
 # Setting up a logger for the module
 module_logger = logging.getLogger('PostgresProducer')
 
+# The placeholder of the id list in the queries
+ID_ARRAY = '= ANY(%s::uuid[])'
+
+
+def to_pg_array(ids: List[str]) -> str:
+    """
+    Formats ids as a single array literal, so a long list is one string constant
+    for the parser instead of one constant per id.
+    """
+    return '{' + ','.join(map(str, ids)) + '}'
+
 
 class PostgresProducer:
     """
@@ -22,10 +45,14 @@ class PostgresProducer:
         a dictionary containing the data source name (DSN) of the PostgreSQL database
     chunk_size : int
         the size of the chunks in which data is fetched from the database
+    temp_table_threshold : int
+        the number of ids above which an id list is copied into a temporary table
     _connection : psycopg2.extensions.connection
         the connection to the PostgreSQL database
     _cursor : psycopg2.extensions.cursor
         the cursor object used to interact with the database
+    _cursor_ids : itertools.count
+        the counter used to name server-side cursors and temporary tables
 
     Methods
     -------
@@ -33,8 +60,12 @@ class PostgresProducer:
         Initializes the cursor object.
     connect():
         Establishes a connection to the PostgreSQL database.
-    execute(query: str, query_args: Union[List, str]) -> Generator[List[DictRow], None, None]:
-        Executes a SQL query on the PostgreSQL database.
+    execute(query: str, query_args: Union[List, Tuple, str]) -> Generator[List[DictRow], None, None]:
+        Executes a SQL query on the PostgreSQL database through a server-side cursor.
+    copy_ids(ids: List[str], name: str) -> str:
+        Copies ids into a temporary table.
+    drop_temp_table(name: str):
+        Drops a temporary table.
     reset():
         Resets the connection and cursor.
     close():
@@ -43,7 +74,12 @@ class PostgresProducer:
         Initializes the connection and cursor.
     """
 
-    def __init__(self, dsn: dict, chunk_size: int = config.ETL_CHUNK_SIZE):
+    def __init__(
+        self,
+        dsn: dict,
+        chunk_size: int = config.ETL_CHUNK_SIZE,
+        temp_table_threshold: int = config.ETL_ID_TEMP_TABLE_THRESHOLD,
+    ):
         """
         Constructs all the necessary attributes for the PostgresProducer object.
 
@@ -53,11 +89,15 @@ class PostgresProducer:
                 a dictionary containing the data source name (DSN) of the PostgreSQL database
             chunk_size : int
                 the size of the chunks in which data is fetched from the database
+            temp_table_threshold : int
+                the number of ids above which an id list is copied into a temporary table
         """
         self.dsn = dsn
         self.chunk_size = chunk_size
+        self.temp_table_threshold = temp_table_threshold
         self._connection = None
         self._cursor = None
+        self._cursor_ids = count()
 
     def cursor(self) -> None:
         """
@@ -78,36 +118,100 @@ class PostgresProducer:
         module_logger.info('PostgreSQL connection is open')
 
     @backoff(exceptions=(psycopg2.DatabaseError, psycopg2.OperationalError), logger=module_logger)
-    def execute(self, query: str, query_args: Union[List, str]) -> Generator[List[DictRow], None, None]:
+    def execute(self, query: str, query_args: Union[List, Tuple, str]) -> Generator[List[DictRow], None, None]:
         """
-        Executes a SQL query on the PostgreSQL database. The query is executed in chunks of size chunk_size.
+        Executes a SQL query on the PostgreSQL database. The query is executed through a named server-side
+        cursor and rows are fetched in chunks of size chunk_size, so the result is never materialized
+        on the client at once.
+
+        An id list is bound as one array literal. A list longer than temp_table_threshold is copied
+        into a temporary table joined by the query instead, so the size of the query stays bounded.
 
         Parameters
         ----------
             query : str
                 the SQL query to be executed
-            query_args : Union[List, str]
-                the arguments to be passed to the SQL query
+            query_args : Union[List, Tuple, str]
+                the arguments to be passed to the SQL query: a string for a single placeholder,
+                a list for an ``= ANY(%s::uuid[])`` placeholder or a tuple of positional placeholders
 
         Yields
         ------
             List[DictRow]
                 a list of rows fetched from the database
         """
+        temp_table = None
         try:
             if isinstance(query_args, str):
                 query = self._cursor.mogrify(query, (query_args,))
+            elif isinstance(query_args, list) and len(query_args) > self.temp_table_threshold:
+                temp_table = f'etl_ids_{next(self._cursor_ids)}'
+                self.copy_ids(query_args, temp_table)
+                query = query.replace(ID_ARRAY, f'IN (SELECT id FROM {temp_table})')
             elif isinstance(query_args, list):
-                query = self._cursor.mogrify(query, (tuple(query_args),))
+                query = self._cursor.mogrify(query, (to_pg_array(query_args),))
+            elif isinstance(query_args, tuple):
+                query = self._cursor.mogrify(query, query_args)
             else:
-                raise TypeError(f'Type of query args must be string or list. not {type(query_args)}')
-            self._cursor.execute(query)
+                raise TypeError(f'Type of query args must be string, list or tuple. not {type(query_args)}')
+            server_cursor = self._connection.cursor(
+                name=f'etl_cursor_{next(self._cursor_ids)}', cursor_factory=DictCursor
+            )
+            server_cursor.itersize = self.chunk_size
+            try:
+                server_cursor.execute(query)
+                while rows := server_cursor.fetchmany(self.chunk_size):
+                    yield rows
+            finally:
+                server_cursor.close()
         except psycopg2.OperationalError:
             self.reset()
             raise
-        else:
-            while rows := self._cursor.fetchmany(self.chunk_size):
-                yield rows
+        finally:
+            if temp_table:
+                self.drop_temp_table(temp_table)
+
+    def copy_ids(self, ids: List[str], name: str) -> str:
+        """
+        Copies ids into a temporary table, chunk by chunk, and analyzes it so the planner
+        knows its size. The table lives until it is dropped or the connection is closed.
+
+        Parameters
+        ----------
+            ids : List[str]
+                the ids to copy
+            name : str
+                the name of the temporary table
+
+        Returns
+        -------
+            str
+                the name of the temporary table
+        """
+        self._cursor.execute(f'CREATE TEMPORARY TABLE {name} (id uuid PRIMARY KEY);')
+        for chunk_ids in chunked(dict.fromkeys(map(str, ids)), config.ETL_BATCH_LIMIT):
+            self._cursor.copy_expert(f'COPY {name} (id) FROM STDIN', io.StringIO('\n'.join(chunk_ids)))
+        self._cursor.execute(f'ANALYZE {name};')
+        module_logger.info('Copied %d ids into %s', len(ids), name)
+        return name
+
+    def drop_temp_table(self, name: str) -> None:
+        """
+        Drops a temporary table, whatever state the connection was left in. A closed connection
+        has dropped it already, and a failed transaction drops it on rollback, as the table was
+        created in it.
+
+        Parameters
+        ----------
+            name : str
+                the name of the temporary table
+        """
+        if self._cursor is None or self._connection.closed:
+            return
+        try:
+            self._cursor.execute(f'DROP TABLE IF EXISTS {name};')
+        except psycopg2.Error:
+            self._connection.rollback()
 
     def reset(self) -> None:
         """
@@ -135,3 +239,263 @@ class PostgresProducer:
         """
         self.connect()
         self.cursor()
+
+
+class PostgresListener:
+    """
+    A class used to receive change notifications sent by the content triggers.
+
+    ...
+
+    Attributes
+    ----------
+    dsn : dict
+        a dictionary containing the data source name (DSN) of the PostgreSQL database
+    channel : str
+        the name of the channel the triggers notify
+    _connection : psycopg2.extensions.connection
+        the autocommit connection that LISTENs on the channel
+    _watermarks : Dict[str, Watermark]
+        the latest (modified, id) notified for each table since the last call of pop_watermarks
+
+    Methods
+    -------
+    init():
+        Installs the triggers that notify the channel about changed rows.
+    connect():
+        Establishes a connection and starts listening on the channel.
+    collect(timeout: float, debounce: float, max_wait: float, limit: int) -> Dict[str, Set[str]]:
+        Waits for notifications and returns changed ids grouped by table.
+    pop_watermarks() -> Dict[str, Watermark]:
+        Returns the latest (modified, id) notified for each table and forgets them.
+    close():
+        Closes the connection to the PostgreSQL database.
+    """
+
+    def __init__(self, dsn: dict, channel: str = config.ETL_CDC_CHANNEL):
+        """
+        Constructs all the necessary attributes for the PostgresListener object.
+
+        Parameters
+        ----------
+            dsn : dict
+                a dictionary containing the data source name (DSN) of the PostgreSQL database
+            channel : str
+                the name of the channel the triggers notify
+        """
+        self.dsn = dsn
+        self.channel = channel
+        self._connection = None
+        self._watermarks = {}
+
+    def init(self) -> None:
+        """
+        Installs the triggers that notify the channel about changed rows.
+        """
+        self.connect()
+        with self._connection.cursor() as cursor:
+            cursor.execute(queries.CDC_TRIGGERS_QUERY.format(channel=self.channel))
+        module_logger.info('Change data capture triggers are installed for channel %s', self.channel)
+
+    @backoff(psycopg2.OperationalError, logger=module_logger)
+    def connect(self) -> None:
+        """
+        Establishes a connection to the PostgreSQL database and starts listening on the channel.
+        Notifications sent while nobody listened are lost, so callers must catch up by polling after connecting.
+        """
+        self.close()
+        self._watermarks = {}
+        self._connection = psycopg2.connect(**self.dsn)
+        self._connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel};')
+        module_logger.info('Listening on channel %s', self.channel)
+
+    def collect(self, timeout: float, debounce: float, max_wait: float, limit: int) -> Dict[str, Set[str]]:
+        """
+        Waits up to timeout seconds for the first notification, then keeps collecting until no new
+        notification arrives for debounce seconds, max_wait seconds have passed or limit ids are collected.
+
+        Parameters
+        ----------
+            timeout : float
+                the time to wait for the first notification
+            debounce : float
+                the quiet period that closes a batch
+            max_wait : float
+                the maximum time a batch is kept open
+            limit : int
+                the maximum number of ids in a batch
+
+        Returns
+        -------
+            Dict[str, Set[str]]
+                changed ids grouped by table, empty if nothing changed within timeout
+
+        Raises
+        ------
+            psycopg2.OperationalError
+                if the connection is lost
+        """
+        changes = defaultdict(set)
+        if not self._wait(timeout):
+            return changes
+
+        started, collected = time.monotonic(), 0
+        while True:
+            collected += self._drain(changes)
+            remaining = max_wait - (time.monotonic() - started)
+            if collected >= limit or remaining <= 0 or not self._wait(min(debounce, remaining)):
+                return changes
+
+    def _wait(self, timeout: float) -> bool:
+        """
+        Waits for the connection to become readable and reads pending notifications.
+        """
+        if select.select([self._connection], [], [], timeout) == ([], [], []):
+            return False
+        self._connection.poll()
+        return True
+
+    def _drain(self, changes: Dict[str, Set[str]]) -> int:
+        """
+        Moves pending notifications into changes and returns how many there were.
+        """
+        drained = 0
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            payload = json.loads(notify.payload)
+            changes[payload['table']].add(payload['id'])
+            if payload.get('modified'):
+                watermark = Watermark(modified=payload['modified'], id=payload['id'])
+                latest = self._watermarks.get(payload['table'])
+                if latest is None or watermark.position > latest.position:
+                    self._watermarks[payload['table']] = watermark
+            drained += 1
+        return drained
+
+    def pop_watermarks(self) -> Dict[str, Watermark]:
+        """
+        Returns the latest (modified, id) notified for each table since the previous call and forgets them.
+        Link rows have no modification time and are left out.
+
+        Returns
+        -------
+            Dict[str, Watermark]
+                the latest notified watermark of each table
+        """
+        watermarks, self._watermarks = self._watermarks, {}
+        return watermarks
+
+    def close(self) -> None:
+        """
+        Closes the connection to the PostgreSQL database.
+        """
+        if self._connection:
+            if not self._connection.closed:
+                self._connection.close()
+            module_logger.info('PostgreSQL listener connection is closed')
+        self._connection = None
+
+
+@lru_cache(maxsize=None)
+def to_asyncpg_query(query: str) -> str:
+    """
+    Rewrites a psycopg2 query for asyncpg: ``%s`` placeholders become ``$1, $2, ...``.
+    Id lists are bound by asyncpg as uuid arrays.
+    """
+    placeholders = count(1)
+    return re.sub('%s', lambda _: f'${next(placeholders)}', query)
+
+
+class AsyncPostgresProducer:
+    """
+    A class used to run the ETL queries over an asyncpg connection pool.
+
+    ...
+
+    Attributes
+    ----------
+    dsn : dict
+        a dictionary containing the data source name (DSN) of the PostgreSQL database
+    pool_size : int
+        the maximum number of connections in the pool
+    _pool : asyncpg.Pool
+        the connection pool
+
+    Methods
+    -------
+    init():
+        Creates the connection pool.
+    fetch(query: str, query_args: Union[List, Tuple]) -> List[asyncpg.Record]:
+        Executes a SQL query and returns all its rows.
+    close():
+        Closes the connection pool.
+    """
+
+    def __init__(self, dsn: dict, pool_size: int = config.POSTGRES_POOL_SIZE):
+        """
+        Constructs all the necessary attributes for the AsyncPostgresProducer object.
+
+        Parameters
+        ----------
+            dsn : dict
+                a dictionary containing the data source name (DSN) of the PostgreSQL database
+            pool_size : int
+                the maximum number of connections in the pool
+        """
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self._pool = None
+
+    async def init(self) -> None:
+        """
+        Creates the connection pool.
+        """
+        self._pool = await asyncpg.create_pool(
+            host=self.dsn['host'],
+            port=self.dsn['port'],
+            user=self.dsn['user'],
+            password=self.dsn['password'],
+            database=self.dsn['dbname'],
+            min_size=1,
+            max_size=self.pool_size,
+            init=self._init_connection,
+        )
+        module_logger.info('PostgreSQL pool is open')
+
+    @staticmethod
+    async def _init_connection(connection: asyncpg.Connection) -> None:
+        """
+        Makes rows look like the rows of PostgresProducer: uuids as strings and json decoded.
+        """
+        await connection.set_type_codec('uuid', encoder=str, decoder=str, schema='pg_catalog', format='text')
+        await connection.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+    async def fetch(self, query: str, query_args: Union[List, Tuple]) -> List[asyncpg.Record]:
+        """
+        Executes a SQL query written for PostgresProducer and returns all its rows.
+
+        Parameters
+        ----------
+            query : str
+                the SQL query to be executed
+            query_args : Union[List, Tuple]
+                a list for an ``= ANY(%s::uuid[])`` placeholder or a tuple of positional placeholders
+
+        Returns
+        -------
+            List[asyncpg.Record]
+                the rows of the query
+        """
+        args = (query_args,) if isinstance(query_args, list) else query_args
+        return await self._pool.fetch(to_asyncpg_query(query), *args)
+
+    async def close(self) -> None:
+        """
+        Closes the connection pool.
+        """
+        if self._pool:
+            await self._pool.close()
+            module_logger.info('PostgreSQL pool is closed')
+        self._pool = None
@@ -1,19 +1,82 @@
-LAST_FW_QUERY = "SELECT id FROM content.film_work WHERE modified > %s ORDER BY modified;"
-LAST_PERSON_QUERY = "SELECT id FROM content.person WHERE modified > %s ORDER BY modified;"
-LAST_GENRE_QUERY = "SELECT id FROM content.genre WHERE modified > %s ORDER BY modified;"
+# Changed rows are paged by a (modified, id) keyset, so every page starts right
+# after the last row of the previous one and no row is skipped or repeated.
+LAST_FW_QUERY = '''
+SELECT id, modified
+FROM content.film_work
+WHERE (modified, id) > (%s::timestamptz, %s::uuid)
+ORDER BY modified, id
+LIMIT %s;
+'''
+LAST_PERSON_QUERY = '''
+SELECT id, modified
+FROM content.person
+WHERE (modified, id) > (%s::timestamptz, %s::uuid)
+ORDER BY modified, id
+LIMIT %s;
+'''
+LAST_GENRE_QUERY = '''
+SELECT id, modified
+FROM content.genre
+WHERE (modified, id) > (%s::timestamptz, %s::uuid)
+ORDER BY modified, id
+LIMIT %s;
+'''
+
+# A full reindex splits the uuid space into (lower, upper] ranges,
+# each paged by id in its own worker process.
+SLICE_FW_QUERY = '''
+SELECT id
+FROM content.film_work
+WHERE id > %s::uuid AND id <= %s::uuid
+ORDER BY id
+LIMIT %s;
+'''
+SLICE_PERSON_QUERY = '''
+SELECT id
+FROM content.person
+WHERE id > %s::uuid AND id <= %s::uuid
+ORDER BY id
+LIMIT %s;
+'''
+SLICE_GENRE_QUERY = '''
+SELECT id
+FROM content.genre
+WHERE id > %s::uuid AND id <= %s::uuid
+ORDER BY id
+LIMIT %s;
+'''
 
+NOW_QUERY = '''
+SELECT clock_timestamp() AS now;
+'''
+
+# Id lists are bound as one uuid[] literal. Above ETL_ID_TEMP_TABLE_THRESHOLD ids,
+# PostgresProducer copies them into a temporary table and joins it instead.
 PERSON_FW_QUERY = '''
 SELECT DISTINCT fw.id
 FROM content.film_work fw
 LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-WHERE pfw.person_id IN %s; 
+WHERE pfw.person_id = ANY(%s::uuid[]);
 '''
 
 GENRE_FW_QUERY = '''
 SELECT DISTINCT fw.id
 FROM content.film_work fw
 LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-WHERE gfw.genre_id IN %s; 
+WHERE gfw.genre_id = ANY(%s::uuid[]);
+'''
+
+# Names of changed persons and genres, renamed in place in the film documents
+PERSON_NAMES_QUERY = '''
+SELECT id, full_name as name
+FROM content.person
+WHERE id = ANY(%s::uuid[]);
+'''
+
+GENRE_NAMES_QUERY = '''
+SELECT id, name
+FROM content.genre
+WHERE id = ANY(%s::uuid[]);
 '''
 
 FW_QUERY = '''
@@ -40,7 +103,58 @@ LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
 LEFT JOIN content.genre g ON g.id = gfw.genre_id
 LEFT JOIN content.file_film_work ffw ON ffw.film_work_id = fw.id
 LEFT JOIN content.file f ON f.id = ffw.file_id
-WHERE fw.id IN %s; 
+WHERE fw.id = ANY(%s::uuid[]);
+'''
+
+# One row per film: persons, genres and files are aggregated in correlated
+# subqueries, so the joins never multiply each other.
+FW_AGG_QUERY = '''
+SELECT
+    fw.id as fw_id,
+    fw.title,
+    fw.description,
+    fw.rating,
+    fw.type,
+    fw.creation_date,
+    COALESCE(g.genre, '[]') as genre,
+    COALESCE(p.actors, '[]') as actors,
+    COALESCE(p.writers, '[]') as writers,
+    COALESCE(p.directors, '[]') as directors,
+    COALESCE(f.high_quality_file, '[]') as high_quality_file,
+    COALESCE(f.middle_quality_file, '[]') as middle_quality_file,
+    COALESCE(f.low_quality_file, '[]') as low_quality_file
+FROM content.film_work fw
+LEFT JOIN LATERAL (
+    SELECT json_agg(json_build_object('id', g.id, 'name', g.name) ORDER BY g.name, g.id) as genre
+    FROM content.genre_film_work gfw
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE gfw.film_work_id = fw.id
+) g ON TRUE
+LEFT JOIN LATERAL (
+    SELECT
+        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.full_name, p.id)
+            FILTER (WHERE pfw.role = 'actor') as actors,
+        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.full_name, p.id)
+            FILTER (WHERE pfw.role = 'writer') as writers,
+        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.full_name, p.id)
+            FILTER (WHERE pfw.role = 'director') as directors
+    FROM content.person_film_work pfw
+    JOIN content.person p ON p.id = pfw.person_id
+    WHERE pfw.film_work_id = fw.id
+) p ON TRUE
+LEFT JOIN LATERAL (
+    SELECT
+        json_agg(json_build_object('id', f.id, 'path', f.file_path) ORDER BY f.id)
+            FILTER (WHERE f.video_width >= 720) as high_quality_file,
+        json_agg(json_build_object('id', f.id, 'path', f.file_path) ORDER BY f.id)
+            FILTER (WHERE f.video_width >= 480 AND f.video_width < 720) as middle_quality_file,
+        json_agg(json_build_object('id', f.id, 'path', f.file_path) ORDER BY f.id)
+            FILTER (WHERE f.video_width > 0 AND f.video_width < 480) as low_quality_file
+    FROM content.file_film_work ffw
+    JOIN content.file f ON f.id = ffw.file_id
+    WHERE ffw.film_work_id = fw.id
+) f ON TRUE
+WHERE fw.id = ANY(%s::uuid[]);
 '''
 
 PERSON_QUERY = '''
@@ -55,7 +169,7 @@ SELECT
 FROM content.person p
 LEFT JOIN content.person_film_work pfw ON pfw.person_id = p.id
 LEFT JOIN content.film_work fw ON fw.id = pfw.film_work_id
-WHERE p.id IN %s; 
+WHERE p.id = ANY(%s::uuid[]);
 '''
 
 
@@ -65,5 +179,64 @@ SELECT
     g.name as genre_name,
     g.description as genre_description
 FROM content.genre g
-WHERE g.id IN %s; 
+WHERE g.id = ANY(%s::uuid[]);
+'''
+
+
+# Change data capture: every committed change of a film, person or genre (and of the
+# links between them) is sent as {"table": ..., "id": ..., "modified": ...} to the {channel} channel.
+# The trigger arguments are the channel and (table, id column) pairs: a link row is sent as a
+# film_work change and as a person_link or genre_link change of its other side, which only the
+# persons and genres indexes follow. modified is the UTC modification time of a changed film, person or genre,
+# formatted as the watermarks, and null for a link row.
+CDC_TRIGGERS_QUERY = '''
+CREATE OR REPLACE FUNCTION content.notify_content_change() RETURNS trigger AS $$
+DECLARE
+    changed_row jsonb;
+    modified text;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed_row := to_jsonb(OLD);
+    ELSE
+        changed_row := to_jsonb(NEW);
+    END IF;
+    modified := to_char(
+        (changed_row ->> 'modified')::timestamptz AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US"+00:00"'
+    );
+    FOR i IN 1..(TG_NARGS - 1) / 2 LOOP
+        PERFORM pg_notify(TG_ARGV[0], json_build_object(
+            'table', TG_ARGV[2 * i - 1], 'id', changed_row ->> TG_ARGV[2 * i], 'modified', modified
+        )::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS film_work_cdc ON content.film_work;
+CREATE TRIGGER film_work_cdc AFTER INSERT OR UPDATE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change('{channel}', 'film_work', 'id');
+
+DROP TRIGGER IF EXISTS person_cdc ON content.person;
+CREATE TRIGGER person_cdc AFTER INSERT OR UPDATE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change('{channel}', 'person', 'id');
+
+DROP TRIGGER IF EXISTS genre_cdc ON content.genre;
+CREATE TRIGGER genre_cdc AFTER INSERT OR UPDATE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change('{channel}', 'genre', 'id');
+
+DROP TRIGGER IF EXISTS person_film_work_cdc ON content.person_film_work;
+CREATE TRIGGER person_film_work_cdc AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change(
+        '{channel}', 'film_work', 'film_work_id', 'person_link', 'person_id'
+    );
+
+DROP TRIGGER IF EXISTS genre_film_work_cdc ON content.genre_film_work;
+CREATE TRIGGER genre_film_work_cdc AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change(
+        '{channel}', 'film_work', 'film_work_id', 'genre_link', 'genre_id'
+    );
+
+DROP TRIGGER IF EXISTS file_film_work_cdc ON content.file_film_work;
+CREATE TRIGGER file_film_work_cdc AFTER INSERT OR UPDATE OR DELETE ON content.file_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.notify_content_change('{channel}', 'film_work', 'film_work_id');
 '''
@@ -0,0 +1,159 @@
+"""
+Rebuilds an index from scratch without downtime.
+
+A new version of the index is created with bulk load settings and filled by worker processes,
+each of them owning a slice of the id space. Then the alias read by the API is atomically
+moved to the new index, the old one is deleted and the changes made during the reindex
+are replayed into the new index.
+
+Run from services/movies_etl:
+    python postgres_to_es/reindex.py movies --workers 4
+"""
+import argparse
+import logging
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import config
+import queries
+from elastic import CONTENT_HASH_FIELD, ElasticsearchLoader, content_hash
+from models import ModeFilmQuery, Watermark
+from pipelines import FilmWorkPipeline, GenrePipeline, PersonPipeline
+from postgres import PostgresProducer
+from state import JsonFileStorage, State
+from utils import chunked
+
+logging.basicConfig(
+    level=logging.INFO, format='%(asctime)s: %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Reindex')
+
+DSN = {
+    'dbname': config.POSTGRES_NAME,
+    'user': config.POSTGRES_USER,
+    'password': config.POSTGRES_PASSWORD,
+    'host': config.POSTGRES_HOST,
+    'port': config.POSTGRES_PORT,
+}
+HOSTS = ['http://{host}:{port}'.format(host=config.ELASTICSEARCH_HOST, port=config.ELASTICSEARCH_PORT)]
+
+if ModeFilmQuery(config.ETL_FW_QUERY_MODE) is ModeFilmQuery.AGGREGATE:
+    FW_SOURCE = (queries.SLICE_FW_QUERY, queries.FW_AGG_QUERY, FilmWorkPipeline.films_from_aggregate)
+else:
+    FW_SOURCE = (queries.SLICE_FW_QUERY, queries.FW_QUERY, FilmWorkPipeline.films_from_join)
+
+# Slice query, document query and row mapping of every index
+SOURCES = {
+    'movies': FW_SOURCE,
+    'persons': (queries.SLICE_PERSON_QUERY, queries.PERSON_QUERY, PersonPipeline.persons_from_rows),
+    'genres': (queries.SLICE_GENRE_QUERY, queries.GENRE_QUERY, GenrePipeline.genres_from_rows),
+}
+PIPELINES = {
+    'movies': FilmWorkPipeline,
+    'persons': PersonPipeline,
+    'genres': GenrePipeline,
+}
+
+
+def uuid_bounds(slices: int) -> List[str]:
+    """
+    Splits the uuid space into equal (lower, upper] ranges. The nil uuid, left out
+    of the first range, is never generated for content.
+    """
+    return [str(uuid.UUID(int=(2 ** 128 - 1) * number // slices)) for number in range(slices + 1)]
+
+
+def build_documents(db_adapter: PostgresProducer, index: str, ids: List[str]) -> List[dict]:
+    """
+    Builds the documents of the index with the given ids from the database. Ids without
+    a row any more are left out.
+    """
+    _, query, transform = SOURCES[index]
+    rows = [row for chunk_rows in db_adapter.execute(query, ids) for row in chunk_rows]
+    return [document.as_dict for document in transform(rows)]
+
+
+def load_slice(index: str, index_name: str, lower: str, upper: str) -> int:
+    """
+    Loads the documents whose id is in the (lower, upper] range. Runs in a worker process
+    with its own database connection and Elasticsearch client.
+
+    Returns the number of loaded source rows.
+    """
+    slice_query = SOURCES[index][0]
+    db_adapter = PostgresProducer(DSN)
+    db_adapter.init()
+    es_loader = ElasticsearchLoader(HOSTS, skip_unchanged=False)
+    loaded, last_id = 0, lower
+    try:
+        while True:
+            ids = [
+                row['id']
+                for rows in db_adapter.execute(slice_query, (last_id, upper, config.ETL_BATCH_LIMIT))
+                for row in rows
+            ]
+            for chunk_ids in chunked(ids, config.ETL_CHUNK_SIZE):
+                documents = build_documents(db_adapter, index, chunk_ids)
+                es_loader.load_to_es(
+                    [{**document, CONTENT_HASH_FIELD: content_hash(document)} for document in documents], index_name
+                )
+            loaded += len(ids)
+            if len(ids) < config.ETL_BATCH_LIMIT:
+                return loaded
+            last_id = ids[-1]
+    finally:
+        db_adapter.close()
+
+
+def replay_changes(index: str, since: Watermark) -> None:
+    """
+    Runs the pipeline of the index once from a watermark, with an in-memory state,
+    so the changes made while the new index was filled reach it through the alias.
+    """
+    state = State(JsonFileStorage())
+    state.set_state(f'{index}_last_updated', since.modified)
+    pipeline = PIPELINES[index](state, PostgresProducer(DSN), ElasticsearchLoader(HOSTS))
+    generators, _ = pipeline.build_process()
+    pipeline.sync(generators)
+    pipeline.db_adapter.close()
+
+
+def reindex(index: str, workers: int) -> None:
+    db_adapter = PostgresProducer(DSN)
+    db_adapter.init()
+    now = [row['now'] for rows in db_adapter.execute(queries.NOW_QUERY, ()) for row in rows][0]
+    started = Watermark(modified=str(now))
+    db_adapter.close()
+
+    es_loader = ElasticsearchLoader(HOSTS, skip_unchanged=False)
+    index_name = es_loader.create_bulk_index(index)
+    bounds = uuid_bounds(workers)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(load_slice, index, index_name, lower, upper)
+                for lower, upper in zip(bounds, bounds[1:])
+            ]
+            loaded = sum(future.result() for future in futures)
+    except Exception:
+        logger.exception('Reindex of %s failed, %s is deleted', index, index_name)
+        es_loader.delete_index(index_name)
+        raise
+    logger.info('Loaded %d rows into %s with %d workers', loaded, index_name, workers)
+
+    es_loader.swap_alias(index, index_name)
+    replay_changes(index, started)
+    logger.info('Reindex of %s is finished', index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('index', choices=list(SOURCES), help='index to rebuild')
+    parser.add_argument('--workers', type=int, default=config.ETL_REINDEX_WORKERS, help='worker processes')
+    args = parser.parse_args()
+    reindex(args.index, args.workers)
+
+
+if __name__ == '__main__':
+    main()
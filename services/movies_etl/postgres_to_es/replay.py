@@ -0,0 +1,79 @@
+"""
+Inspects and replays the documents Elasticsearch rejected for good.
+
+`list` prints the dead letters, `replay` rebuilds their documents from the database
+and sends them again: the ones rejected again are appended back to the dead-letter file.
+
+Run from services/movies_etl:
+    python postgres_to_es/replay.py list
+    python postgres_to_es/replay.py replay --index movies
+"""
+import argparse
+import logging
+from collections import defaultdict
+
+import config
+from dead_letters import DeadLetterStore
+from elastic import ElasticsearchLoader
+from postgres import PostgresProducer
+from reindex import DSN, HOSTS, SOURCES, build_documents
+from utils import chunked
+
+logging.basicConfig(
+    level=logging.INFO, format='%(asctime)s: %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Replay')
+
+
+def list_dead_letters(store: DeadLetterStore, index: str) -> None:
+    for dead_letter in store.read():
+        if index in (None, dead_letter['index']):
+            print(
+                f"{dead_letter['failed_at']} {dead_letter['index']} {dead_letter['id']} "
+                f"{dead_letter['status']}: {dead_letter['error']}"
+            )
+
+
+def source_index(index_name: str) -> str:
+    """
+    Returns the index whose source builds the documents of an index, also for the
+    timestamped indexes filled by a reindex.
+    """
+    return index_name if index_name in SOURCES else index_name.rsplit('_', 1)[0]
+
+
+def replay_dead_letters(store: DeadLetterStore, index: str) -> None:
+    with store.take(lambda dead_letter: index in (None, dead_letter['index'])) as dead_letters:
+        # Ids by index, once each and in order
+        ids = defaultdict(dict)
+        for dead_letter in dead_letters:
+            ids[dead_letter['index']][dead_letter['id']] = None
+        db_adapter = PostgresProducer(DSN)
+        db_adapter.init()
+        es_loader = ElasticsearchLoader(HOSTS, dead_letter_file=store.file_path)
+        try:
+            for index_name, index_ids in ids.items():
+                logger.info('Replay %d docs into %s', len(index_ids), index_name)
+                for chunk_ids in chunked(list(index_ids), config.ETL_CHUNK_SIZE):
+                    documents = build_documents(db_adapter, source_index(index_name), chunk_ids)
+                    es_loader.load_to_es(documents, index_name)
+        finally:
+            db_adapter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['list', 'replay'])
+    parser.add_argument('--index', help='only the dead letters of this index')
+    parser.add_argument('--file', default=config.ETL_DEAD_LETTER_FILE, help='dead-letter file')
+    args = parser.parse_args()
+
+    store = DeadLetterStore(args.file)
+    if args.command == 'list':
+        list_dead_letters(store, args.index)
+    else:
+        replay_dead_letters(store, args.index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Tuple
+
+import config
+import queries
+from elastic import AsyncElasticsearchLoader
+from models import ModeFilmQuery, Watermark
+from pipelines import FilmWorkPipeline, GenrePipeline, PersonPipeline
+from postgres import AsyncPostgresProducer
+from state import State
+from utils import AdaptiveDelay, chunked
+
+module_logger = logging.getLogger('AsyncETLRunner')
+
+
+class AsyncETLRunner:
+    """
+    Runs the film work, person and genre pipelines in a single process on asyncio.
+
+    Every source table is scanned once per cycle and its changed ids are routed to all the indexes
+    that depend on it, instead of every pipeline scanning the same table on its own. While a batch
+    is being indexed, the rows of the next batch are already being fetched from the database.
+
+    Attributes:
+        state (State): An instance of the State class that manages the watermarks of the source tables.
+        db_adapter (AsyncPostgresProducer): An instance of the AsyncPostgresProducer class that handles database operations.
+        es_loader (AsyncElasticsearchLoader): An instance of the AsyncElasticsearchLoader class that handles
+            Elasticsearch operations.
+        run_stats (Counter): The number of changed rows and full batches of the current cycle.
+        lags (Dict[str, float]): The lag in seconds of every source table in the current cycle.
+        partial_updates (bool): Whether names of changed persons or genres are renamed in place in the film
+            documents instead of rebuilding the films.
+    """
+
+    # Indexes fed by every source table
+    dependent_indexes = {
+        'film_work': ('movies',),
+        'person': ('movies', 'persons'),
+        'genre': ('movies', 'genres'),
+    }
+
+    indexes = ('movies', 'genres', 'persons')
+
+    def __init__(
+        self,
+        state: State,
+        db_adapter: AsyncPostgresProducer,
+        es_loader: AsyncElasticsearchLoader,
+        partial_updates: bool = False,
+    ):
+        """
+        The constructor for the AsyncETLRunner class.
+
+        Parameters:
+            state (State): An instance of the State class.
+            db_adapter (AsyncPostgresProducer): An instance of the AsyncPostgresProducer class.
+            es_loader (AsyncElasticsearchLoader): An instance of the AsyncElasticsearchLoader class.
+            partial_updates (bool): Whether to rename persons and genres in place. Only safe when every change
+                of a person or genre is a rename seen by CDC; the runner polls, so it rebuilds by default.
+        """
+        self.state = state
+        self.db_adapter = db_adapter
+        self.es_loader = es_loader
+        self.query_mode = ModeFilmQuery(config.ETL_FW_QUERY_MODE)
+        self.run_stats = Counter()
+        self.lags = {}
+        self.partial_updates = partial_updates
+
+    @property
+    def fw_query(self) -> str:
+        """
+        Returns the film query matching the query mode.
+        """
+        return queries.FW_AGG_QUERY if self.query_mode is ModeFilmQuery.AGGREGATE else queries.FW_QUERY
+
+    @property
+    def fw_transform(self) -> Callable:
+        """
+        Returns the row mapping matching the query mode.
+        """
+        if self.query_mode is ModeFilmQuery.AGGREGATE:
+            return FilmWorkPipeline.films_from_aggregate
+        return FilmWorkPipeline.films_from_join
+
+    async def run(self) -> None:
+        """
+        Synchronizes all the indexes until the process is stopped. Cycles run back to back while
+        they hit the batch limit and the delay between idle cycles grows up to ETL_SYNC_MAX_DELAY.
+        """
+        await self.db_adapter.init()
+        try:
+            for index in self.indexes:
+                await self.es_loader.init(index)
+            delays = AdaptiveDelay(config.ETL_SYNC_DELAY, config.ETL_SYNC_MAX_DELAY)
+            while True:
+                await self.sync()
+                delay = delays.next_delay(self.run_stats['changed'], self.run_stats['full_batches'] > 0)
+                module_logger.info('Sleep %d seconds', delay)
+                await asyncio.sleep(delay)
+        finally:
+            await self.db_adapter.close()
+            await self.es_loader.close()
+
+    async def sync(self) -> None:
+        """
+        Scans the three source tables concurrently and loads the changes into the indexes.
+        The lag of every source table is checkpointed as `{source}_lag`.
+        """
+        self.run_stats = Counter()
+        self.lags = dict.fromkeys(self.dependent_indexes, 0.0)
+        await asyncio.gather(
+            self.collect_changed_ids('film_work', queries.LAST_FW_QUERY, self.film_work_changed),
+            self.collect_changed_ids('person', queries.LAST_PERSON_QUERY, self.person_changed),
+            self.collect_changed_ids('genre', queries.LAST_GENRE_QUERY, self.genre_changed),
+        )
+        for index in self.indexes:
+            stats = self.es_loader.pop_stats(index)
+            module_logger.info(
+                'Run for %s: %d docs written, %d unchanged skipped, %d failed',
+                index, stats['written'], stats['skipped'], stats['failed'],
+            )
+        measured_at = datetime.now(timezone.utc).isoformat()
+        self.state.set_states({
+            f'{source}_lag': {'seconds': round(lag, 3), 'measured_at': measured_at}
+            for source, lag in self.lags.items()
+        })
+        module_logger.info(
+            'Lag: %s over %d changed rows',
+            ', '.join(f'{source} {lag:.1f} seconds' for source, lag in self.lags.items()), self.run_stats['changed'],
+        )
+
+    def get_watermark(self, source: str) -> Watermark:
+        """
+        Returns the watermark of a source table. Before the first checkpoint of the runner, it starts
+        from the oldest watermark left by the per-index pipelines, so no index misses a change.
+
+        Parameters:
+            source (str): The name of the source table.
+        """
+        if stored_watermark := self.state.get_state(f'{source}_watermark'):
+            return Watermark.from_state(stored_watermark, config.ETL_DEFAULT_DATE)
+
+        watermarks = []
+        for index in self.dependent_indexes[source]:
+            stored_watermark = (
+                self.state.get_state(f'{index}_{source}_watermark')
+                or self.state.get_state(f'{index}_last_updated')
+            )
+            watermarks.append(Watermark.from_state(stored_watermark, config.ETL_DEFAULT_DATE))
+        return min(watermarks, key=lambda watermark: (watermark.modified_at, watermark.id))
+
+    async def collect_changed_ids(
+        self, source: str, query: str, route: Callable[[List[str]], Awaitable[None]]
+    ) -> None:
+        """
+        Pages through the rows of a source table changed after its watermark and routes their IDs
+        batch by batch, checkpointing the watermark once a batch has been loaded.
+
+        Parameters:
+            source (str): The name of the source table, used to build the state key.
+            query (str): The keyset-paged SQL query to execute.
+            route (Callable): The coroutine function loading the changed IDs into the dependent indexes.
+        """
+        watermark = self.get_watermark(source)
+        # The rows of a full load are as old as the catalog, they are not delayed changes
+        full_load = watermark.modified == config.ETL_DEFAULT_DATE
+        while True:
+            rows = await self.db_adapter.fetch(
+                query, (watermark.modified_at, watermark.id, config.ETL_BATCH_LIMIT)
+            )
+            if not rows:
+                break
+
+            module_logger.info('Got %d changed %s ids after %s', len(rows), source, watermark.modified)
+            self.run_stats.update(changed=len(rows), full_batches=len(rows) == config.ETL_BATCH_LIMIT)
+            if not full_load:
+                self.lags[source] = max(self.lags[source], Watermark(modified=str(rows[0]['modified'])).lag)
+            await route([row['id'] for row in rows])
+
+            watermark = Watermark(modified=str(rows[-1]['modified']), id=str(rows[-1]['id']))
+            self.state.set_state(f'{source}_watermark', watermark.as_dict)
+            if len(rows) < config.ETL_BATCH_LIMIT:
+                break
+
+    async def film_work_changed(self, ids: List[str]) -> None:
+        await self.load_ids('movies', self.fw_query, self.fw_transform, ids)
+
+    async def person_changed(self, ids: List[str]) -> None:
+        await asyncio.gather(
+            self.load_ids('persons', queries.PERSON_QUERY, PersonPipeline.persons_from_rows, ids),
+            self.update_films(queries.PERSON_FW_QUERY, queries.PERSON_NAMES_QUERY, FilmWorkPipeline.person_fields, ids),
+        )
+
+    async def genre_changed(self, ids: List[str]) -> None:
+        await asyncio.gather(
+            self.load_ids('genres', queries.GENRE_QUERY, GenrePipeline.genres_from_rows, ids),
+            self.update_films(queries.GENRE_FW_QUERY, queries.GENRE_NAMES_QUERY, FilmWorkPipeline.genre_fields, ids),
+        )
+
+    async def update_films(self, fw_query: str, names_query: str, fields: Tuple[str, ...], ids: List[str]) -> None:
+        """
+        Updates the films of changed persons or genres: with partial_updates their names are renamed
+        in place in the film documents, otherwise the films are rebuilt.
+
+        Parameters:
+            fw_query (str): The SQL query selecting the IDs of the films of the changed rows.
+            names_query (str): The SQL query selecting the id and the name of the changed rows.
+            fields (Tuple[str, ...]): The nested fields of the film documents holding the changed rows.
+            ids (List[str]): The IDs of the changed rows.
+        """
+        if self.partial_updates:
+            if names := {row['id']: row['name'] for row in await self.db_adapter.fetch(names_query, ids)}:
+                await self.es_loader.rename_nested('movies', fields, names)
+        else:
+            fw_ids = [row['id'] for row in await self.db_adapter.fetch(fw_query, ids)]
+            await self.load_ids('movies', self.fw_query, self.fw_transform, fw_ids)
+
+    async def load_ids(self, index: str, query: str, transform: Callable, ids: List[str]) -> None:
+        """
+        Queries documents by chunks of ETL_CHUNK_SIZE ids and loads them into an index. The chunks
+        are fetched by a producer task, so the next chunk is read while the current one is indexed.
+
+        Parameters:
+            index (str): The name of the Elasticsearch index to load data to.
+            query (str): The SQL query selecting the rows of the documents.
+            transform (Callable): The function mapping the rows to documents.
+            ids (List[str]): The IDs of the documents.
+        """
+        if not ids:
+            return
+
+        queue = asyncio.Queue(maxsize=1)
+
+        async def produce() -> None:
+            try:
+                for chunk_ids in chunked(ids, config.ETL_CHUNK_SIZE):
+                    if rows := await self.db_adapter.fetch(query, chunk_ids):
+                        await queue.put(rows)
+            except Exception:
+                # Wake the consumer up, the error is raised when the producer is awaited
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (rows := await queue.get()) is not None:
+                await self.es_loader.load_to_es([doc.as_dict for doc in transform(rows)], index)
+        except BaseException:
+            producer.cancel()
+            raise
+        await producer
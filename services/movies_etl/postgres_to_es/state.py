@@ -1,7 +1,14 @@
 import abc
+import fcntl
 import json
 import logging
-from typing import Any, Optional, Dict
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import redis
 
 module_logger = logging.getLogger('JsonFileStorage')
 
@@ -27,11 +34,54 @@ class BaseStorage(abc.ABC):
         """
         pass
 
+    def update_state(self, values: Dict[str, Any]) -> None:
+        """
+        Save some keys of the state at once, keeping the other keys of the storage.
+
+        Args:
+            values (Dict[str, Any]): The keys to save and their values.
+        """
+        state = self.retrieve_state()
+        state.update(values)
+        self.save_state(state)
+
 
 class JsonFileStorage(BaseStorage):
+    """
+    Keeps the state in a JSON file, replaced atomically on every save, so a crash
+    leaves either the previous or the new state. Updates are serialized by a lock
+    file, so several processes can share the file as long as they write their own keys.
+    """
+
     def __init__(self, file_path: Optional[str] = None):
         self.file_path = file_path
 
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        with open(f'{self.file_path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, state: Dict[str, Any]) -> None:
+        """
+        Write the state to a temporary file and rename it over the state file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.state-', delete=False) as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.file_path)
+        # The rename itself is durable once the directory is synced
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
     def save_state(self, state: Dict[str, Any]) -> None:
         """
         Save the state to a JSON file.
@@ -42,8 +92,23 @@ class JsonFileStorage(BaseStorage):
         if self.file_path is None:
             return
 
-        with open(self.file_path, 'w') as f:
-            json.dump(state, f)
+        with self._lock():
+            self._write(state)
+
+    def update_state(self, values: Dict[str, Any]) -> None:
+        """
+        Merge some keys into the JSON file under the lock.
+
+        Args:
+            values (Dict[str, Any]): The keys to save and their values.
+        """
+        if self.file_path is None:
+            return
+
+        with self._lock():
+            state = self.retrieve_state()
+            state.update(values)
+            self._write(state)
 
     def retrieve_state(self) -> Dict[str, Any]:
         """
@@ -62,5 +127,149 @@ class JsonFileStorage(BaseStorage):
             return data
         except FileNotFoundError:
             module_logger.warning('State file not found. Initializing with empty state.')
-            self.save_state({})
             return {}
+
+
+class SqliteStorage(BaseStorage):
+    """
+    Keeps the state in a SQLite database in WAL mode, one row per key. Every update
+    is one transaction, and readers never block the writer, so several processes
+    can share the database.
+    """
+
+    def __init__(self, file_path: str, timeout: float = 30):
+        self.file_path = file_path
+        self.timeout = timeout
+        with closing(self._connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.file_path, timeout=self.timeout)
+        connection.execute('PRAGMA synchronous=FULL')
+        return connection
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """
+        Replace the whole state in one transaction.
+
+        Args:
+            state (Dict[str, Any]): The state to save.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM state')
+            connection.executemany(
+                'INSERT INTO state (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in state.items()],
+            )
+
+    def update_state(self, values: Dict[str, Any]) -> None:
+        """
+        Upsert some keys in one transaction.
+
+        Args:
+            values (Dict[str, Any]): The keys to save and their values.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                'INSERT INTO state (key, value) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                [(key, json.dumps(value)) for key, value in values.items()],
+            )
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """
+        Retrieve the state from the database.
+
+        Returns:
+            Dict[str, Any]: The retrieved state.
+        """
+        with closing(self._connect()) as connection:
+            return {key: json.loads(value) for key, value in connection.execute('SELECT key, value FROM state')}
+
+
+class RedisStorage(BaseStorage):
+    """
+    Keeps the state in a Redis hash, one field per key. Updates are single HSET commands,
+    which Redis applies atomically, so any number of processes can share the hash.
+    """
+
+    def __init__(self, client: redis.Redis, key: str):
+        self.client = client
+        self.key = key
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """
+        Replace the whole hash in one transaction.
+
+        Args:
+            state (Dict[str, Any]): The state to save.
+        """
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.delete(self.key)
+        if state:
+            pipeline.hset(self.key, mapping={key: json.dumps(value) for key, value in state.items()})
+        pipeline.execute()
+
+    def update_state(self, values: Dict[str, Any]) -> None:
+        """
+        Set some fields of the hash at once.
+
+        Args:
+            values (Dict[str, Any]): The keys to save and their values.
+        """
+        if values:
+            self.client.hset(self.key, mapping={key: json.dumps(value) for key, value in values.items()})
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """
+        Retrieve the state from the hash.
+
+        Returns:
+            Dict[str, Any]: The retrieved state.
+        """
+        return {key.decode(): json.loads(value) for key, value in self.client.hgetall(self.key).items()}
+
+
+class State:
+    """
+    Class for storing the state while working with data, so that you don't
+    have to constantly re-read the data from the beginning.
+    """
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+        self.state = self.storage.retrieve_state()
+
+    def set_state(self, key: str, value: Any) -> None:
+        """
+        Set the state for a specific key and persist it.
+
+        Args:
+            key (str): The key of the state.
+            value (Any): The value to store.
+        """
+        self.set_states({key: value})
+
+    def set_states(self, values: Dict[str, Any]) -> None:
+        """
+        Set the state for several keys and persist them as one checkpoint.
+        Only these keys are written, so processes sharing the storage keep each other's keys.
+
+        Args:
+            values (Dict[str, Any]): The keys and the values to store.
+        """
+        self.state.update(values)
+        self.storage.update_state(values)
+
+    def get_state(self, key: str) -> Any:
+        """
+        Get the state for a specific key.
+
+        Args:
+            key (str): The key of the state.
+
+        Returns:
+            Any: The stored value or None if the key is absent.
+        """
+        return self.state.get(key)
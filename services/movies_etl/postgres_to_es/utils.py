@@ -1,17 +1,20 @@
+import asyncio
 import time
 import logging
 from functools import wraps
-from typing import Callable, Type, Any, Tuple
+from itertools import islice
+from typing import Callable, Type, Any, Generator, Iterable, List, Optional, Tuple
 
 def backoff(
     exceptions: Tuple[Type[Exception], ...],
     logger: logging.Logger,
     total_tries: int = 5,
     start_sleep_time: int = 1,
-    backoff_factor: int = 2
+    backoff_factor: int = 2,
+    retry_if: Optional[Callable[[Exception], bool]] = None,
 ) -> Callable:
     """
-    Retry decorator with exponential backoff.
+    Retry decorator with exponential backoff, for functions and coroutine functions.
 
     Args:
         exceptions (Tuple[Type[Exception], ...]): Exceptions to catch.
@@ -19,22 +22,47 @@ def backoff(
         total_tries (int): Total number of retry attempts.
         start_sleep_time (int): Initial sleep time between retries.
         backoff_factor (int): Factor by which the sleep time increases.
+        retry_if (Optional[Callable[[Exception], bool]]): Tells whether a caught exception is retried,
+            the others are raised at once. Every caught exception is retried by default.
 
     Returns:
         Callable: Decorated function with retry logic.
     """
+    def should_retry(error: Exception, attempt: int, delay: int) -> bool:
+        if retry_if is not None and not retry_if(error):
+            return False
+        if attempt == total_tries:
+            logger.exception('Retry: %d/%d failed. Raising exception.', attempt, total_tries)
+            return False
+        logger.exception('Retry: %d/%d failed. Retrying in %d seconds...', attempt, total_tries, delay)
+        return True
+
     def retry_decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_func_with_retry(*args: Any, **kwargs: Any) -> Any:
+                attempt, delay = 1, start_sleep_time
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except exceptions as e:
+                        if not should_retry(e, attempt, delay):
+                            raise
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        delay *= backoff_factor
+
+            return async_func_with_retry
+
         @wraps(func)
         def func_with_retry(*args: Any, **kwargs: Any) -> Any:
             attempt, delay = 1, start_sleep_time
-            while attempt <= total_tries:
+            while True:
                 try:
                     return func(*args, **kwargs)
                 except exceptions as e:
-                    if attempt == total_tries:
-                        logger.exception('Retry: %d/%d failed. Raising exception.', attempt, total_tries)
+                    if not should_retry(e, attempt, delay):
                         raise
-                    logger.exception('Retry: %d/%d failed. Retrying in %d seconds...', attempt, total_tries, delay)
                     time.sleep(delay)
                     attempt += 1
                     delay *= backoff_factor
@@ -60,4 +88,59 @@ def coroutine(func: Callable) -> Callable:
         next(coroutine_func)
         return coroutine_func
 
-    return inner
\ No newline at end of file
+    return inner
+
+
+def chunked(iterable: Iterable, size: int) -> Generator[List, None, None]:
+    """
+    Split an iterable into lists of at most `size` items.
+
+    Args:
+        iterable (Iterable): Items to split.
+        size (int): Maximum size of a chunk.
+
+    Returns:
+        Generator[List, None, None]: Generator of chunks.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class AdaptiveDelay:
+    """
+    Delay between two runs of the ETL, adapted to the amount of changes.
+
+    A run that hit the batch limit worked through a backlog, so the next run starts right away.
+    After a run with a few changes, the next one starts after the base delay. Every idle run
+    in a row doubles the delay, up to a ceiling.
+
+    Args:
+        delay (float): Base delay in seconds.
+        max_delay (float): Ceiling of the delay in seconds.
+        backoff_factor (float): Factor by which the delay increases after an idle run.
+    """
+
+    def __init__(self, delay: float, max_delay: float, backoff_factor: float = 2):
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+        self.backoff_factor = backoff_factor
+        self.idle_delay = delay
+
+    def next_delay(self, changed: int, hit_batch_limit: bool) -> float:
+        """
+        Return the delay before the next run.
+
+        Args:
+            changed (int): Number of changed rows processed by the last run.
+            hit_batch_limit (bool): Whether the last run got a full batch of changed rows.
+
+        Returns:
+            float: Delay in seconds.
+        """
+        if changed:
+            self.idle_delay = self.delay
+            return 0 if hit_batch_limit else self.delay
+        delay = self.idle_delay
+        self.idle_delay = min(self.idle_delay * self.backoff_factor, self.max_delay)
+        return delay